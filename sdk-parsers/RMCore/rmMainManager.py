@@ -16,6 +16,7 @@ from RMUtilsFramework.rmUtils import RMSingleton
 from RMUtilsFramework.rmLogging import log
 from RMUtilsFramework.rmThreadWatcher import RMThreadWatcher
 from RMUtilsFramework.rmCommandThread import RMCommand
+from RMUtilsFramework.rmScheduler import RMWakeupQueue
 
 class RMMainManager:
     __metaclass__ = RMSingleton
@@ -25,6 +26,8 @@ class RMMainManager:
     #
     instance = None
 
+    MaxWaitTime = 5 * 60 # The thread watcher expects an update at least every 7 minutes
+
     @staticmethod
     def createInstance():
         if RMMainManager.instance is None:
@@ -53,9 +56,15 @@ class RMMainManager:
 
         self.__sysUpgradeFilePath = None
 
-        self.__messageQueue = Queue.Queue()
+        self.__messageQueue = RMWakeupQueue() # sleeps until the next parser run or a command, no polling
         self.__alexaServer = None
 
+        self.wakeupStats = {
+            "deadline": 0,  # woke up because parsers were due
+            "command": 0,   # woke up by a command
+            "watchdog": 0   # woke up only to update the thread watcher
+        }
+
     def setup(self):
         if not os.path.exists(globalSettings.databasePath):
             try:
@@ -83,27 +92,28 @@ class RMMainManager:
 
         self.__parserThread = RMParserThread()
         self.__parserThread.start()
-
+        self.__parserThread.setScheduleListener(self.__parsersRescheduled)
 
         while not self.__stopRunning:
             RMThreadWatcher.instance.updateThread()
-            
-            if globalSettings.wizardHasRun:
-                self.__parserThread.run()
 
-            messageLoopTimestamp = int(time.time())
+            if globalSettings.wizardHasRun and self.__parserThread.isRunDue():
+                self.__parserThread.run()
 
             while True:
-                waitTime = 60 + messageLoopTimestamp - int(time.time())
+                waitTime, reason = self.__getWaitTime()
 
                 if waitTime <= 0:
                     break
 
                 try:
                     command = self.__messageQueue.get(True, waitTime)
+                    self.wakeupStats["command"] += 1
                     log.debug(command.name)
 
-                    if command.name == "savesettings":
+                    if command.name == "reschedule":
+                        break
+                    elif command.name == "savesettings":
                         globalSettings.saveSettings()
                         globalSettings.loadSettings()
                         break
@@ -162,6 +172,7 @@ class RMMainManager:
                         self.__restart = True
                         break
                 except Queue.Empty, e:
+                    self.wakeupStats[reason] += 1
                     break
 
         RMThreadWatcher.instance.stop()
@@ -172,6 +183,24 @@ class RMMainManager:
 
         self.__postRun()
 
+    def __getWaitTime(self):
+        ### Seconds until the next parser run, at most MaxWaitTime, and what ends the wait if no command arrives
+        nextRunTimestamp = None
+        if globalSettings.wizardHasRun:
+            nextRunTimestamp = self.__parserThread.getNextRunTimestamp()
+
+        if nextRunTimestamp is None:
+            return RMMainManager.MaxWaitTime, "watchdog"
+
+        waitTime = nextRunTimestamp - time.time()
+        if waitTime > RMMainManager.MaxWaitTime:
+            return RMMainManager.MaxWaitTime, "watchdog"
+        return waitTime, "deadline"
+
+    def __parsersRescheduled(self):
+        # Called from the thread that changed a parser, wakes up the loop to wait for the new deadline
+        self.__messageQueue.put_nowait(RMCommand("reschedule", False))
+
     def stop(self, shutdown = False):
         if shutdown:
             self.__messageQueue.put_nowait(RMCommand("shutdown", False))
@@ -3,23 +3,14 @@
 # Authors: Nicu Pavel <npavel@mini-box.com>
 #          Codrin Juravle <codrin.juravle@mini-box.com>
 
-from cStringIO import StringIO
-import pickle
+from rmParserUserData import rmEncodeToSQLite, rmDecodeFromSQLite
 
 def RMParserParams_adaptToSQLite(params):
     if params == None:
         return None
-
-    outputStream = StringIO()
-    pickler = pickle.Pickler(outputStream)
-    pickler.dump(params)
-    return outputStream.getvalue()
+    return rmEncodeToSQLite(params)
 
 def RMParserParams_convertFromSQLite(data):
     if data == None:
         return None
-
-    inputStream = StringIO(data)
-    unpickler = pickle.Unpickler(inputStream)
-    return unpickler.load()
-
+    return rmDecodeFromSQLite(data)
@@ -5,8 +5,39 @@
 
 
 from cStringIO import StringIO
-import pickle
+import pickle, json
 
+from RMUtilsFramework.rmJson import rmJsonParseString
+
+#-----------------------------------------------------------------------------------------------------------
+# Database encoding of userData and parser params: a version tag followed by compact JSON. Values that
+# were stored with pickle by older versions are still read, with an unpickler that only accepts
+# RMParserUserData and builtin containers.
+#
+RMEncodingVersionTag = "v1"
+
+def rmEncodeToSQLite(value):
+    return RMEncodingVersionTag + json.dumps(value, separators=(',', ':'))
+
+def rmDecodeFromSQLite(data):
+    if data.startswith(RMEncodingVersionTag):
+        return rmJsonParseString(data[len(RMEncodingVersionTag):])
+    return RMLegacyUnpickler(StringIO(data)).load()
+
+class RMLegacyUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if name == "RMParserUserData" and module.endswith("rmParserUserData"):
+            return RMParserUserData
+        if module == "copy_reg" and name == "_reconstructor":
+            import copy_reg
+            return copy_reg._reconstructor
+        if module == "__builtin__" and name == "object":
+            return object
+        raise pickle.UnpicklingError("Class %s.%s is not allowed in stored data" % (module, name))
+
+#-----------------------------------------------------------------------------------------------------------
+#
+#
 class RMParserUserDataTypeEntry:
     def __init__(self, id = None, name = None):
         self.id = id
@@ -19,8 +50,12 @@ class RMParserUserData(object):
     cachedIDs = {}      # id -> RMParserUserDataTypeEntry
     cachedNames = {}    # name -> RMParserUserDataTypeEntry
 
-    def __init__(self):
-        self.data = {}
+    def __init__(self, encoded = None):
+        ### When created from the database the values are decoded only on first access.
+        self.__encoded = encoded
+        self.__data = None
+        if encoded is None:
+            self.__data = {}
 
     def __repr__(self):
         text = ""
@@ -30,6 +65,35 @@ class RMParserUserData(object):
             text = text + `key` + "=" + `self.data[key]`
         return text
 
+    def __getstate__(self):
+        return {"data": self.data}
+
+    def __setstate__(self, state):
+        # Also used for the values pickled by older versions
+        self.__encoded = None
+        self.__data = state.get("data", {})
+
+    @property
+    def data(self):
+        if self.__data is None:
+            data = rmDecodeFromSQLite(self.__encoded)
+            if isinstance(data, RMParserUserData):
+                data = data.data
+            self.__data = dict((int(key), value) for key, value in data.iteritems()) # JSON keys are strings
+            self.__encoded = None
+        return self.__data
+
+    @data.setter
+    def data(self, value):
+        self.__encoded = None
+        self.__data = value
+
+    def getEncoded(self):
+        ### Database representation, the stored one is reused if the values were not accessed.
+        if self.__encoded is not None and self.__encoded.startswith(RMEncodingVersionTag):
+            return self.__encoded
+        return rmEncodeToSQLite(self.data)
+
     def setValue(self, key,  value):
         if key in RMParserUserData.cachedNames:
             self.data[RMParserUserData.cachedNames[key].id] = value
@@ -44,18 +108,42 @@ class RMParserUserData(object):
 def RMUserData_adaptToSQLite(userData):
     if userData == None:
         return None
-
-    outputStream = StringIO()
-    pickler = pickle.Pickler(outputStream)
-    pickler.dump(userData)
-    return outputStream.getvalue()
+    return userData.getEncoded()
 
 def RMUserData_convertFromSQLite(data):
     if data == None:
         return None
+    return RMParserUserData(data)
+
+
+#-----------------------------------------------------------------------------------------------------------
+# Main Test Unit
+#
+if __name__ == "__main__":
+    import time
+
+    userData = RMParserUserData()
+    userData.data = {1: "forecast for 2016-10-01", 2: 12.5, 3: 7}
+    count = 10000
+
+    def pickleEncode(value):
+        outputStream = StringIO()
+        pickle.Pickler(outputStream).dump(value)
+        return outputStream.getvalue()
 
-    inputStream = StringIO(data)
-    unpickler = pickle.Unpickler(inputStream)
-    return unpickler.load()
+    legacy = pickleEncode(userData).replace("c__main__\n", "cRMDataFramework.rmParserUserData\n") # as stored by older versions
+    encoded = RMUserData_adaptToSQLite(userData)
+    print "Encoded size: pickle %d bytes, %s %d bytes" % (len(legacy), RMEncodingVersionTag, len(encoded))
 
+    if RMUserData_convertFromSQLite(legacy).data != userData.data or RMUserData_convertFromSQLite(encoded).data != userData.data:
+        print "Decoded values don't match!"
 
+    for name, function, value in (("pickle encode", pickleEncode, userData),
+                                  ("pickle decode", lambda data: RMLegacyUnpickler(StringIO(data)).load(), legacy),
+                                  ("%s encode" % RMEncodingVersionTag, RMUserData_adaptToSQLite, userData),
+                                  ("%s decode" % RMEncodingVersionTag, lambda data: RMUserData_convertFromSQLite(data).data, encoded),
+                                  ("%s convert, not accessed" % RMEncodingVersionTag, RMUserData_convertFromSQLite, encoded)):
+        startTime = time.time()
+        for i in xrange(count):
+            function(value)
+        print "%s: %.2f us per value" % (name, (time.time() - startTime) * 1000000 / count)
@@ -104,6 +104,7 @@ class RMUserSettings:
         self.__defaultSettings = None
 
         self.databasePath = None
+        self.databaseWALMode = False # write ahead logging, read only queries don't wait behind the writes
         self.parserDataSizeInDays = 6
         self.parserHistorySize = 365
         self.mixerHistorySize = 365
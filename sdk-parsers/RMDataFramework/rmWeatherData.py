@@ -4,6 +4,7 @@
 #          Codrin Juravle <codrin.juravle@mini-box.com>
 
 
+import hashlib, json
 from datetime import datetime
 from RMUtilsFramework.rmLogging import log
 from rmParserUserData import RMParserUserData
@@ -201,3 +202,25 @@ class RMWeatherData:
         if self.userData == None:
             self.userData = RMParserUserData()
         self.userData.setValue(key, value)
+
+
+def rmWeatherDataDigest(values):
+    ### Digest of the timestamps and values of a parser result, independent of their order and of int/float
+    ### types, so a result identical to a previous one has the same digest.
+    def number(value):
+        if value is None:
+            return None
+        return float(value)
+
+    digest = hashlib.sha1()
+    for value in sorted(values, key=lambda value: value.timestamp):
+        userData = None
+        if value.userData is not None:
+            userData = json.dumps(value.userData.data, sort_keys=True)
+        digest.update(repr((int(value.timestamp),
+                            number(value.temperature), number(value.minTemperature), number(value.maxTemperature),
+                            number(value.rh), number(value.minRh), number(value.maxRh),
+                            number(value.wind), number(value.solarRad), number(value.skyCover), number(value.rain),
+                            number(value.et0), number(value.pop), number(value.qpf), value.condition,
+                            number(value.pressure), number(value.dewPoint), userData)))
+    return digest.hexdigest()
@@ -0,0 +1,274 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import sys
+from array import array
+from bisect import insort
+
+from RMUtilsFramework.rmLogging import log
+from rmWeatherData import RMWeatherData, RMWeatherDataType
+from rmParserUserData import RMParserUserData
+
+#-----------------------------------------------------------------------------------------------------------
+# Columnar storage for the values returned by a parser. Each RMWeatherDataType has its own column
+# (array of doubles plus a null mask, or a plain list for condition/userData) created on first use,
+# all sharing one row per hour. Rows are exposed as RMWeatherData views built on demand, and the
+# frame behaves like the {timestamp: RMWeatherData} dict that parsers used before.
+#
+class RMWeatherDataFrame(object):
+
+    # RMWeatherDataType -> RMWeatherData attribute
+    NumericColumns = {
+        RMWeatherDataType.TEMPERATURE: "temperature",
+        RMWeatherDataType.MINTEMP: "minTemperature",
+        RMWeatherDataType.MAXTEMP: "maxTemperature",
+        RMWeatherDataType.RH: "rh",
+        RMWeatherDataType.MINRH: "minRh",
+        RMWeatherDataType.MAXRH: "maxRh",
+        RMWeatherDataType.WIND: "wind",
+        RMWeatherDataType.SOLARRADIATION: "solarRad",
+        RMWeatherDataType.SKYCOVER: "skyCover",
+        RMWeatherDataType.RAIN: "rain",
+        RMWeatherDataType.ET0: "et0",
+        RMWeatherDataType.POP: "pop",
+        RMWeatherDataType.QPF: "qpf",
+        RMWeatherDataType.PRESSURE: "pressure",
+        RMWeatherDataType.DEWPOINT: "dewPoint",
+    }
+
+    ObjectColumns = {
+        RMWeatherDataType.CONDITION: "condition",
+        RMWeatherDataType.USERDATA: "userData",
+    }
+
+    NumericAttributes = frozenset(NumericColumns.values())
+    ObjectAttributes = frozenset(ObjectColumns.values())
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.__rows = {}            # hour timestamp -> row index
+        self.__hours = []           # sorted hour timestamps
+        self.__timestamps = []      # row index -> RMWeatherData.timestamp
+        self.__values = {}          # attribute -> array('d')
+        self.__nulls = {}           # attribute -> bytearray, 1 where the value is None
+        self.__objects = {}         # attribute -> list
+
+    #-------------------------------------------------------------------------------------------------------
+    #
+    # dict like interface
+    #
+    def __len__(self):
+        return len(self.__hours)
+
+    def __nonzero__(self):
+        return len(self.__hours) > 0
+
+    def __contains__(self, timestamp):
+        return timestamp in self.__rows
+
+    def __iter__(self):
+        return iter(list(self.__hours))
+
+    def __getitem__(self, timestamp):
+        return RMWeatherDataView(self, self.__rows[timestamp])
+
+    def __repr__(self):
+        return "{" + ", ".join(`timestamp` + ": " + `self[timestamp]` for timestamp in self.__hours) + "}"
+
+    def keys(self):
+        return list(self.__hours)
+
+    def values(self):
+        return [RMWeatherDataView(self, self.__rows[timestamp]) for timestamp in self.__hours]
+
+    def items(self):
+        return [(timestamp, RMWeatherDataView(self, self.__rows[timestamp])) for timestamp in self.__hours]
+
+    def get(self, timestamp, default = None):
+        row = self.__rows.get(timestamp)
+        if row is None:
+            return default
+        return RMWeatherDataView(self, row)
+
+    #-------------------------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def setValue(self, timestamp, key, value):
+        row = self.__row(timestamp)
+
+        if key == RMWeatherDataType.TIMESTAMP:
+            self.__timestamps[row] = int(value)
+            return
+
+        attribute = RMWeatherDataFrame.ObjectColumns.get(key)
+        if attribute is not None:
+            self.setAttribute(row, attribute, value)
+            return
+
+        attribute = RMWeatherDataFrame.NumericColumns.get(key)
+        if attribute is None:
+            return
+
+        # Same conversion as RMWeatherData.setValue(), missing values are common so skip the exception for them
+        if value is not None:
+            try:
+                if type(value) is str or type(value) is unicode:
+                    value = float(value)
+                value = round(value, 2)
+            except Exception, e:
+                log.debug("Can't convert value '%s' to proper category type(%s) because %s" % (value, key, e))
+                value = None
+
+        self.setAttribute(row, attribute, value)
+
+    def setUserValue(self, timestamp, key, value):
+        row = self.__row(timestamp)
+        userData = self.getAttribute(row, "userData")
+        if userData is None:
+            userData = RMParserUserData()
+            self.setAttribute(row, "userData", userData)
+        userData.setValue(key, value)
+
+    def getColumn(self, attribute):
+        ### Values of one attribute for all hours in timestamp order, None for missing values.
+        return [self.getAttribute(self.__rows[timestamp], attribute) for timestamp in self.__hours]
+
+    #-------------------------------------------------------------------------------------------------------
+    #
+    # Row level access used by RMWeatherDataView
+    #
+    def getTimestamp(self, row):
+        return self.__timestamps[row]
+
+    def setTimestamp(self, row, timestamp):
+        self.__timestamps[row] = timestamp
+
+    def getAttribute(self, row, attribute):
+        if attribute in RMWeatherDataFrame.NumericAttributes:
+            nulls = self.__nulls.get(attribute)
+            if nulls is None or nulls[row]:
+                return None
+            return self.__values[attribute][row]
+
+        column = self.__objects.get(attribute)
+        if column is None:
+            return None
+        return column[row]
+
+    def setAttribute(self, row, attribute, value):
+        if attribute in RMWeatherDataFrame.NumericAttributes:
+            nulls = self.__nulls.get(attribute)
+            if nulls is None:
+                if value is None:
+                    return
+                nulls = self.__nulls[attribute] = bytearray('\x01') * len(self.__timestamps)
+                self.__values[attribute] = array('d', [0.0]) * len(self.__timestamps)
+
+            if value is None:
+                nulls[row] = 1
+            else:
+                self.__values[attribute][row] = value
+                nulls[row] = 0
+        else:
+            column = self.__objects.get(attribute)
+            if column is None:
+                if value is None:
+                    return
+                column = self.__objects[attribute] = [None] * len(self.__timestamps)
+            column[row] = value
+
+    def __row(self, timestamp):
+        row = self.__rows.get(timestamp)
+        if row is None:
+            row = self.__rows[timestamp] = len(self.__timestamps)
+            self.__timestamps.append(timestamp)
+            if not self.__hours or self.__hours[-1] < timestamp:
+                self.__hours.append(timestamp)
+            else:
+                insort(self.__hours, timestamp)
+
+            for attribute in self.__values:
+                self.__values[attribute].append(0.0)
+                self.__nulls[attribute].append(1)
+            for attribute in self.__objects:
+                self.__objects[attribute].append(None)
+        return row
+
+#-----------------------------------------------------------------------------------------------------------
+# RMWeatherData compatible view over one row of a RMWeatherDataFrame. Attributes are read from
+# and written to the frame columns.
+#
+class RMWeatherDataView(RMWeatherData):
+    def __init__(self, frame, row):
+        self.__dict__["_frame"] = frame
+        self.__dict__["_row"] = row
+        self.__dict__["useCounters"] = False
+
+    def __getattr__(self, name):
+        if name == "timestamp":
+            return self._frame.getTimestamp(self._row)
+        if name in RMWeatherDataFrame.NumericAttributes or name in RMWeatherDataFrame.ObjectAttributes:
+            return self._frame.getAttribute(self._row, name)
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name == "timestamp":
+            self._frame.setTimestamp(self._row, value)
+        elif name in RMWeatherDataFrame.NumericAttributes or name in RMWeatherDataFrame.ObjectAttributes:
+            self._frame.setAttribute(self._row, name, value)
+        else:
+            self.__dict__[name] = value
+
+
+#-----------------------------------------------------------------------------------------------------------
+# Main Test Unit
+#
+if __name__ == "__main__":
+    import random, time, gc, logging
+    log.setLevel(logging.INFO)
+
+    keys = RMWeatherDataFrame.NumericColumns.keys() + [RMWeatherDataType.CONDITION]
+    hours = [1500000000 + hour * 3600 for hour in range(240)] # MOSMIX_L like series
+    random.seed(1)
+    samples = [(key, [(hour, random.choice([None, "12.345", random.uniform(-10, 40)])) for hour in hours]) for key in keys]
+
+    def fillDict():
+        result = {}
+        for key, values in samples:
+            for timestamp, value in values:
+                if timestamp not in result:
+                    result[timestamp] = RMWeatherData(timestamp)
+                result[timestamp].setValue(key, value)
+        return result
+
+    def fillFrame():
+        result = RMWeatherDataFrame()
+        for key, values in samples:
+            for timestamp, value in values:
+                result.setValue(timestamp, key, value)
+        return result
+
+    oldResult = fillDict()
+    newResult = fillFrame()
+    for timestamp in hours:
+        if oldResult[timestamp].toString() != newResult[timestamp].toString():
+            print "Mismatch for %d: %s != %s" % (timestamp, oldResult[timestamp], newResult[timestamp])
+            break
+    else:
+        print "Frame matches RMWeatherData for %d hours" % len(hours)
+
+    for name, fill in (("dict of RMWeatherData", fillDict), ("RMWeatherDataFrame", fillFrame)):
+        gc.collect()
+        startTime = time.time()
+        for i in range(100):
+            fill()
+        print "%s: %.2f ms per parser result" % (name, (time.time() - startTime) * 10)
+
+    rowSize = sum(sys.getsizeof(value) for value in oldResult[hours[0]].__dict__.values()) + sys.getsizeof(oldResult[hours[0]].__dict__)
+    print "RMWeatherData row: ~%d bytes, frame row: ~%d bytes" % (rowSize, 8 * len(RMWeatherDataFrame.NumericColumns) + len(RMWeatherDataFrame.NumericColumns) + 3 * 8)
@@ -0,0 +1,133 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Forecast accuracy on a synthetic history: one run per day for 150 days, each with 7 days of hourly values.
+# The values for the run day are the observed weather. One parser forecasts it exactly, the other one adds
+# to each forecasted day an error drawn from a normal distribution that depends on the lead time:
+#  - the stored MAE, bias and RMSE must be the ones of the errors that were drawn, for the observed days
+#  - they must match the distributions the errors were drawn from
+#
+
+import sys, math, random
+sys.path.append('../')
+
+import rmDatabase, rmParserDataTable
+from rmDatabase import *
+from rmForecastInfoTable import *
+from rmParserDataTable import *
+
+from RMUtilsFramework.rmTimeUtils import rmDeltaDayFromTimestamp
+from RMDataFramework.rmWeatherData import RMWeatherData
+
+rmDatabase.USE_COMMAND_THREAD__ = False
+
+random.seed(1)
+failed = False
+
+parserDatabase = RMParsersDatabase(":memory:")
+parserDatabase.open()
+
+parserTable = RMParserTable(parserDatabase)
+forecastTable = RMForecastTable(parserDatabase)
+parserDataTable = RMParserDataTable(parserDatabase)
+
+exactParserID = parserTable.addParser("exact.py", "Exact", True)[0].dbID
+parserID = parserTable.addParser("noisy.py", "Noisy", True)[0].dbID
+
+# Temperature error distribution by lead time, rh has twice the error of temperature
+def bias(lead):
+    return 0.4 * lead
+
+def sigma(lead):
+    return 0.5 + 0.3 * lead
+
+# History compaction runs on the days before the current day, which moves with the runs
+currentDayTimestamp = None
+rmParserDataTable.rmCurrentDayTimestamp = lambda: currentDayTimestamp
+
+startTimestamp = 1420070400 # 2015-01-01
+days = 150
+observed = {} # hour timestamp: (temperature, rh)
+errors = {}   # (dayTimestamp, lead): temperature error
+for day in range(days):
+    dayTimestamp = currentDayTimestamp = rmDeltaDayFromTimestamp(startTimestamp, day)
+    forecast = forecastTable.addRecord(dayTimestamp + 3600)
+
+    exactValues = []
+    values = []
+    for lead in range(7):
+        forecastDayTimestamp = rmDeltaDayFromTimestamp(dayTimestamp, lead)
+        error = 0
+        if lead > 0:
+            error = errors[(forecastDayTimestamp, lead)] = random.gauss(bias(lead), sigma(lead))
+
+        for hour in range(24):
+            timestamp = forecastDayTimestamp + hour * 3600
+            if not timestamp in observed:
+                observed[timestamp] = (15 + 10 * math.sin(timestamp / 86400.0 * 2 * math.pi) + random.uniform(-3, 3), random.uniform(30, 90))
+            temperature, rh = observed[timestamp]
+
+            value = RMWeatherData(timestamp)
+            value.temperature = temperature
+            value.rh = rh
+            exactValues.append(value)
+
+            value = RMWeatherData(timestamp)
+            value.temperature = temperature + error
+            value.rh = rh + 2 * error
+            values.append(value)
+
+    for id, parserValues in ((exactParserID, exactValues), (parserID, values)):
+        parserDataTable.removeEntriesWithParserIdAndTimestamp(id, parserValues)
+        parserDataTable.addRecords(forecast.id, id, parserValues)
+
+accuracy = parserDataTable.accuracyTable.getRecords(parserID)
+observedDays = set(row[0] for row in parserDatabase.execute("SELECT timestamp FROM parserData WHERE parserID=? AND archived=1", (parserID, )))
+
+print "%d observed days, %d pending forecast values" % (len(observedDays), parserDatabase.execute("SELECT COUNT(*) FROM parserForecastPending").fetchone()[0])
+print "lead  count      MAE     bias     RMSE   expected bias     RMSE"
+for lead in range(1, 7):
+    leadErrors = [error for (dayTimestamp, errorLead), error in errors.items() if errorLead == lead and dayTimestamp in observedDays]
+    count = len(leadErrors)
+    expected = {
+        "count": count,
+        "mae": sum(abs(error) for error in leadErrors) / count,
+        "bias": sum(leadErrors) / count,
+        "rmse": math.sqrt(sum(error * error for error in leadErrors) / count)
+    }
+
+    temperature = accuracy["temperature"][lead]
+    print "%4d %6d %8.3f %8.3f %8.3f        %8.3f %8.3f" % (lead, temperature["count"], temperature["mae"], temperature["bias"], temperature["rmse"],
+                                                          bias(lead), math.sqrt(bias(lead) ** 2 + sigma(lead) ** 2))
+
+    # The errors that were drawn
+    rh = accuracy["rh"][lead]
+    for name in expected:
+        if abs(temperature[name] - expected[name]) > 1e-6 or abs(rh[name] - (expected[name] if name == "count" else 2 * expected[name])) > 1e-6:
+            print "lead %d: %s differs from the drawn errors" % (lead, name)
+            failed = True
+
+    # The distributions they were drawn from
+    if abs(temperature["bias"] - bias(lead)) > 4 * sigma(lead) / math.sqrt(count) or \
+       abs(temperature["rmse"] - math.sqrt(bias(lead) ** 2 + sigma(lead) ** 2)) > 0.2 * math.sqrt(bias(lead) ** 2 + sigma(lead) ** 2):
+        print "lead %d: errors don't match their distribution" % lead
+        failed = True
+
+if 0 in accuracy["temperature"]:
+    print "the observed forecast was compared with itself"
+    failed = True
+
+for field, leads in parserDataTable.accuracyTable.getRecords(exactParserID).items():
+    for lead, statistics in leads.items():
+        if statistics["mae"] > 1e-9 or statistics["rmse"] > 1e-9:
+            print "exact parser has %s errors at lead %d" % (field, lead)
+            failed = True
+
+if parserDataTable.accuracyTable.getRecordsByLead("temperature", 3).keys() != [exactParserID, parserID]:
+    print "getRecordsByLead is missing parsers"
+    failed = True
+
+print "FAILED" if failed else "OK"
@@ -0,0 +1,129 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Downsampled parser and mixer series on a temporary database with a year of hourly values for 5 parsers,
+# saved as one forecast each day with the next 7 days (the newest forecast wins each timestamp) and a year
+# of daily mixer values:
+#  - each mode must return the same points as rmDownsample() on the full series read with getLatestRecordsByParserID()
+#    and getLastRecordsByThreshold()
+#  - benchmark: full series read and built in Python against the downsampled query, for 500 points
+#
+
+import sys, time, random, shutil, tempfile, logging
+sys.path.append('../')
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmCommandThread import RMCommandThread
+from RMUtilsFramework.rmDownsample import rmDownsample, RMDownsampleModes
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMDataFramework.rmMixerData import RMMixerData
+from RMDataFramework.rmUserSettings import globalSettings
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmForecastInfoTable import RMForecastTable
+from RMDatabaseFramework.rmParserDataTable import RMParserTable, RMParserDataTable
+from RMDatabaseFramework.rmMixerDataTable import RMMixerDataTable
+
+log.setLevel(logging.CRITICAL)
+
+databasePath = tempfile.mkdtemp()
+globalSettings.databasePath = databasePath
+RMCommandThread.createInstance()
+globalDbManager.initialize(databasePath)
+
+parserTable = RMParserTable(globalDbManager.parserDatabase)
+forecastTable = RMForecastTable(globalDbManager.parserDatabase)
+parserDataTable = RMParserDataTable(globalDbManager.parserDatabase)
+mixerDataTable = RMMixerDataTable(globalDbManager.mixerDatabase)
+
+startTimestamp = 1420070400 # 2015-01-01
+days = 365
+parsers = 5
+threshold = 500
+rng = random.Random(1)
+
+def hourlyValues(dayTimestamp, parserIndex, forecastIndex):
+    values = []
+    for hour in range(7 * 24):
+        timestamp = dayTimestamp + hour * 3600
+        values.append(RMWeatherData(timestamp))
+        values[-1].temperature = round(10 + 10 * rng.random() + parserIndex + forecastIndex % 3, 2)
+        values[-1].rh = round(rng.uniform(30, 95), 1)
+        values[-1].qpf = rng.choice([0.0, 0.0, 0.0, round(rng.uniform(0, 5), 2)])
+    return values
+
+parserIDs = []
+for index in range(parsers):
+    parserConfig, isNew = parserTable.addParser("downsample%d.py" % index, "Downsample %d" % index, True)
+    parserIDs.append(parserConfig.dbID)
+
+for day in range(days):
+    dayTimestamp = startTimestamp + day * 86400
+    forecast = forecastTable.addRecord()
+    for index, parserID in enumerate(parserIDs):
+        parserDataTable.addRecords(forecast.id, parserID, hourlyValues(dayTimestamp, index, day))
+
+    mixerData = RMMixerData(dayTimestamp)
+    mixerData.temperature = rng.uniform(5, 30)
+    mixerData.et0final = rng.uniform(0, 8)
+    mixerData.qpf = rng.choice([None, 0.0, rng.uniform(0, 10)])
+    mixerDataTable.addRecords(forecast.id, dayTimestamp, [mixerData])
+
+minTimestamp = startTimestamp
+maxTimestamp = startTimestamp + days * 86400
+failed = False
+
+#-----------------------------------------------------------------------------------------------------------
+# Same points as the full series downsampled in Python
+#
+def parserSeries(parserID, field):
+    values = parserDataTable.getLatestRecordsByParserID(parserID, minTimestamp, maxTimestamp)
+    return [(value.timestamp, getattr(value, field)) for value in values if getattr(value, field) is not None]
+
+def mixerSeries(field):
+    values = mixerDataTable.getLastRecordsByThreshold(minTimestamp, maxTimestamp - 1)
+    return [(value.timestamp, getattr(value, field)) for value in values if getattr(value, field) is not None]
+
+for mode in RMDownsampleModes:
+    for field in ("temperature", "qpf"):
+        series = parserSeries(parserIDs[0], field)
+        if parserDataTable.getDownsampledRecordsByParserID(parserIDs[0], field, minTimestamp, maxTimestamp, threshold, mode) != \
+           rmDownsample(series, len(series), threshold, mode):
+            print "parser %s %s: different points" % (field, mode)
+            failed = True
+
+    for field in ("et0final", "qpf"):
+        series = mixerSeries(field)
+        if mixerDataTable.getDownsampledRecords(field, minTimestamp, maxTimestamp, 100, mode) != rmDownsample(series, len(series), 100, mode):
+            print "mixer %s %s: different points" % (field, mode)
+            failed = True
+
+if parserDataTable.getDownsampledRecordsByParserID(parserIDs[0], "temperature; DROP TABLE parserData", None, None, threshold) is not None:
+    print "unknown field accepted"
+    failed = True
+
+#-----------------------------------------------------------------------------------------------------------
+# Benchmark
+#
+runs = 3
+def timed(function):
+    startTime = time.time()
+    for run in range(runs):
+        result = function()
+    return (time.time() - startTime) * 1000 / runs, len(result)
+
+points = len(parserSeries(parserIDs[0], "temperature"))
+print "%d parsers, %d hourly points each, temperature" % (parsers, points)
+
+elapsed, count = timed(lambda: [parserSeries(parserID, "temperature") for parserID in parserIDs][0])
+print "  %-40s %8.1f ms  %5d points" % ("getLatestRecordsByParserID, all parsers", elapsed, count)
+for mode in RMDownsampleModes:
+    elapsed, count = timed(lambda: [parserDataTable.getDownsampledRecordsByParserID(parserID, "temperature", minTimestamp, maxTimestamp, threshold, mode)
+                                    for parserID in parserIDs][0])
+    print "  %-40s %8.1f ms  %5d points" % ("downsampled %s, all parsers" % mode, elapsed, count)
+
+RMCommandThread.instance.stop()
+shutil.rmtree(databasePath)
+print "FAILED" if failed else "OK"
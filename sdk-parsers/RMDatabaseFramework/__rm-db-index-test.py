@@ -0,0 +1,129 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Checks that the hot parserData and mixerData queries don't scan the whole table and
+# benchmarks them with and without indexes on a year of hourly data.
+#
+
+import sys, re, random
+sys.path.append('../')
+
+import rmDatabase
+from rmDatabase import *
+from rmForecastInfoTable import *
+from rmParserDataTable import *
+from rmMixerDataTable import *
+
+import time
+
+rmDatabase.USE_COMMAND_THREAD__ = False
+
+#-----------------------------------------------------------------------------------------------------------
+# A year of hourly data, one forecast per day with 10 days of values for 5 parsers.
+#
+parserDatabase = RMParsersDatabase(":memory:")
+parserDatabase.open()
+mixerDatabase = RMMixerDatabase(":memory:")
+mixerDatabase.open()
+
+parserTable = RMParserTable(parserDatabase)
+forecastTable = RMForecastTable(parserDatabase)
+parserDataTable = RMParserDataTable(parserDatabase)
+mixerDataTable = RMMixerDataTable(mixerDatabase)
+
+parserIDs = range(1, 6)
+for parserID in parserIDs:
+    parserTable.addParser("parser%d.py" % parserID, "Parser %d" % parserID, True)
+
+random.seed(1)
+startTimestamp = 1420070400 # 2015-01-01
+days = 365
+for day in range(days):
+    forecast = forecastTable.addRecord(startTimestamp + day * 86400)
+    hours = [startTimestamp + day * 86400 + hour * 3600 for hour in range(240)]
+
+    parserDatabase.executeMany("INSERT INTO parserData(forecastID, parserID, timestamp, temperature, rh, qpf) VALUES(?, ?, ?, ?, ?, ?)",
+                               [(forecast.id, parserID, timestamp, random.uniform(-5, 35), random.uniform(20, 100), random.uniform(0, 2))
+                                for parserID in parserIDs for timestamp in hours])
+    mixerDatabase.executeMany("INSERT INTO mixerData(forecastID, forecastTimestamp, timestamp, temperature, et0, qpf, condition) VALUES(?, ?, ?, ?, ?, ?, ?)",
+                              [(forecast.id, forecast.timestamp, timestamp, random.uniform(-5, 35), random.uniform(0, 8), random.uniform(0, 2), random.choice([None, 1]))
+                               for timestamp in hours])
+parserDatabase.commit()
+mixerDatabase.commit()
+
+dayTimestamp = startTimestamp + 200 * 86400
+parserQueries = [
+    ("getMinMax", "SELECT f.timestamp, pd.timestamp, pd.temperature, pd.minTemperature, pd.maxTemperature, pd.rh, pd.minRh, pd.maxRh "\
+                  "FROM forecast f, parserData pd "\
+                  "WHERE pd.parserID=? AND ?<=pd.timestamp AND pd.timestamp<=? AND pd.forecastID=f.ID ORDER BY pd.forecastID DESC",
+                  (3, dayTimestamp - 2 * 86400, dayTimestamp + 2 * 86400)),
+    ("getRecordsByParserID", "SELECT f.timestamp, f.processed, pd.* FROM forecast f, parserData pd "\
+                             "WHERE pd.parserID==? AND f.id == pd.forecastID AND ?<=pd.timestamp AND pd.timestamp<? "\
+                             "ORDER BY f.id DESC, pd.timestamp ASC", (3, dayTimestamp, dayTimestamp + 86400)),
+    ("history compaction range", "SELECT f.ID, f.timestamp, p.rowid, p.timestamp, p.temperature, p.rh, p.wind, p.solarRad, p.skyCover, p.rain, p.et0, p.pop, p.qpf, p.condition, p.pressure, p.dewPoint, p.archived "\
+                                 "FROM parserData p, forecast f WHERE f.ID=p.forecastID AND p.parserID=? AND ?<=p.timestamp AND p.timestamp<? ORDER BY p.timestamp DESC, p.forecastID DESC",
+                                 (3, dayTimestamp, dayTimestamp + 10 * 86400)),
+    ("history compaction watermark", "SELECT MIN(timestamp), MAX(timestamp) FROM parserData WHERE forecastID>? AND +parserID=?", (days - 2, 3)),
+    ("removeEntriesWithParserIdAndTimestamp", "DELETE FROM parserData WHERE parserID=? AND timestamp>=?", (3, dayTimestamp)),
+    ("deleteRecordsByTimestampThreshold", "DELETE FROM parserData WHERE parserID=? AND (timestamp<? OR ?<timestamp)", (3, dayTimestamp, dayTimestamp + 86400)),
+]
+
+mixerQueries = [
+    ("getLastRecordsByThreshold", "SELECT MAX(forecastID), * FROM mixerData WHERE ?<=timestamp AND timestamp<=? GROUP BY timestamp ORDER BY timestamp ASC",
+                                  (dayTimestamp, dayTimestamp + 7 * 86400)),
+    ("getLastRecordsByThreshold min", "SELECT MAX(forecastID), * FROM mixerData WHERE ?<=timestamp GROUP BY timestamp ORDER BY timestamp DESC LIMIT 24",
+                                      (dayTimestamp, )),
+    ("getLastRecordForDayForSimulator", "SELECT * FROM mixerData WHERE ?<=timestamp AND timestamp<? GROUP BY timestamp ORDER BY forecastID DESC LIMIT 1",
+                                        (dayTimestamp, dayTimestamp + 86400)),
+    ("getLastKnownConditionForDay", "SELECT condition FROM mixerData WHERE ?<=timestamp AND timestamp<? AND condition IS NOT NULL ORDER BY forecastID DESC, forecastTimestamp DESC LIMIT 1",
+                                    (dayTimestamp, dayTimestamp + 86400)),
+    ("getRecordsByThreshold", "SELECT * FROM mixerData WHERE ?<=timestamp AND timestamp<? ORDER BY timestamp ASC", (dayTimestamp, dayTimestamp + 86400)),
+    ("deleteRecordsByDayThreshold", "DELETE FROM mixerData WHERE timestamp<?", (startTimestamp + 86400, )),
+]
+
+#-----------------------------------------------------------------------------------------------------------
+# Query plans: parserData and mixerData may only be searched or scanned through an index.
+#
+fullScan = re.compile(r"^SCAN (TABLE )?(parserData|mixerData)( AS \w+)?$")
+
+failed = 0
+for database, queries in ((parserDatabase, parserQueries), (mixerDatabase, mixerQueries)):
+    for name, query, params in queries:
+        plan = [row[3] for row in database.execute("EXPLAIN QUERY PLAN " + query, params)]
+        scans = [detail for detail in plan if fullScan.match(detail)]
+        if scans:
+            failed += 1
+        print "%-40s %s  %s" % (name, "FULL SCAN" if scans else "ok", " | ".join(plan))
+
+print "Query plans: %d of %d hot queries scan a whole table" % (failed, len(parserQueries) + len(mixerQueries))
+
+#-----------------------------------------------------------------------------------------------------------
+# Benchmark of the read queries with and without the indexes.
+#
+def benchmark(database, queries, count = 20):
+    results = {}
+    for name, query, params in queries:
+        if query.startswith("DELETE"):
+            continue
+        startTime = time.time()
+        for i in range(count):
+            database.execute(query, params).fetchall()
+        results[name] = (time.time() - startTime) * 1000 / count
+    return results
+
+indexed = benchmark(parserDatabase, parserQueries)
+indexed.update(benchmark(mixerDatabase, mixerQueries))
+
+parserDatabase.execute("DROP INDEX parserData_parserID_timestamp_forecastID")
+mixerDatabase.execute("DROP INDEX mixerData_timestamp_forecastID")
+
+notIndexed = benchmark(parserDatabase, parserQueries)
+notIndexed.update(benchmark(mixerDatabase, mixerQueries))
+
+print "%d parserData rows, %d mixerData rows" % (parserDatabase.execute("SELECT COUNT(*) FROM parserData").fetchone()[0],
+                                                  mixerDatabase.execute("SELECT COUNT(*) FROM mixerData").fetchone()[0])
+for name in sorted(indexed):
+    print "%-40s %8.2f ms without indexes %8.2f ms with indexes" % (name, notIndexed[name], indexed[name])
@@ -0,0 +1,183 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Daily, weekly and monthly rollups of parserData and mixerData:
+#  - 60 days of daily parser runs, saved like RMParserManager does, with history compaction: the consistency
+#    checker must find no differences and the compacted days keep their hourly statistics
+#  - benchmark: rollup reads against aggregation of the raw rows on 3 years of hourly data
+#
+
+import sys, random
+sys.path.append('../')
+
+import rmDatabase, rmParserDataTable
+from rmDatabase import *
+from rmForecastInfoTable import *
+from rmParserDataTable import *
+from rmMixerDataTable import *
+
+import time
+
+from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay, rmGetStartOfMonth, rmDeltaDayFromTimestamp
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMDataFramework.rmMixerData import RMMixerData
+
+rmDatabase.USE_COMMAND_THREAD__ = False
+
+random.seed(1)
+failed = False
+
+#-----------------------------------------------------------------------------------------------------------
+# Incremental rollups: one run per day for 3 parsers, each with 7 days of hourly values
+#
+parserDatabase = RMParsersDatabase(":memory:")
+parserDatabase.open()
+mixerDatabase = RMMixerDatabase(":memory:")
+mixerDatabase.open()
+
+parserTable = RMParserTable(parserDatabase)
+forecastTable = RMForecastTable(parserDatabase)
+parserDataTable = RMParserDataTable(parserDatabase)
+mixerDataTable = RMMixerDataTable(mixerDatabase)
+
+parserIDs = []
+for index in range(3):
+    parserConfig, isNew = parserTable.addParser("rollup%d.py" % index, "Rollup %d" % index, True)
+    parserIDs.append(parserConfig.dbID)
+
+# History compaction runs on the days before the current day, which moves with the runs
+currentDayTimestamp = None
+rmParserDataTable.rmCurrentDayTimestamp = lambda: currentDayTimestamp
+
+startTimestamp = 1420070400 # 2015-01-01
+hourly = {} # parserID: {day: {timestamp: temperature of the last run with that day}}
+for day in range(60):
+    dayTimestamp = currentDayTimestamp = rmDeltaDayFromTimestamp(startTimestamp, day)
+    forecast = forecastTable.addRecord(dayTimestamp + 3600)
+
+    for parserID in parserIDs:
+        values = []
+        for hour in range(7 * 24):
+            value = RMWeatherData(dayTimestamp + hour * 3600)
+            value.temperature = round(random.gauss(15 + parserID, 5), 2)
+            value.rh = round(random.uniform(20, 100), 2)
+            value.qpf = random.choice([None, 0, 1.5])
+            values.append(value)
+
+            hourly.setdefault(parserID, {}).setdefault(rmGetStartOfDay(value.timestamp), {})[value.timestamp] = value.temperature
+
+        parserDataTable.removeEntriesWithParserIdAndTimestamp(parserID, values)
+        parserDataTable.addRecords(forecast.id, parserID, values)
+
+    mixerValues = []
+    for offset in range(7):
+        mixerData = RMMixerData(rmDeltaDayFromTimestamp(dayTimestamp, offset))
+        mixerData.temperature = round(random.uniform(5, 30), 2)
+        mixerData.et0final = round(random.uniform(0, 8), 2)
+        mixerData.qpf = random.choice([None, 0.0, 4.2])
+        mixerValues.append(mixerData)
+    mixerDataTable.addRecords(forecast.id, forecast.timestamp, mixerValues)
+    mixerDataTable.deleteRecordsHistoryByDayThreshold(dayTimestamp, False)
+
+for parserID in parserIDs:
+    if parserDataTable.rollupTable.verify(parserID):
+        print "parser %d: rollups differ from the raw rows" % parserID
+        failed = True
+
+    # Days compacted to a single row must keep the statistics of their hourly values
+    days = parserDataTable.rollupTable.getRecords(parserID, "day")
+    archived = parserDatabase.execute("SELECT timestamp, temperature FROM parserData WHERE parserID=? AND archived=1", (parserID, )).fetchall()
+    for row in archived:
+        temperatures = hourly[parserID][row[0]].values()
+        rollup = days[row[0]]["temperature"]
+        if rollup["count"] != len(temperatures) or abs(rollup["min"] - min(temperatures)) > 1e-9 or abs(rollup["max"] - max(temperatures)) > 1e-9 or \
+           abs(rollup["mean"] - row[1]) > 0.0051:
+            print "parser %d: compacted day %d lost its statistics" % (parserID, row[0])
+            failed = True
+            break
+
+    months = parserDataTable.rollupTable.getRecords(parserID, "month")
+    expected = {}
+    for dayTimestamp, temperatures in hourly[parserID].items():
+        expected[rmGetStartOfMonth(dayTimestamp)] = expected.get(rmGetStartOfMonth(dayTimestamp), 0) + len(temperatures)
+    if dict((timestamp, values["temperature"]["count"]) for timestamp, values in months.items()) != expected:
+        print "parser %d: monthly counts differ" % parserID
+        failed = True
+
+print "%d archived days, %d parserData rows" % (len(archived), parserDatabase.execute("SELECT COUNT(*) FROM parserData").fetchone()[0])
+
+if mixerDataTable.rollupTable.verify(RMMixerDataRollupTable.SourceID):
+    print "mixer: rollups differ from the raw rows"
+    failed = True
+
+parserDataTable.deleteRecordsByParser(parserIDs[0])
+if parserDataTable.rollupTable.getRecords(parserIDs[0], "week"):
+    print "rollups of a deleted parser are kept"
+    failed = True
+
+#-----------------------------------------------------------------------------------------------------------
+# Benchmark: 3 years of hourly values for 5 parsers
+#
+parserDatabase = RMParsersDatabase(":memory:")
+parserDatabase.open()
+parserTable = RMParserTable(parserDatabase)
+forecastTable = RMForecastTable(parserDatabase)
+parserDataTable = RMParserDataTable(parserDatabase)
+
+parserIDs = range(1, 6)
+for parserID in parserIDs:
+    parserTable.addParser("parser%d.py" % parserID, "Parser %d" % parserID, True)
+
+days = 3 * 365
+for day in range(days):
+    forecast = forecastTable.addRecord(startTimestamp + day * 86400)
+    parserDatabase.executeMany("INSERT INTO parserData(forecastID, parserID, timestamp, temperature, rh, qpf) VALUES(?, ?, ?, ?, ?, ?)",
+                               [(forecast.id, parserID, startTimestamp + day * 86400 + hour * 3600,
+                                 random.uniform(-5, 35), random.uniform(20, 100), random.uniform(0, 2))
+                                for parserID in parserIDs for hour in range(24)])
+parserDatabase.commit()
+
+startTime = time.time()
+for parserID in parserIDs:
+    parserDataTable.rollupTable.rebuild(parserID)
+rebuildTime = time.time() - startTime
+
+def rawMonthly(parserID):
+    return parserDatabase.execute("SELECT strftime('%Y-%m', timestamp, 'unixepoch', 'localtime') month, COUNT(temperature), SUM(temperature), MIN(temperature), MAX(temperature) "\
+                                  "FROM (SELECT timestamp, MAX(forecastID), temperature FROM parserData WHERE parserID=? GROUP BY timestamp) GROUP BY month",
+                                  (parserID, )).fetchall()
+
+def rawDaily(parserID, minTimestamp, maxTimestamp):
+    return parserDatabase.execute("SELECT strftime('%Y-%m-%d', timestamp, 'unixepoch', 'localtime') day, COUNT(temperature), SUM(temperature), MIN(temperature), MAX(temperature) "\
+                                  "FROM (SELECT timestamp, MAX(forecastID), temperature FROM parserData WHERE parserID=? AND ?<=timestamp AND timestamp<? GROUP BY timestamp) GROUP BY day",
+                                  (parserID, minTimestamp, maxTimestamp)).fetchall()
+
+def benchmark(function, count = 5):
+    startTime = time.time()
+    for i in range(count):
+        for parserID in parserIDs:
+            function(parserID)
+    return (time.time() - startTime) * 1000 / count
+
+lastMonth = startTimestamp + (days - 30) * 86400
+endTimestamp = startTimestamp + days * 86400
+queries = [
+    ("monthly, 3 years", rawMonthly, lambda parserID: parserDataTable.rollupTable.getRecords(parserID, "month")),
+    ("weekly, 3 years", None, lambda parserID: parserDataTable.rollupTable.getRecords(parserID, "week")),
+    ("daily, last 30 days", lambda parserID: rawDaily(parserID, lastMonth, endTimestamp),
+                            lambda parserID: parserDataTable.rollupTable.getRecords(parserID, "day", lastMonth, endTimestamp)),
+    ("daily, 3 years", lambda parserID: rawDaily(parserID, startTimestamp, endTimestamp),
+                       lambda parserID: parserDataTable.rollupTable.getRecords(parserID, "day")),
+]
+
+print "%d parsers, %d parserData rows, rollups built in %.2f s" % (len(parserIDs), parserDatabase.execute("SELECT COUNT(*) FROM parserData").fetchone()[0], rebuildTime)
+for name, raw, rollup in queries:
+    if raw is None:
+        print "  %-25s %10s from raw rows %8.2f ms from rollups" % (name, "-", benchmark(rollup))
+    else:
+        print "  %-25s %8.2f ms from raw rows %8.2f ms from rollups" % (name, benchmark(raw), benchmark(rollup))
+
+print "FAILED" if failed else "OK"
@@ -0,0 +1,149 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Parser values saved by RMParserManager.run() with one transaction per parser against the previous
+# commit after each statement:
+#  - crash injection: the process is killed after each statement of a parser cycle in turn, the
+#    database must then be in the state of a fully saved prefix of the parser results
+#  - benchmark: commits (each one fsyncs the journal and the database file) and wall time per run
+#
+
+import sys, os, imp, random, shutil, sqlite3, tempfile, logging
+sys.path.append('../')
+
+import time
+from contextlib import contextmanager
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp
+from RMUtilsFramework.rmCommandThread import RMCommandThread
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMDatabaseFramework.rmDatabase import RMDatabase
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+imp.load_source("rmParserTestUtils", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RMParserFramework", "__rm-parser-test-utils.py"))
+from rmParserTestUtils import RMTestParser, createParserManager, runInChild
+
+log.setLevel(logging.CRITICAL)
+
+dayTimestamp = rmCurrentDayTimestamp()
+
+def generate(hours):
+    def values(parser):
+        rng = random.Random(parser.runs * 100 + parser.index)
+        result = []
+        for hour in range(hours):
+            value = RMWeatherData(dayTimestamp + hour * 3600)
+            value.temperature = round(rng.uniform(-5, 35), 2)
+            value.rh = round(rng.uniform(20, 100), 2)
+            value.qpf = rng.choice([0, 0, 1.5])
+            result.append(value)
+        return result
+    return values
+
+def perStatementCommits():
+    # RMParserManager before the unit of work: every table method commits
+    @contextmanager
+    def transaction(self):
+        yield self
+    RMDatabase.transaction = transaction
+
+def setup(databasePath, parsers, hours):
+    return createParserManager(databasePath, [RMTestParser(index, generate(hours)) for index in range(parsers)])
+
+def snapshot(databasePath):
+    connection = sqlite3.connect(os.path.join(databasePath, "rainmachine-parser.sqlite"))
+    forecasts = [list(row) for row in connection.execute("SELECT ID, processed FROM forecast ORDER BY ID")]
+    values = [list(row) for row in connection.execute("SELECT forecastID, parserID, timestamp, temperature, minTemperature, maxTemperature, rh, qpf "\
+                                                       "FROM parserData ORDER BY parserID, timestamp, forecastID")]
+    connection.close()
+    return [forecasts, values]
+
+def countStatements(database, crashAt = None):
+    count = [0]
+    def counted(method):
+        def wrapped(*args):
+            result = method(*args)
+            count[0] += 1
+            if count[0] == crashAt:
+                os._exit(0) # killed before anything else reaches the disk
+            return result
+        return wrapped
+    database.execute = counted(database.execute)
+    database.executeMany = counted(database.executeMany)
+    return count
+
+#-----------------------------------------------------------------------------------------------------------
+# Crash injection
+#
+def referenceRun(databasePath, unitOfWork, runs):
+    ### Database states after each parser result is saved and the number of statements executed
+    if not unitOfWork:
+        perStatementCommits()
+    manager = setup(databasePath, 3, 48)
+    states = [snapshot(databasePath)]
+    writeParserValues = manager._RMParserManager__writeParserValues
+    def writeAndSnapshot(*args):
+        result = writeParserValues(*args)
+        states.append(snapshot(databasePath))
+        return result
+    manager._RMParserManager__writeParserValues = writeAndSnapshot
+
+    count = countStatements(globalDbManager.parserDatabase)
+    for run in range(runs):
+        manager.run()
+        states.append(snapshot(databasePath)) # forecast marked as mixed
+    return {"states": states, "statements": count[0]}
+
+def crashRun(databasePath, unitOfWork, runs, crashAt):
+    if not unitOfWork:
+        perStatementCommits()
+    manager = setup(databasePath, 3, 48)
+    countStatements(globalDbManager.parserDatabase, crashAt)
+    for run in range(runs):
+        manager.run()
+
+def crashTest(unitOfWork, runs = 3):
+    databasePath = tempfile.mkdtemp()
+    reference = runInChild(referenceRun, databasePath, unitOfWork, runs)
+    shutil.rmtree(databasePath)
+
+    partial = 0
+    for crashAt in range(1, reference["statements"] + 1):
+        databasePath = tempfile.mkdtemp()
+        runInChild(crashRun, databasePath, unitOfWork, runs, crashAt)
+        if snapshot(databasePath) not in reference["states"]:
+            partial += 1
+        shutil.rmtree(databasePath)
+
+    print "%-22s crash after each of %3d statements: %3d partially saved parser results" % \
+          ("unit of work" if unitOfWork else "commit per statement", reference["statements"], partial)
+
+#-----------------------------------------------------------------------------------------------------------
+# Benchmark: 5 parsers with 10 days of hourly values
+#
+def benchmarkRun(databasePath, unitOfWork, runs):
+    if not unitOfWork:
+        perStatementCommits()
+    manager = setup(databasePath, 5, 240)
+    stats = globalDbManager.parserDatabase.stats
+    commits = stats["commits"]
+    startTime = time.time()
+    for run in range(runs):
+        manager.run()
+    elapsed = time.time() - startTime
+    RMCommandThread.instance.stop()
+    return {"commits": float(stats["commits"] - commits) / runs, "time": elapsed * 1000 / runs}
+
+def benchmark(unitOfWork, runs = 20):
+    databasePath = tempfile.mkdtemp(dir = os.path.dirname(os.path.abspath(__file__))) # not on a tmpfs
+    result = runInChild(benchmarkRun, databasePath, unitOfWork, runs)
+    shutil.rmtree(databasePath)
+    print "%-22s %5.1f commits per run  %7.1f ms per run" % ("unit of work" if unitOfWork else "commit per statement", result["commits"], result["time"])
+
+for unitOfWork in (False, True):
+    crashTest(unitOfWork)
+for unitOfWork in (False, True):
+    benchmark(unitOfWork)
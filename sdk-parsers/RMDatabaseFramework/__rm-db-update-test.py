@@ -0,0 +1,162 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Databases of an older version opened by RMDatabaseManager.initialize(): a version 16 database, with pickled
+# parser params, the old parserData_parserID_timestamp index, parserResultDigest without lastRunTimestamp and
+# without the timestamp range indexes and the rollups, is updated by the dbUpdateScripts to
+# RMVersionTable.CurrentVersion when it is opened. The rollups are filled from the data in the database and
+# are the same as the ones kept while the values are saved. A new database is created with the current
+# version and runs no update script.
+#
+
+import sys, os, pickle, random, shutil, sqlite3, tempfile, logging
+sys.path.append('../')
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMDataFramework.rmMixerData import RMMixerData
+from RMDataFramework.rmParserUserData import RMEncodingVersionTag
+from RMDatabaseFramework.rmDatabase import RMVersionTable, rmExecuteCommand
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmForecastInfoTable import RMForecastTable
+from RMDatabaseFramework.rmParserDataTable import RMParserTable, RMParserDataTable
+from RMDatabaseFramework.rmMixerDataTable import RMMixerDataTable, RMMixerDataRollupTable
+
+log.setLevel(logging.ERROR)
+updates = []
+log.info = lambda message, *args, **kwargs: updates.append(os.path.basename(message)) if "applying database upgrade" in message else None
+
+failed = False
+
+def check(name, ok):
+    global failed
+    if not ok:
+        print "  %s FAILED" % name
+        failed = True
+    return ok
+
+def rollups(parserDataTable, mixerDataTable, parserIDs):
+    result = {}
+    for period in ("day", "week", "month"):
+        for parserID in parserIDs:
+            result[(parserID, period)] = parserDataTable.rollupTable.getRecords(parserID, period)
+        result[("mixer", period)] = mixerDataTable.rollupTable.getRecords(RMMixerDataRollupTable.SourceID, period)
+    return result
+
+def columns(databasePath, table):
+    connection = sqlite3.connect(os.path.join(databasePath, "rainmachine-parser.sqlite"))
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(%s)" % table)]
+    connection.close()
+    return columns
+
+def indexes(databasePath):
+    indexes = []
+    for fileName in ("rainmachine-parser.sqlite", "rainmachine-mixer.sqlite"):
+        connection = sqlite3.connect(os.path.join(databasePath, fileName))
+        indexes += [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='index' AND name NOT LIKE 'sqlite_%'")]
+        connection.close()
+    return sorted(indexes)
+
+rng = random.Random(1)
+startTimestamp = 1420070400
+days = 40
+RMCommandThread.createInstance()
+
+#-----------------------------------------------------------------------------------------------------------
+# Current database with 2 parsers and the mixer, 40 daily forecasts of 3 days of hourly values
+#
+databasePath = tempfile.mkdtemp()
+globalDbManager.initialize(databasePath)
+check("new database version", globalDbManager.mainDatabase.versionTable.getVersion() == RMVersionTable.CurrentVersion)
+check("new database without updates", updates == [])
+
+parserTable = RMParserTable(globalDbManager.parserDatabase)
+forecastTable = RMForecastTable(globalDbManager.parserDatabase)
+parserDataTable = RMParserDataTable(globalDbManager.parserDatabase)
+mixerDataTable = RMMixerDataTable(globalDbManager.mixerDatabase)
+
+parserIDs = [parserTable.addParser("update%d.py" % index, "Update %d" % index, True)[0].dbID for index in range(2)]
+for day in range(days):
+    dayTimestamp = startTimestamp + day * 86400
+    forecast = forecastTable.addRecord(dayTimestamp)
+    for parserID in parserIDs:
+        values = []
+        for hour in range(72):
+            values.append(RMWeatherData(dayTimestamp + hour * 3600))
+            values[-1].temperature = round(rng.uniform(-5, 35), 2)
+            values[-1].qpf = rng.choice([None, 0.0, round(rng.uniform(0, 5), 2)])
+        parserDataTable.addRecords(forecast.id, parserID, values)
+        parserDataTable.rollupTable.updateDays(parserID, [value.timestamp for value in values])
+
+    mixerData = RMMixerData(dayTimestamp)
+    mixerData.temperature = round(rng.uniform(5, 30), 2)
+    mixerData.et0final = round(rng.uniform(0, 8), 2)
+    mixerDataTable.addRecords(forecast.id, dayTimestamp, [mixerData])
+
+expectedRollups = rollups(parserDataTable, mixerDataTable, parserIDs)
+expectedIndexes = indexes(databasePath)
+print "version %d database: %d parser day rollups, indexes %s" % \
+      (RMVersionTable.CurrentVersion, sum(len(expectedRollups[(parserID, "day")]) for parserID in parserIDs), expectedIndexes)
+
+#-----------------------------------------------------------------------------------------------------------
+# The same data as saved by version 16
+#
+params = {"station": "10637", "units": "metric"}
+
+def downgrade():
+    for database, statements in ((globalDbManager.parserDatabase, ["DROP TABLE parserDataRollup", "DROP INDEX parserData_parserID_timestamp_forecastID",
+                                                                     "CREATE INDEX parserData_parserID_timestamp ON parserData(parserID, timestamp)",
+                                                                     "DROP TABLE parserResultDigest",
+                                                                     "CREATE TABLE parserResultDigest (parserID INTEGER PRIMARY KEY, forecastID INTEGER NOT NULL, "\
+                                                                     "digest VARCHAR(40) NOT NULL)"]),
+                                 (globalDbManager.mixerDatabase, ["DROP TABLE mixerDataRollup", "DROP INDEX mixerData_timestamp_forecastID"])):
+        for statement in statements:
+            database.execute(statement)
+        database.commit()
+
+    globalDbManager.parserDatabase.execute("UPDATE parser SET params=? WHERE ID=?", (pickle.dumps(params), parserIDs[0]))
+    globalDbManager.parserDatabase.commit()
+
+rmExecuteCommand(RMCommand("downgrade", True, downgrade))
+globalDbManager.mainDatabase.versionTable.setVersion(16)
+globalDbManager.uninitialize()
+
+#-----------------------------------------------------------------------------------------------------------
+# Opened by the current version
+#
+globalDbManager.initialize(databasePath)
+parserTable = RMParserTable(globalDbManager.parserDatabase)
+parserDataTable = RMParserDataTable(globalDbManager.parserDatabase)
+mixerDataTable = RMMixerDataTable(globalDbManager.mixerDatabase)
+
+version = globalDbManager.mainDatabase.versionTable.getVersion()
+updatedRollups = rollups(parserDataTable, mixerDataTable, parserIDs)
+print "version 16 database opened: version %d, updates %s, %d parser day rollups, indexes %s" % \
+      (version, updates, sum(len(updatedRollups[(parserID, "day")]) for parserID in parserIDs), indexes(databasePath))
+
+check("updated to the current version", version == RMVersionTable.CurrentVersion)
+check("update scripts in order", updates == ["updateV%d.py" % version for version in range(17, RMVersionTable.CurrentVersion + 1)])
+check("rollups filled", all(updatedRollups[(parserID, "day")] for parserID in parserIDs) and updatedRollups[("mixer", "day")])
+check("same rollups as the saved values", updatedRollups == expectedRollups)
+check("consistent rollups", not any(parserDataTable.rollupTable.verify(parserID) for parserID in parserIDs) and
+                            not mixerDataTable.rollupTable.verify(RMMixerDataRollupTable.SourceID))
+check("indexes created", indexes(databasePath) == expectedIndexes)
+check("parserResultDigest columns", columns(databasePath, "parserResultDigest") == ["parserID", "forecastID", "digest", "lastRunTimestamp"])
+storedParams = rmExecuteCommand(RMCommand("params", True, lambda: str(globalDbManager.parserDatabase.execute("SELECT CAST(params AS TEXT) FROM parser WHERE ID=?",
+                                                                                                               (parserIDs[0], )).fetchone()[0])))
+check("parser params converted", parserTable.getParserParams(parserIDs[0]) == params and storedParams.startswith(RMEncodingVersionTag))
+globalDbManager.uninitialize()
+
+# Opened again, nothing left to update
+del updates[:]
+globalDbManager.initialize(databasePath)
+check("no update once current", updates == [])
+globalDbManager.uninitialize()
+
+RMCommandThread.instance.stop()
+shutil.rmtree(databasePath)
+print "FAILED" if failed else "OK"
@@ -0,0 +1,111 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Incremental vacuum of the parser database:
+#  - an existing database without auto_vacuum is switched to INCREMENTAL once, on the first open, and
+#    keeps its data. A new database gets the mode without the migration.
+#  - reclaimSpace() releases the free pages left by deleted rows, at most VacuumPagesBudget pages per
+#    call, until no more than FreePagesThreshold are left. The database file shrinks accordingly.
+#
+
+import sys, os, random, shutil, tempfile, logging
+sys.path.append('../')
+
+import rmDatabase
+from rmDatabase import *
+from rmForecastInfoTable import *
+from rmParserDataTable import *
+
+rmDatabase.USE_COMMAND_THREAD__ = False
+
+log.setLevel(logging.ERROR)
+migrations = []
+log.info = lambda message, *args, **kwargs: migrations.append(message) if "migrating to incremental vacuum" in message else None
+
+failed = False
+
+def check(name, ok):
+    global failed
+    if not ok:
+        print "  %s FAILED" % name
+        failed = True
+    return ok
+
+def pragma(database, name):
+    return database.execute("PRAGMA %s" % name).fetchone()[0]
+
+random.seed(1)
+databaseDir = tempfile.mkdtemp()
+fileName = os.path.join(databaseDir, "rainmachine-parser.sqlite")
+
+#-----------------------------------------------------------------------------------------------------------
+# Existing database created before incremental vacuum
+#
+database = RMParsersDatabase(fileName)
+database.incrementalVacuum = False
+database.open()
+parserTable = RMParserTable(database)
+forecastTable = RMForecastTable(database)
+RMParserDataTable(database)
+
+parserIDs = [parserTable.addParser("parser%d.py" % index, "Parser %d" % index, True)[0].dbID for index in range(10)]
+startTimestamp = 1420070400
+for day in range(240):
+    forecast = forecastTable.addRecord(startTimestamp + day * 86400)
+    database.executeMany("INSERT INTO parserData(forecastID, parserID, timestamp, temperature, rh, qpf) VALUES(?, ?, ?, ?, ?, ?)",
+                         [(forecast.id, parserID, startTimestamp + day * 86400 + hour * 3600,
+                           random.uniform(-5, 35), random.uniform(20, 100), random.uniform(0, 2))
+                          for parserID in parserIDs for hour in range(24)])
+database.commit()
+rows = database.execute("SELECT COUNT(*) FROM parserData").fetchone()[0]
+print "existing database: auto_vacuum %d, %d pages, %d parserData rows" % (pragma(database, "auto_vacuum"), pragma(database, "page_count"), rows)
+database.close()
+
+for attempt in range(2):
+    database = RMParsersDatabase(fileName)
+    database.open()
+    print "open %d: auto_vacuum %d, %d migrations" % (attempt + 1, pragma(database, "auto_vacuum"), len(migrations))
+    check("auto_vacuum INCREMENTAL", pragma(database, "auto_vacuum") == 2)
+    check("migrated once", len(migrations) == 1)
+    check("data kept", database.execute("SELECT COUNT(*) FROM parserData").fetchone()[0] == rows)
+    if attempt == 0:
+        database.close()
+
+newDatabase = RMParsersDatabase(os.path.join(databaseDir, "new.sqlite"))
+newDatabase.open()
+RMParserDataTable(newDatabase)
+check("new database INCREMENTAL without migration", pragma(newDatabase, "auto_vacuum") == 2 and len(migrations) == 1)
+newDatabase.close()
+
+#-----------------------------------------------------------------------------------------------------------
+# Space reclaimed after deleting rows
+#
+database.execute("DELETE FROM parserData WHERE timestamp<?", (startTimestamp + 200 * 86400, ))
+database.commit()
+
+fileSize = os.path.getsize(fileName)
+freePages = pragma(database, "freelist_count")
+print "deleted %d days: %d free pages, file %d KB" % (200, freePages, fileSize / 1024)
+check("free pages left by the deleted rows", freePages > RMDatabase.FreePagesThreshold + RMDatabase.VacuumPagesBudget)
+
+calls = 0
+while True:
+    released = database.reclaimSpace()
+    if released == 0:
+        break
+    calls += 1
+    check("at most VacuumPagesBudget pages per call", released <= RMDatabase.VacuumPagesBudget)
+
+pageSize = pragma(database, "page_size")
+print "reclaimSpace(): %d calls, %d free pages left, file %d KB" % (calls, pragma(database, "freelist_count"), os.path.getsize(fileName) / 1024)
+check("free pages released", pragma(database, "freelist_count") <= RMDatabase.FreePagesThreshold)
+check("file truncated", os.path.getsize(fileName) <= fileSize - (freePages - RMDatabase.FreePagesThreshold) * pageSize)
+check("remaining data kept", database.execute("SELECT COUNT(*) FROM parserData").fetchone()[0] == rows / 6)
+check("database consistent", database.execute("PRAGMA integrity_check").fetchone()[0] == "ok")
+database.close()
+
+shutil.rmtree(databaseDir)
+print "FAILED" if failed else "OK"
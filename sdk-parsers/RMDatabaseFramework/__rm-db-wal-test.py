@@ -0,0 +1,149 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Read latency of the parserData and mixerData queries made from other threads while the command
+# thread runs parser addRecords() (with clearHistory()) cycles, in rollback journal and in WAL mode.
+# The readers pause 5 ms between reads (stress) or 50 ms (closer to the API clients of a device). In WAL
+# mode the write cycle gets slower with the number of reads served: the command thread does the same
+# work but waits for the GIL that the reader threads now hold while building their results.
+#
+
+import sys, os, random, shutil, tempfile, logging
+sys.path.append('../')
+
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+
+from rmDatabase import *
+from rmForecastInfoTable import *
+from rmParserDataTable import *
+from rmMixerDataTable import *
+
+import time
+from threading import Thread
+
+log.setLevel(logging.ERROR)
+
+parserIDs = range(1, 6)
+days = 60
+readerCount = 3
+cycles = 15
+
+def forecastValues(timestamp):
+    values = []
+    for hour in range(240):
+        value = RMWeatherData(timestamp + hour * 3600)
+        value.temperature = round(random.uniform(-5, 35), 2)
+        value.rh = round(random.uniform(20, 100), 2)
+        value.wind = round(random.uniform(0, 8), 2)
+        value.qpf = random.choice([0, 0, 1.5])
+        value.condition = random.choice([None, 1, 2])
+        values.append(value)
+    return values
+
+def parserSummary(records):
+    return [(forecast.id, day, [(value.timestamp, value.temperature, value.minTemperature) for value in values])
+            for forecast in records for day, values in records[forecast].items()]
+
+def mixerSummary(records):
+    return [(value.timestamp, value.temperature, value.et0) for value in records]
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def run(walMode, readerPause):
+    random.seed(1)
+    databaseDir = tempfile.mkdtemp()
+
+    parserDatabase = RMParsersDatabase(os.path.join(databaseDir, "rainmachine-parser.sqlite"))
+    parserDatabase.walMode = walMode
+    parserDatabase.open()
+    mixerDatabase = RMMixerDatabase(os.path.join(databaseDir, "rainmachine-mixer.sqlite"))
+    mixerDatabase.walMode = walMode
+    mixerDatabase.open()
+
+    parserTable = RMParserTable(parserDatabase)
+    forecastTable = RMForecastTable(parserDatabase)
+    parserDataTable = RMParserDataTable(parserDatabase)
+    mixerDataTable = RMMixerDataTable(mixerDatabase)
+
+    # History of the last days, written directly like the index test
+    today = rmCurrentDayTimestamp()
+    startTimestamp = today - days * 86400
+    def fill():
+        for parserID in parserIDs:
+            parserTable.addParser("parser%d.py" % parserID, "Parser %d" % parserID, True)
+        for day in range(days):
+            forecast = forecastTable.addRecord(startTimestamp + day * 86400)
+            hours = [startTimestamp + day * 86400 + hour * 3600 for hour in range(240)]
+            parserDatabase.executeMany("INSERT INTO parserData(forecastID, parserID, timestamp, temperature, rh, qpf) VALUES(?, ?, ?, ?, ?, ?)",
+                                       [(forecast.id, parserID, timestamp, random.uniform(-5, 35), random.uniform(20, 100), random.uniform(0, 2))
+                                        for parserID in parserIDs for timestamp in hours])
+            mixerDatabase.executeMany("INSERT INTO mixerData(forecastID, forecastTimestamp, timestamp, temperature, et0, qpf) VALUES(?, ?, ?, ?, ?, ?)",
+                                      [(forecast.id, forecast.timestamp, timestamp, random.uniform(-5, 35), random.uniform(0, 8), random.uniform(0, 2))
+                                       for timestamp in hours])
+        parserDatabase.commit()
+        mixerDatabase.commit()
+    RMCommandThread.instance.executeCommand(RMCommand("fill", True, fill))
+
+    writes = [forecastValues(today) for parserID in parserIDs]
+    running = [True]
+    writeTimes = []
+    latencies = []
+
+    def writer():
+        for cycle in range(cycles):
+            startTime = time.time()
+            forecast = forecastTable.addRecord(today + cycle * 60)
+            for parserID, values in zip(parserIDs, writes):
+                parserDataTable.addRecords(forecast.id, parserID, values) # clearHistory() is part of addRecords()
+            parserDatabase.reclaimSpace()
+            writeTimes.append(time.time() - startTime)
+        running[0] = False
+
+    def reader(index):
+        readerLatencies = []
+        while running[0]:
+            day = today + random.randint(-2, 7) * 86400
+            startTime = time.time()
+            if index % 2:
+                mixerDataTable.getLastRecordsByThreshold(day - 7 * 86400, day)
+            else:
+                parserDataTable.getRecordsByParserID(random.choice(parserIDs), day, day + 2 * 86400)
+            readerLatencies.append((time.time() - startTime) * 1000)
+            time.sleep(readerPause) # API clients, not a busy loop starving the command thread of the GIL
+        latencies.extend(readerLatencies)
+
+    threads = [Thread(target=reader, args=(index, )) for index in range(readerCount)]
+    for thread in threads:
+        thread.start()
+    writer()
+    for thread in threads:
+        thread.join()
+
+    # Readers see the committed data, same as the command thread
+    sameResults = parserSummary(parserDataTable.getRecordsByParserID(1, today - 86400, today + 86400)) == \
+                  parserSummary(RMCommandThread.instance.executeCommand(RMCommand("check", True, parserDataTable.getRecordsByParserID, (1, today - 86400, today + 86400))))
+    sameResults = sameResults and mixerSummary(mixerDataTable.getLastRecordsByThreshold(today, today + 86400)) == \
+                  mixerSummary(RMCommandThread.instance.executeCommand(RMCommand("check", True, mixerDataTable.getLastRecordsByThreshold, (today, today + 86400))))
+
+    parserDatabase.close()
+    mixerDatabase.close()
+    shutil.rmtree(databaseDir)
+
+    latencies.sort()
+    print "%-16s %2d ms pause %5d reads  p50 %7.2f ms  p90 %7.2f ms  p99 %7.2f ms  max %7.2f ms  | write cycle %7.1f ms  | %s" % \
+          ("WAL" if walMode else "rollback journal", readerPause * 1000, len(latencies),
+           percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99), latencies[-1],
+           sum(writeTimes) * 1000 / len(writeTimes), "same results" if sameResults else "DIFFERENT RESULTS")
+
+RMCommandThread.createInstance()
+print "%d readers, %d write cycles of %d parsers x 240 hourly values, %d days of history" % (readerCount, cycles, len(parserIDs), days)
+for readerPause in (0.005, 0.05):
+    run(False, readerPause)
+    run(True, readerPause)
+RMCommandThread.instance.stop()
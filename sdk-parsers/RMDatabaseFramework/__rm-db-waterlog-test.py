@@ -0,0 +1,214 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# A year of watering history for 16 zones (one program per day, 3 cycles per zone) saved in water_log:
+#  - per record retention: the history size DELETE and a commit for each inserted cycle
+#  - amortized retention, one addRecord() for each cycle
+#  - amortized retention, one addRecords() for each program run
+# The rows left at the end must be the same, the benchmark reports time and commits.
+# Then getRecords() and getRecordsEx() are compared with the implementation they replaced (see below).
+#
+
+import sys, os, imp, shutil, tempfile, hashlib, json
+sys.path.append('../')
+
+import time
+
+import rmDatabase
+import rmMainDataTable
+from rmDatabase import RMMainDatabase
+from rmMainDataTable import RMWaterLogTable
+from RMDataFramework.rmUserSettings import globalSettings
+imp.load_source("rmParserTestUtils", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RMParserFramework", "__rm-parser-test-utils.py"))
+from rmParserTestUtils import runInChild
+
+rmDatabase.USE_COMMAND_THREAD__ = False
+globalSettings.waterLogHistorySize = 90
+
+startTimestamp = 1420070400 # 2015-01-01
+clock = [startTimestamp]
+rmMainDataTable.rmCurrentDayTimestamp = lambda: clock[0]
+
+zones = 16
+cycles = 3
+days = 365
+
+def programRun(dayTimestamp):
+    ### Water log records of one cycle/soak program run
+    records = []
+    startTime = dayTimestamp + 5 * 3600
+    for cycle in range(cycles):
+        for zid in range(1, zones + 1):
+            records.append((startTime, 1, zid, 300, 280, 280, 0, "token%d" % dayTimestamp, dayTimestamp + 5 * 3600))
+            startTime += 300
+    return records
+
+def perRecordRetention(table, records):
+    # RMWaterLogTable.addRecord before the amortized retention
+    for record in records:
+        table.deleteRecordsByHistory(False)
+        table.database.execute("INSERT OR REPLACE INTO %s VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)" % table._tableName, record)
+        table.database.commit()
+
+def perRecord(table, records):
+    for record in records:
+        table.addRecord(*record)
+
+def perProgramRun(table, records):
+    table.addRecords(records)
+
+def run(name, function):
+    databasePath = tempfile.mkdtemp(dir = os.path.dirname(os.path.abspath(__file__))) # not on a tmpfs
+    database = RMMainDatabase(os.path.join(databasePath, "rainmachine-main.sqlite"))
+    database.open()
+    table = RMWaterLogTable(database)
+    if function is perRecordRetention:
+        database.execute("DROP INDEX water_log_tokenTimestamp")
+
+    commits = database.stats["commits"]
+    startTime = time.time()
+    for day in range(days):
+        clock[0] = startTimestamp + day * 86400
+        function(table, programRun(clock[0]))
+    elapsed = time.time() - startTime
+    commits = database.stats["commits"] - commits
+
+    rows = database.execute("SELECT * FROM water_log ORDER BY ts_started, usersch_id, zid").fetchall()
+    database.close()
+    shutil.rmtree(databasePath)
+
+    print "%-36s %6d records  %6d commits  %8.1f ms  %5d rows kept" % (name, days * zones * cycles, commits, elapsed * 1000, len(rows))
+    return rows
+
+reference = run("per record retention", perRecordRetention)
+failed = False
+for name, function in (("amortized retention, per record", perRecord), ("amortized retention, per program run", perProgramRun)):
+    if run(name, function) != reference:
+        print "  DIFFERENT ROWS"
+        failed = True
+
+#-----------------------------------------------------------------------------------------------------------
+# Reads: getRecords() and getRecordsEx() building the result in Python from all the rows of the range
+# against the paged rows and SQL sums, for 1, 30 and 365 days of the same 16 zones history with a
+# manual run every 7 days. Each case runs in a new child process, after a first child warmed up the page
+# cache, and reports its peak memory above the memory used before the call. Only a digest of the result is
+# sent back so the parent memory stays the same for every case.
+#
+from collections import OrderedDict
+from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay, rmTimestampToDateAsString
+
+def previousGetRecords(table, minTimestamp, maxTimestamp):
+    # RMWaterLogTable.getRecords before the paged rows
+    records = table.database.execute("SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp FROM water_log "\
+                                      "WHERE ?<=tokenTimestamp AND tokenTimestamp<? ORDER BY tokenTimestamp, usersch_id, zid, ts_started", (minTimestamp, maxTimestamp))
+    tempResults = OrderedDict()
+    for row in records:
+        dayGroup = tempResults.setdefault(rmGetStartOfDay(int(row[8])), OrderedDict())
+        programGroup = dayGroup.setdefault(row[7], OrderedDict())
+        zones = programGroup.setdefault(row[1], OrderedDict())
+        zone = zones.get(row[2], None)
+        if zone is None:
+            zone = OrderedDict([("uid", row[2]), ("flag", row[6]), ("cycles", [])])
+            zones[row[2]] = zone
+        cycles = zone["cycles"]
+        cycles.append(OrderedDict([("id", len(cycles) + 1), ("startTime", rmTimestampToDateAsString(row[0])), ("startTimestamp", row[0]),
+                                   ("userDuration", row[3]), ("machineDuration", row[4]), ("realDuration", row[5])]))
+
+    results = {"days": []}
+    for dayTimestamp in tempResults:
+        programs = []
+        results["days"].append({"date": rmTimestampToDateAsString(dayTimestamp, "%Y-%m-%d"), "dateTimestamp": dayTimestamp, "programs": programs})
+        for token in tempResults[dayTimestamp]:
+            tempPrograms = tempResults[dayTimestamp][token]
+            for programId in tempPrograms:
+                programs.append(OrderedDict([("id", programId), ("zones", tempPrograms[programId].values())]))
+    return results
+
+def previousGetRecordsEx(table, minTimestamp, maxTimestamp, withManualPrograms):
+    # RMWaterLogTable.getRecordsEx before the SQL sums
+    records = table.database.execute("SELECT tokenTimestamp, SUM(real_sec) realDuration, SUM(user_sec) userDuration, usersch_id FROM water_log "\
+                                     "WHERE ?<=tokenTimestamp AND tokenTimestamp<? GROUP BY tokenTimestamp ORDER BY tokenTimestamp", (minTimestamp, maxTimestamp))
+    tempResults = OrderedDict()
+    for row in records:
+        if not withManualPrograms and int(row[3]) == 0:
+            continue
+        totalDurations = tempResults.setdefault(rmGetStartOfDay(int(row[0])), [0, 0])
+        totalDurations[0] += int(row[1])
+        totalDurations[1] += int(row[2])
+    return {"days": [{"dayTimestamp": dayTimestamp, "date": rmTimestampToDateAsString(dayTimestamp, "%Y-%m-%d"),
+                      "realDuration": tempResults[dayTimestamp][0], "userDuration": tempResults[dayTimestamp][1]} for dayTimestamp in tempResults]}
+
+def streamDays(table, minTimestamp, maxTimestamp):
+    days = 0
+    for day in table.iterDays(minTimestamp, maxTimestamp):
+        days += 1
+    return {"days": days}
+
+readCases = OrderedDict([
+    ("getRecords before", lambda table, minTimestamp, maxTimestamp: previousGetRecords(table, minTimestamp, maxTimestamp)),
+    ("getRecords", lambda table, minTimestamp, maxTimestamp: table.getRecords(minTimestamp, maxTimestamp)),
+    ("iterDays", streamDays),
+    ("getRecordsEx before", lambda table, minTimestamp, maxTimestamp: [previousGetRecordsEx(table, minTimestamp, maxTimestamp, manual) for manual in (False, True)]),
+    ("getRecordsEx", lambda table, minTimestamp, maxTimestamp: [table.getRecordsEx(minTimestamp, maxTimestamp, manual) for manual in (False, True)]),
+    ("getDurationTotals zone/program", lambda table, minTimestamp, maxTimestamp: [table.getDurationTotals(minTimestamp, maxTimestamp, groupBy) for groupBy in ("zone", "program")])
+])
+
+def memoryStatus(name):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(name + ":"):
+                return int(line.split()[1])
+
+def resetPeakMemory():
+    # the peak memory (VmHWM) of a forked child starts from the one of its parent
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+def readCase(databaseFile, case, days):
+    database = RMMainDatabase(databaseFile)
+    database.open()
+    table = RMWaterLogTable(database)
+    maxTimestamp = startTimestamp + 365 * 86400
+    minTimestamp = maxTimestamp - days * 86400
+    table.getRecordsPage(minTimestamp, maxTimestamp, None, 1)
+
+    function = readCases[case]
+    resetPeakMemory()
+    memory = memoryStatus("VmRSS")
+    startTime = time.time()
+    result = function(table, minTimestamp, maxTimestamp)
+    elapsed = time.time() - startTime
+    memory = memoryStatus("VmHWM") - memory
+    return {"result": hashlib.md5(json.dumps(result)).hexdigest(), "time": elapsed * 1000, "memory": memory}
+
+globalSettings.waterLogHistorySize = 400
+databasePath = tempfile.mkdtemp()
+database = RMMainDatabase(os.path.join(databasePath, "rainmachine-main.sqlite"))
+database.open()
+table = RMWaterLogTable(database)
+for day in range(365):
+    clock[0] = startTimestamp + day * 86400
+    records = programRun(clock[0])
+    if day % 7 == 0:
+        records += [(clock[0] + 20 * 3600, 0, 3, 600, 600, 590, 0, "manual%d" % day, clock[0] + 20 * 3600)]
+    table.addRecords(records)
+database.close()
+
+print
+for days in (1, 30, 365):
+    runInChild(readCase, database.fileName, "getRecords before", days) # warm up the page cache
+    results = OrderedDict((case, runInChild(readCase, database.fileName, case, days)) for case in readCases)
+    print "%d days, %d rows" % (days, days * zones * cycles)
+    for case in results:
+        print "  %-32s %8.1f ms  %6d KB peak memory" % (case, results[case]["time"], results[case]["memory"])
+
+    if results["getRecords"]["result"] != results["getRecords before"]["result"] or \
+       results["getRecordsEx"]["result"] != results["getRecordsEx before"]["result"]:
+        print "  DIFFERENT RESULTS"
+        failed = True
+
+shutil.rmtree(databasePath)
+print "FAILED" if failed else "OK"
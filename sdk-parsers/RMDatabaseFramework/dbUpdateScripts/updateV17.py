@@ -0,0 +1,34 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDataFramework.rmParserUserData import RMEncodingVersionTag
+
+#----------------------------------------------------------------------------------
+# Version 17: parserData.userData and parser.params are stored as versioned JSON
+# instead of pickle. The rows are read through the legacy converters and written
+# back through the new adapters.
+#
+def performUpdate():
+    database = globalDbManager.parserDatabase
+    if not database.isOpen():
+        return False
+
+    rows = database.execute("SELECT rowid, userData FROM parserData WHERE userData IS NOT NULL AND substr(userData, 1, ?)<>?",
+                            (len(RMEncodingVersionTag), RMEncodingVersionTag, )).fetchall()
+    database.executeMany("UPDATE parserData SET userData=? WHERE rowid=?", [(row[1], row[0]) for row in rows])
+    log.info("... converted %d parser userData values" % len(rows))
+
+    rows = database.execute("SELECT ID, params FROM parser WHERE params IS NOT NULL AND substr(params, 1, ?)<>?",
+                            (len(RMEncodingVersionTag), RMEncodingVersionTag, )).fetchall()
+    database.executeMany("UPDATE parser SET params=? WHERE ID=?", [(row[1], row[0]) for row in rows])
+    log.info("... converted %d parser params" % len(rows))
+
+    database.commit()
+
+    globalDbManager.mainDatabase.versionTable.setVersion(17)
+    return True
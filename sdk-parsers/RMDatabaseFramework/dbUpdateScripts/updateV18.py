@@ -0,0 +1,35 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmParserDataTable import RMParserDataTable
+from RMDatabaseFramework.rmMixerDataTable import RMMixerDataTable
+
+#----------------------------------------------------------------------------------
+# Version 18: indexes for the parserData and mixerData timestamp range queries.
+#
+def performUpdate():
+    parserDatabase = globalDbManager.parserDatabase
+    mixerDatabase = globalDbManager.mixerDatabase
+    if not parserDatabase.isOpen() or not mixerDatabase.isOpen():
+        return False
+
+    # Replaced by parserData_parserID_timestamp_forecastID, databases created while the history compaction
+    # used it still have it
+    parserDatabase.execute("DROP INDEX IF EXISTS parserData_parserID_timestamp")
+
+    # Creating the tables also creates their missing indexes
+    RMParserDataTable(parserDatabase)
+    RMMixerDataTable(mixerDatabase)
+
+    for database in (parserDatabase, mixerDatabase):
+        database.execute("ANALYZE")
+        database.commit()
+    log.info("... created parserData and mixerData indexes")
+
+    globalDbManager.mainDatabase.versionTable.setVersion(18)
+    return True
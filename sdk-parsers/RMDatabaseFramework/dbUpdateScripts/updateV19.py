@@ -0,0 +1,30 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmParserDataTable import RMParserTable, RMParserDataTable
+from RMDatabaseFramework.rmMixerDataTable import RMMixerDataTable, RMMixerDataRollupTable
+
+#----------------------------------------------------------------------------------
+# Version 19: daily, weekly and monthly rollups of parserData and mixerData.
+#
+def performUpdate():
+    parserDatabase = globalDbManager.parserDatabase
+    mixerDatabase = globalDbManager.mixerDatabase
+    if not parserDatabase.isOpen() or not mixerDatabase.isOpen():
+        return False
+
+    # Creating the tables also creates their rollup tables, filled from the data still in the database
+    parserDataTable = RMParserDataTable(parserDatabase)
+    for parser in RMParserTable(parserDatabase).getAllParsers():
+        parserDataTable.rollupTable.rebuild(parser["id"])
+
+    RMMixerDataTable(mixerDatabase).rollupTable.rebuild(RMMixerDataRollupTable.SourceID)
+    log.info("... created parserData and mixerData rollups")
+
+    globalDbManager.mainDatabase.versionTable.setVersion(19)
+    return True
@@ -0,0 +1,26 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+from RMUtilsFramework.rmLogging import log
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+
+#----------------------------------------------------------------------------------
+# Version 20: last run of the parsers that returned the same result as the one saved.
+#
+def performUpdate():
+    parserDatabase = globalDbManager.parserDatabase
+    if not parserDatabase.isOpen():
+        return False
+
+    # Without the table it's created with the column by RMParserDataTable
+    columns = [row[1] for row in parserDatabase.execute("PRAGMA table_info(parserResultDigest)")]
+    if columns and not "lastRunTimestamp" in columns:
+        parserDatabase.execute("ALTER TABLE parserResultDigest ADD COLUMN lastRunTimestamp INTEGER DEFAULT NULL")
+        parserDatabase.commit()
+        log.info("... added parserResultDigest.lastRunTimestamp")
+
+    globalDbManager.mainDatabase.versionTable.setVersion(20)
+    return True
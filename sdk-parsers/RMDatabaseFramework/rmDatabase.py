@@ -5,6 +5,10 @@
 
 
 import sqlite3, os
+from types import FunctionType
+from inspect import isgeneratorfunction
+from contextlib import contextmanager
+from threading import Lock, local
 
 from RMDataFramework.rmParserUserData import *
 from RMDataFramework.rmParserParams import RMParserParams_adaptToSQLite, RMParserParams_convertFromSQLite
@@ -14,10 +18,93 @@ from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
 USE_COMMAND_THREAD__ = True
 
 
+##-----------------------------------------------------------------------------------------------------
+## Database commands issued outside of the RMTable methods. Without USE_COMMAND_THREAD__ they run on the
+## caller thread, like the table methods.
+##
+def rmExecuteCommand(command):
+    if not USE_COMMAND_THREAD__:
+        command.run()
+        command.notifyFinished()
+        return command.result
+    return RMCommandThread.instance.executeCommand(command)
+
+def rmSubmitCommand(command):
+    ### The returned command is a future, already finished without USE_COMMAND_THREAD__
+    if not USE_COMMAND_THREAD__:
+        rmExecuteCommand(command)
+        return command
+    return RMCommandThread.instance.submitCommand(command)
+
+def rmExecuteBatch(commands):
+    ### Results of the commands executed in order
+    if not USE_COMMAND_THREAD__:
+        return [rmExecuteCommand(command) for command in commands]
+    return RMCommandThread.instance.executeBatch(commands)
+
+##-----------------------------------------------------------------------------------------------------
+## Public RMTable methods are replaced at class creation with wrappers that execute them on the
+## command thread. The routing decision is taken when the method is called so attribute access
+## costs nothing and no closure is created per call. Generator methods are not wrapped: their body
+## runs on the thread iterating them and must read through the wrapped methods.
+##
+def RMTableMethod(name, method):
+    def wrapped(self, *args, **kwargs):
+        if not USE_COMMAND_THREAD__ or RMCommandThread.instance.runsOnThisThread():
+            return method(self, *args, **kwargs)
+        return RMCommandThread.instance.executeCommand(RMCommand(name, True, method, (self, ) + args, kwargs))
+
+    wrapped.__name__ = method.__name__
+    wrapped.__doc__ = method.__doc__
+    return wrapped
+
+##-----------------------------------------------------------------------------------------------------
+## Methods marked with @rmReadOnly only run SELECTs. When the database is in WAL mode they are executed
+## on the caller thread with one of the database read only connections, so they don't wait behind the
+## writes queued on the command thread. Without a free read connection they run on the command thread.
+##
+def rmReadOnly(method):
+    method.readOnly = True
+    return method
+
+def RMTableReadMethod(name, method):
+    def wrapped(self, *args, **kwargs):
+        if not USE_COMMAND_THREAD__ or RMCommandThread.instance.runsOnThisThread():
+            return method(self, *args, **kwargs)
+
+        database = self.database
+        if database is not None and database.isReading(): # nested read only call
+            return method(self, *args, **kwargs)
+
+        if database is not None and database.acquireReader():
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                database.releaseReader()
+
+        return RMCommandThread.instance.executeCommand(RMCommand(name, True, method, (self, ) + args, kwargs))
+
+    wrapped.__name__ = method.__name__
+    wrapped.__doc__ = method.__doc__
+    return wrapped
+
+class RMTableType(type):
+    def __new__(mcs, className, bases, attributes):
+        for name, attr in attributes.items():
+            if not name.startswith("_") and isinstance(attr, FunctionType) and not isgeneratorfunction(attr):
+                if getattr(attr, "readOnly", False):
+                    attributes[name] = RMTableReadMethod(name, attr)
+                else:
+                    attributes[name] = RMTableMethod(name, attr)
+        return type.__new__(mcs, className, bases, attributes)
+
 ##-----------------------------------------------------------------------------------------------------
 ##
 ##
 class RMTable(object):
+
+    __metaclass__ = RMTableType
+
     def __init__(self, database):
         self.database = database
         if(self.database):
@@ -30,33 +117,12 @@ class RMTable(object):
         if self.database.isOpen():
             self.database.commit()
 
-    def __getattribute__(self, name):
-        global USE_COMMAND_THREAD__
-        attr = super(RMTable, self).__getattribute__(name)
-
-        if not USE_COMMAND_THREAD__ or not attr or name.startswith("_"):
-            return attr
-        elif callable(attr):
-            if RMCommandThread.instance.runsOnThisThread():
-                return attr
-            else:
-                def wrapped(*args, **kwargs):
-                    cmd = RMCommand(name, True)
-                    cmd.command = attr
-                    cmd.args = args
-                    cmd.kwargs = kwargs
-                    retval = RMCommandThread.instance.executeCommand(cmd)
-                    return retval
-                return wrapped
-        else:
-            return attr
-
 ##-----------------------------------------------------------------------------------------------------
 ##
 ##
 class RMVersionTable(RMTable):
 
-    CurrentVersion = 16
+    CurrentVersion = 20
 
     def initialize(self):
         if self.database.isOpen():
@@ -88,14 +154,40 @@ class RMVersionTable(RMTable):
 ##
 ##
 class RMDatabase:
+
+    # Incremental vacuum: free pages are given back to the file system only when there are more than
+    # FreePagesThreshold of them and at most VacuumPagesBudget pages are released on each reclaimSpace() call.
+    FreePagesThreshold = 64
+    VacuumPagesBudget = 256
+
+    # WAL mode: at most ReadPoolSize read only connections serve the @rmReadOnly table methods, this
+    # also bounds how many reader threads compete with the command thread for the GIL
+    ReadPoolSize = 2
+
     def __init__(self, fileName):
         self.createIfNotExists = True
         self.fileName = fileName
         self.cursor = None
         self.connection = None
+        self.incrementalVacuum = False
+        self.walMode = False
+        self.readPoolSize = 0   # set by open() when the database is in WAL mode
+
+        self.__readersLock = Lock()
+        self.__idleReaders = []
+        self.__readerCount = 0
+        self.__reading = local() # cursor of the read connection used by the current thread
+
+        self.__transactionDepth = 0
+        self.__committedChanges = 0
+        self.stats = {"commits": 0, "transactions": 0, "rollbacks": 0} # commits: the ones that wrote changes
 
         self.versionTable = None
 
+    def __deepcopy__(self, memo):
+        ### Copies of objects holding a table (globalSettings) share the database connections
+        return self
+
     def open(self):
         global USE_COMMAND_THREAD__
         if USE_COMMAND_THREAD__ and not RMCommandThread.instance.runsOnThisThread():
@@ -116,6 +208,11 @@ class RMDatabase:
             self.cursor = self.connection.cursor()
             self.cursor.execute("PRAGMA foreign_keys=1")
 
+            if self.incrementalVacuum:
+                self.__enableIncrementalVacuum()
+
+            self.__setJournalMode()
+
             self.versionTable = RMVersionTable(self)
 
             return True
@@ -134,6 +231,7 @@ class RMDatabase:
 
     def __close(self):
         if(self.connection):
+            self.__closeReaders()
             self.cursor.close()
             self.cursor = None
             self.connection.close()
@@ -151,14 +249,136 @@ class RMDatabase:
         if(self.cursor):
             self.cursor.execute("VACUUM")
 
+    def reclaimSpace(self):
+        if not USE_COMMAND_THREAD__ or RMCommandThread.instance.runsOnThisThread():
+            return self.__reclaimSpace()
+        else:
+            cmd = RMCommand("rmDatabaseReclaimSpace", True)
+            cmd.command = self.__reclaimSpace
+            return RMCommandThread.instance.executeCommand(cmd)
+
+    def __reclaimSpace(self):
+        ### Returns the number of pages released, the database file is never rewritten entirely.
+        if not self.cursor or not self.incrementalVacuum or self.__transactionDepth > 0:
+            return 0
+
+        freePages = self.cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        if freePages <= RMDatabase.FreePagesThreshold:
+            return 0
+
+        self.cursor.execute("PRAGMA incremental_vacuum(%d)" % RMDatabase.VacuumPagesBudget).fetchall()
+        self.__commit()
+
+        releasedPages = freePages - self.cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        log.debug("Database %s: released %d of %d free pages" % (self.fileName, releasedPages, freePages))
+        return releasedPages
+
+    def __enableIncrementalVacuum(self):
+        if self.cursor.execute("PRAGMA auto_vacuum").fetchone()[0] == 2: # INCREMENTAL
+            return
+
+        isNew = self.cursor.execute("PRAGMA page_count").fetchone()[0] == 0
+        self.cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+        # An existing database switches mode only after a VACUUM, this is done once.
+        if not isNew:
+            log.info("Database %s: migrating to incremental vacuum" % self.fileName)
+            try:
+                self.cursor.execute("VACUUM")
+            except Exception, e:
+                log.error("Database %s: cannot migrate to incremental vacuum: %s" % (self.fileName, e))
+
+    def __setJournalMode(self):
+        journalMode = self.cursor.execute("PRAGMA journal_mode").fetchone()[0].lower()
+
+        if self.walMode and self.fileName != ":memory:":
+            if journalMode != "wal":
+                journalMode = self.cursor.execute("PRAGMA journal_mode=WAL").fetchone()[0].lower()
+                if journalMode != "wal":
+                    log.error("Database %s: cannot switch to WAL, journal mode is %s" % (self.fileName, journalMode))
+                    return
+                log.info("Database %s: switched to WAL journal mode" % self.fileName)
+
+            # In WAL mode a power loss can only lose the last commits, never corrupt the database
+            self.cursor.execute("PRAGMA synchronous=NORMAL")
+            self.readPoolSize = RMDatabase.ReadPoolSize
+        elif journalMode == "wal":
+            self.cursor.execute("PRAGMA journal_mode=DELETE")
+            log.info("Database %s: switched back to rollback journal mode" % self.fileName)
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Read only connections used by @rmReadOnly table methods called outside the command thread.
+    # acquireReader() never waits: it returns False when all ReadPoolSize connections are busy.
+    #
+    def acquireReader(self):
+        if self.readPoolSize <= 0 or not self.cursor:
+            return False
+
+        with self.__readersLock:
+            if self.__idleReaders:
+                connection = self.__idleReaders.pop()
+            elif self.__readerCount < self.readPoolSize:
+                self.__readerCount += 1
+                connection = None
+            else:
+                return False
+
+        if connection is None:
+            try:
+                connection = self.__openReader()
+            except Exception, e:
+                log.error("Database %s: cannot open read connection: %s" % (self.fileName, e))
+                with self.__readersLock:
+                    self.__readerCount -= 1
+                return False
+
+        self.__reading.cursor = connection.cursor()
+        return True
+
+    def releaseReader(self):
+        cursor = self.__reading.cursor
+        self.__reading.cursor = None
+
+        # Closing the cursor resets its statement so no read transaction is kept open between calls
+        connection = cursor.connection
+        cursor.close()
+
+        with self.__readersLock:
+            if self.connection is not None and self.readPoolSize > 0:
+                self.__idleReaders.append(connection)
+                return
+            self.__readerCount -= 1
+        connection.close()
+
+    def isReading(self):
+        return getattr(self.__reading, "cursor", None) is not None
+
+    def __openReader(self):
+        connection = sqlite3.connect(self.fileName, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.text_factory = str
+        connection.execute("PRAGMA query_only=1")
+        return connection
+
+    def __closeReaders(self):
+        ### Readers in use are closed by releaseReader()
+        with self.__readersLock:
+            self.readPoolSize = 0
+            for connection in self.__idleReaders:
+                connection.close()
+            self.__readerCount -= len(self.__idleReaders)
+            self.__idleReaders = []
+
     def execute(self, *args):
         paramCount = len(args)
-        if(self.cursor and paramCount > 0):
+        cursor = getattr(self.__reading, "cursor", None) or self.cursor
+        if(cursor and paramCount > 0):
             if(paramCount == 1):
-                self.cursor.execute(args[0])
+                cursor.execute(args[0])
             elif(paramCount == 2):
-                self.cursor.execute(args[0], args[1])
-            return self.cursor
+                cursor.execute(args[0], args[1])
+            return cursor
         return None
 
     def executeMany(self, *args):
@@ -178,8 +398,47 @@ class RMDatabase:
             return RMCommandThread.instance.executeCommand(cmd)
 
     def __commit(self):
-        if(self.connection):
+        ### Inside a transaction() the commit is done once, when the transaction ends
+        if self.connection and self.__transactionDepth == 0:
             self.connection.commit()
+            if self.__committedChanges != self.connection.total_changes:
+                self.__committedChanges = self.connection.total_changes
+                self.stats["commits"] += 1
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Unit of work: the statements executed inside "with database.transaction():" are written in a
+    # single BEGIN IMMEDIATE transaction, committed at the end or rolled back if an exception is raised.
+    # The commit() calls of the table methods are deferred to the end of the outermost transaction.
+    # Must be used on the command thread, other threads would interleave their statements.
+    #
+    @contextmanager
+    def transaction(self):
+        if USE_COMMAND_THREAD__ and not RMCommandThread.instance.runsOnThisThread():
+            raise RuntimeError("Database %s: transactions must run on the command thread" % self.fileName)
+
+        if self.__transactionDepth == 0:
+            self.__commit() # BEGIN would commit the pending statements anyway
+            self.cursor.execute("BEGIN IMMEDIATE")
+
+        self.__transactionDepth += 1
+        try:
+            yield self
+        except:
+            self.__transactionDepth -= 1
+            if self.__transactionDepth == 0:
+                self.connection.rollback()
+                self.__committedChanges = self.connection.total_changes
+                self.stats["rollbacks"] += 1
+            raise
+
+        self.__transactionDepth -= 1
+        if self.__transactionDepth == 0:
+            self.__commit()
+            self.stats["transactions"] += 1
+
+    def inTransaction(self):
+        return self.__transactionDepth > 0
 
     def lastRowId(self):
         if(self.cursor):
@@ -198,6 +457,7 @@ class RMDatabase:
 class RMParsersDatabase(RMDatabase):
     def __init__(self, fileName):
         RMDatabase.__init__(self, fileName)
+        self.incrementalVacuum = True
 
     def open(self):
         if RMDatabase.open(self):
@@ -243,3 +503,38 @@ class RMDoyDatabase(RMDatabase):
 class RMSimulatorDatabase(RMDatabase):
     def __init__(self, fileName):
         RMDatabase.__init__(self, fileName)
+
+
+#-----------------------------------------------------------------------------------------------------------
+# Main Test Unit
+#
+if __name__ == "__main__":
+    import time, logging
+    log.setLevel(logging.INFO)
+
+    class RMBenchmarkTable(RMTable):
+        def initialize(self):
+            self.database.execute("CREATE TABLE IF NOT EXISTS benchmark (value INTEGER)")
+
+        def getValue(self, value):
+            return self.database is not None and value
+
+    def benchmarkCalls(table, count):
+        startTime = time.time()
+        for i in xrange(count):
+            table.getValue(i)
+        return time.time() - startTime
+
+    RMCommandThread.createInstance()
+    database = RMDatabase(":memory:")
+    database.open()
+    table = RMBenchmarkTable(database)
+
+    count = 100000
+    cmd = RMCommand("benchmark", True, benchmarkCalls, (table, count))
+    sameThread = RMCommandThread.instance.executeCommand(cmd)
+    otherThread = benchmarkCalls(table, count)
+    RMCommandThread.instance.stop()
+
+    print "%d table method calls on the command thread: %.3f s (%.2f us per call)" % (count, sameThread, sameThread * 1000000 / count)
+    print "%d table method calls from another thread: %.3f s (%.2f us per call)" % (count, otherThread, otherThread * 1000000 / count)
@@ -23,6 +23,8 @@ class RMDatabaseManager:
         self.doyDatabasePath = None
         self.simulatorDatabasePath = None
 
+        self.walMode = False
+
         self.mainDatabase = None
         self.parserDatabase = None
         self.mixerDatabase = None
@@ -32,9 +34,13 @@ class RMDatabaseManager:
 
     #-----------------------------------------------------------------------------------------------
     #
+    # With walMode the databases use write ahead logging and the read only table methods called
+    # from other threads don't wait for the command thread. The writes get slower with the number
+    # of reads served at the same time: the reader threads hold the GIL while they build their
+    # results and the command thread waits for it (see __rm-db-wal-test.py).
     #
-    #
-    def initialize(self, databasePath):
+    def initialize(self, databasePath, walMode = False):
+        self.walMode = walMode
         self.mainDatabasePath = os.path.join(databasePath, 'rainmachine-main.sqlite')
         self.parserDatabasePath = os.path.join(databasePath, 'rainmachine-parser.sqlite')
         self.mixerDatabasePath = os.path.join(databasePath, 'rainmachine-mixer.sqlite')
@@ -46,9 +52,15 @@ class RMDatabaseManager:
         cmd.command = self.__openDatabases
         RMCommandThread.instance.executeCommand(cmd)
 
+        # Databases of an older version are brought to RMVersionTable.CurrentVersion by the dbUpdateScripts
+        from RMDatabaseFramework.rmDatabaseUpdate import RMDatabaseUpdate # it imports globalDbManager
+        if not RMDatabaseUpdate.update():
+            log.error("*** Cannot update the databases from version %s to %d" %
+                      (self.mainDatabase.versionTable.getVersion(), RMVersionTable.CurrentVersion))
+
     def uninitialize(self):
         cmd = RMCommand("RMDatabaseManagerClose", True)
-        cmd.command = self.__openDatabases
+        cmd.command = self.__closeDatabases
         RMCommandThread.instance.executeCommand(cmd)
 
     #-----------------------------------------------------------------------------------------------
@@ -57,21 +69,27 @@ class RMDatabaseManager:
     #
     def __openDatabases(self):
         self.mainDatabase = RMMainDatabase(self.mainDatabasePath)
+        self.mainDatabase.walMode = self.walMode
         self.mainDatabase.open()
 
         self.parserDatabase = RMParsersDatabase(self.parserDatabasePath)
+        self.parserDatabase.walMode = self.walMode
         self.parserDatabase.open()
 
         self.mixerDatabase = RMMixerDatabase(self.mixerDatabasePath)
+        self.mixerDatabase.walMode = self.walMode
         self.mixerDatabase.open()
 
         self.settingsDatabase = RMUserSettingsDatabase(self.settingsDatabasePath)
+        self.settingsDatabase.walMode = self.walMode
         self.settingsDatabase.open()
 
         self.doyDatabase = RMDoyDatabase(self.doyDatabasePath)
+        self.doyDatabase.walMode = self.walMode
         self.doyDatabase.open()
 
         self.simulatorDatabase = RMSimulatorDatabase(self.simulatorDatabasePath)
+        self.simulatorDatabase.walMode = self.walMode
         self.simulatorDatabase.open()
 
     def __closeDatabases(self):
@@ -87,4 +87,9 @@ class RMDatabaseUpdate:
                 log.error(e)
                 return False
 
+            # The next scripts set a newer version, this one would never run again
+            if not success:
+                log.error("*** Database upgrade %s failed" % scriptPath)
+                return False
+
         return True
@@ -0,0 +1,163 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import math
+from collections import OrderedDict
+
+from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay
+from rmDatabase import RMTable, rmReadOnly
+
+##-----------------------------------------------------------------------------------------------------
+## Forecast accuracy of each parser by variable and lead time (days between the forecast day and the
+## forecasted day, 0 to MaxLead).
+##
+## The daily values of every saved forecast are kept in parserForecastPending, the newest forecast for each
+## lead. History compaction deletes the older forecasts of a day long before the day is observed. When a day
+## is compacted (its values are final) its pending forecasts are compared with the observed values and the
+## errors are added to the totals in parserForecastAccuracy, the pending values are then deleted. The kept
+## forecast of the day is the observation so it is not compared with itself.
+##
+## Daily values: the mean of the hourly values, the sum for qpf.
+##
+class RMForecastAccuracyTable(RMTable):
+
+    Fields = ("temperature", "rh", "wind", "solarRad", "skyCover", "pop", "qpf", "pressure", "dewPoint")
+    SumFields = ("qpf", )
+    MaxLead = 6
+
+    def initialize(self):
+        self.database.execute("CREATE TABLE IF NOT EXISTS parserForecastPending ("\
+                                            "parserID INTEGER NOT NULL, "\
+                                            "dayTimestamp INTEGER NOT NULL, "\
+                                            "lead INTEGER NOT NULL, "\
+                                            "field VARCHAR(16) NOT NULL, "\
+                                            "forecastID INTEGER NOT NULL, "\
+                                            "value DECIMAL NOT NULL, "\
+                                            "PRIMARY KEY(parserID, dayTimestamp, lead, field)"\
+                                            ")")
+        self.database.execute("CREATE TABLE IF NOT EXISTS parserForecastAccuracy ("\
+                                            "parserID INTEGER NOT NULL, "\
+                                            "field VARCHAR(16) NOT NULL, "\
+                                            "lead INTEGER NOT NULL, "\
+                                            "count INTEGER NOT NULL DEFAULT 0, "\
+                                            "sumError DECIMAL NOT NULL DEFAULT 0, "\
+                                            "sumAbsError DECIMAL NOT NULL DEFAULT 0, "\
+                                            "sumSquaredError DECIMAL NOT NULL DEFAULT 0, "\
+                                            "PRIMARY KEY(parserID, field, lead)"\
+                                            ")")
+        self.database.commit()
+
+    def addForecast(self, parserID, forecastID, values):
+        ### Keeps the daily values of a forecast until their days are observed. Not committed.
+        if self.database.isOpen() and values:
+            row = self.database.execute("SELECT timestamp FROM forecast WHERE ID=?", (forecastID, )).fetchone()
+            if row is None:
+                return
+            forecastDayTimestamp = rmGetStartOfDay(row[0])
+
+            days = OrderedDict()
+            for value in values:
+                dayTimestamp = rmGetStartOfDay(value.timestamp)
+                dayValues = days.get(dayTimestamp)
+                if dayValues is None:
+                    dayValues = days[dayTimestamp] = {}
+                for field in RMForecastAccuracyTable.Fields:
+                    fieldValue = getattr(value, field)
+                    if fieldValue is not None:
+                        total = dayValues.get(field, (0, 0))
+                        dayValues[field] = (total[0] + 1, total[1] + fieldValue)
+
+            pending = []
+            for dayTimestamp, dayValues in days.items():
+                lead = int(round((dayTimestamp - forecastDayTimestamp) / 86400.0))
+                if not 0 <= lead <= RMForecastAccuracyTable.MaxLead:
+                    continue
+                for field, total in dayValues.items():
+                    pending.append((parserID, dayTimestamp, lead, field, forecastID, self.__dailyValue(field, total[0], total[1])))
+
+            self.database.executeMany("INSERT OR REPLACE INTO parserForecastPending (parserID, dayTimestamp, lead, field, forecastID, value) "\
+                                      "VALUES(?, ?, ?, ?, ?, ?)", pending)
+
+    def addObservations(self, parserID, observations):
+        ### observations: {dayTimestamp: (forecastID, {field: (count, sum)})} the final hourly totals of each day
+        ### and the forecast they come from. Not committed.
+        if self.database.isOpen() and observations:
+            errors = {}
+            for dayTimestamp, (forecastID, observed) in observations.items():
+                rows = self.database.execute("SELECT lead, field, value FROM parserForecastPending WHERE parserID=? AND dayTimestamp=? AND forecastID<>?",
+                                             (parserID, dayTimestamp, forecastID, )).fetchall()
+                for row in rows:
+                    total = observed.get(row[1])
+                    if total is None or not total[0]:
+                        continue
+                    error = row[2] - self.__dailyValue(row[1], total[0], total[1])
+                    key = (row[1], row[0])
+                    accumulated = errors.get(key, (0, 0, 0, 0))
+                    errors[key] = (accumulated[0] + 1, accumulated[1] + error, accumulated[2] + abs(error), accumulated[3] + error * error)
+
+            self.database.executeMany("DELETE FROM parserForecastPending WHERE parserID=? AND dayTimestamp=?",
+                                      [(parserID, dayTimestamp) for dayTimestamp in observations])
+
+            if errors:
+                self.database.executeMany("INSERT OR IGNORE INTO parserForecastAccuracy (parserID, field, lead) VALUES(?, ?, ?)",
+                                          [(parserID, field, lead) for field, lead in errors])
+                self.database.executeMany("UPDATE parserForecastAccuracy SET count=count+?, sumError=sumError+?, sumAbsError=sumAbsError+?, "\
+                                          "sumSquaredError=sumSquaredError+? WHERE parserID=? AND field=? AND lead=?",
+                                          [values + (parserID, field, lead) for (field, lead), values in errors.items()])
+
+    def deletePendingByDayThreshold(self, dayTimestamp):
+        ### Forecasts of days that were never observed. Not committed.
+        if self.database.isOpen():
+            self.database.execute("DELETE FROM parserForecastPending WHERE dayTimestamp<?", (dayTimestamp, ))
+
+    @rmReadOnly
+    def getRecords(self, parserID):
+        ### {field: {lead: {count, mae, bias, rmse}}}
+        results = OrderedDict()
+        if self.database.isOpen():
+            rows = self.database.execute("SELECT field, lead, count, sumError, sumAbsError, sumSquaredError FROM parserForecastAccuracy "\
+                                         "WHERE parserID=? AND count>0 ORDER BY field, lead", (parserID, ))
+            for row in rows:
+                results.setdefault(row[0], OrderedDict())[row[1]] = self.__statistics(row[2], row[3], row[4], row[5])
+        return results
+
+    @rmReadOnly
+    def getRecordsByLead(self, field, lead):
+        ### {parserID: {count, mae, bias, rmse}} to compare the parsers
+        results = OrderedDict()
+        if self.database.isOpen():
+            rows = self.database.execute("SELECT parserID, count, sumError, sumAbsError, sumSquaredError FROM parserForecastAccuracy "\
+                                         "WHERE field=? AND lead=? AND count>0 ORDER BY parserID", (field, lead, ))
+            for row in rows:
+                results[row[0]] = self.__statistics(row[1], row[2], row[3], row[4])
+        return results
+
+    def deleteRecords(self, parserID, commit = True):
+        if self.database.isOpen():
+            self.database.execute("DELETE FROM parserForecastPending WHERE parserID=?", (parserID, ))
+            self.database.execute("DELETE FROM parserForecastAccuracy WHERE parserID=?", (parserID, ))
+            if commit:
+                self.database.commit()
+
+    def clear(self, commit):
+        if self.database.isOpen():
+            self.database.execute("DELETE FROM parserForecastPending")
+            self.database.execute("DELETE FROM parserForecastAccuracy")
+            if commit:
+                self.database.commit()
+
+    def __dailyValue(self, field, count, sum):
+        if field in RMForecastAccuracyTable.SumFields:
+            return sum
+        return sum / float(count)
+
+    def __statistics(self, count, sumError, sumAbsError, sumSquaredError):
+        return {
+            "count": count,
+            "mae": sumAbsError / count,
+            "bias": sumError / count,
+            "rmse": math.sqrt(sumSquaredError / count)
+        }
@@ -6,7 +6,7 @@
 import uuid
 
 from collections import OrderedDict
-from rmDatabase import RMTable, RMDatabase
+from rmDatabase import RMTable, RMDatabase, rmReadOnly
 from RMUtilsFramework.rmLogging import log
 from RMUtilsFramework.rmTimeUtils import rmCurrentTimestamp, rmGetStartOfDay, rmTimestampToDateAsString
 from RMDataFramework.rmMainDataRecords import RMPastValues, RMAvailableWaterValues
@@ -444,8 +444,18 @@ class RMStatusTable(RMTable):
 ##
 
 class RMWaterLogTable(RMTable):
+
+    # The history size retention runs with the first insert of each day and then again only after
+    # RetentionInserts more inserted records (a record for a past day may be inserted at any time).
+    RetentionInserts = 1000
+
+    # Rows read at a time by iterRecords()
+    RecordsPageSize = 500
+
     def __init__(self, database, fake = False):
         self._tableName = "water_log_fake" if fake else "water_log"
+        self.__retentionDayTimestamp = None
+        self.__insertsSinceRetention = 0
         RMTable.__init__(self, database)
 
     def initialize(self):
@@ -462,15 +472,24 @@ class RMWaterLogTable(RMTable):
                                     "tokenTimestamp VARCHAR(32) NOT NULL, "\
                                     "PRIMARY KEY(ts_started, usersch_id, zid)"\
                             ")" % self._tableName)
+        self.createIndexes()
         self.database.commit()
 
+    def createIndexes(self):
+        # History size retention, the getRecords/getRecordsEx ranges and the iterRecords() order
+        self.database.execute("CREATE INDEX IF NOT EXISTS %s_tokenTimestamp ON %s(tokenTimestamp, usersch_id, zid, ts_started)" % (self._tableName, self._tableName))
+
     def addRecord(self, startTime, pid, zid, userDuration, machineDuration, realDuration, flag, token, tokenTimestamp):
+        return self.addRecords([(startTime, pid, zid, userDuration, machineDuration, realDuration, flag, token, tokenTimestamp)])
+
+    def addRecords(self, records):
+        ### records: (startTime, pid, zid, userDuration, machineDuration, realDuration, flag, token, tokenTimestamp) tuples,
+        ### for example all the zone cycles of a program run, saved with one commit.
         if(self.database.isOpen()):
 
-            self.deleteRecordsByHistory(False)
+            self.__applyRetention(len(records))
 
-            self.database.execute("INSERT OR REPLACE INTO %s VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)" % self._tableName,
-                                (startTime, pid, zid, userDuration, machineDuration, realDuration, flag, token, tokenTimestamp))
+            self.database.executeMany("INSERT OR REPLACE INTO %s VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?)" % self._tableName, records)
             self.database.commit()
             return True
         return False
@@ -490,165 +509,204 @@ class RMWaterLogTable(RMTable):
             if commit:
                 self.database.commit()
 
-    def getRecords(self, minTimestamp, maxTimestamp):
-        if(self.database.isOpen()):
-            if minTimestamp and maxTimestamp:
-                records = self.database.execute("SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp FROM %s "\
-                                                 "WHERE ?<=tokenTimestamp AND tokenTimestamp<? "\
-                                                 "ORDER BY tokenTimestamp, usersch_id, zid" % self._tableName, (minTimestamp, maxTimestamp)
-                                                )
-            elif minTimestamp:
-                records = self.database.execute("SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp FROM %s "\
-                                                 "WHERE ?<=tokenTimestamp "\
-                                                 "ORDER BY tokenTimestamp, usersch_id, zid" % self._tableName, (minTimestamp, )
-                                                )
-            elif maxTimestamp:
-                records = self.database.execute("SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp FROM %s "\
-                                                 "WHERE tokenTimestamp<? "\
-                                                 "ORDER BY tokenTimestamp, usersch_id, zid" % self._tableName, (maxTimestamp, )
-                                                )
-            else:
-                records = self.database.execute("SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp FROM %s "\
-                                                 "ORDER BY tokenTimestamp, usersch_id, zid" % self._tableName
-                                            )
-
-            tempResults = OrderedDict()
+            self.__retentionDayTimestamp = rmCurrentDayTimestamp()
+            self.__insertsSinceRetention = 0
 
-            for row in records:
-                token = row[7]
-                dayTimestamp = rmGetStartOfDay(int(row[8]))
-
-                dayGroup = tempResults.get(dayTimestamp, None)
-                if dayGroup is None:
-                   dayGroup = OrderedDict()
-                   tempResults[dayTimestamp] = dayGroup
-
-                programGroup = dayGroup.get(token, None)
-                if programGroup is None:
-                   programGroup = OrderedDict()
-                   dayGroup[token] = programGroup
-
-                zones = programGroup.get(row[1], None)
-                if zones is None:
-                   zones = OrderedDict()
-                   programGroup[row[1]] = zones
-
-                zone = zones.get(row[2], None)
-                if zone is None:
-                   zone = OrderedDict()
-                   zone["uid"] = row[2]
-                   zone["flag"] = row[6]
-                   zone["cycles"] = []
-                   zones[row[2]] = zone
-
-                cycles = zone["cycles"]
-
-                info = OrderedDict()
+    def __applyRetention(self, inserts):
+        self.__insertsSinceRetention += inserts
+        if self.__retentionDayTimestamp != rmCurrentDayTimestamp() or self.__insertsSinceRetention > RMWaterLogTable.RetentionInserts:
+            self.deleteRecordsByHistory(False)
 
-                info["id"] = len(cycles) + 1
-                info["startTime"] = rmTimestampToDateAsString(row[0])
-                info["startTimestamp"] = row[0]
-                info["userDuration"] = row[3]
-                info["machineDuration"] = row[4]
-                info["realDuration"] = row[5]
+    def __buildDay(self, dayTimestamp, tokens):
+        programs = []
+        for programGroup in tokens.itervalues():
+            for programId in programGroup:
+                program = OrderedDict()
+                program["id"] = programId
+                program["zones"] = programGroup[programId].values()
+                programs.append(program)
+
+        return {
+            "date": rmTimestampToDateAsString(dayTimestamp, "%Y-%m-%d"),
+            "dateTimestamp": dayTimestamp,
+            "programs": programs
+        }
+
+    def __sumDurations(self, groupBy, minTimestamp, maxTimestamp, withManualPrograms):
+        ### [key, user, machine and real seconds, cycles] ordered by key
+        conditions, params = self.__rangeCondition(minTimestamp, maxTimestamp)
+        if not withManualPrograms:
+            conditions.append("usersch_id!=0")
+
+        # Days are summed from the sums of each program run, a local time day for each row costs more than the query
+        groupColumn = {"day": "tokenTimestamp", "zone": "zid", "program": "usersch_id"}[groupBy]
+        records = self.database.execute("SELECT %s, SUM(user_sec), SUM(machine_sec), SUM(real_sec), COUNT(*) FROM %s %s "\
+                                        "GROUP BY 1 ORDER BY 1" % (groupColumn, self._tableName, self.__where(conditions)), params)
+
+        if groupBy != "day":
+            return [[row[0], int(row[1]), int(row[2]), int(row[3]), row[4]] for row in records]
+
+        results = []
+        total = None
+        for row in records:
+            dayTimestamp = rmGetStartOfDay(int(row[0]))
+            if total is None or total[0] != dayTimestamp:
+                total = [dayTimestamp, 0, 0, 0, 0]
+                results.append(total)
+            total[1] += int(row[1])
+            total[2] += int(row[2])
+            total[3] += int(row[3])
+            total[4] += row[4]
+        return results
+
+    def __rangeCondition(self, minTimestamp, maxTimestamp):
+        conditions = []
+        params = []
+        if minTimestamp:
+            conditions.append("?<=tokenTimestamp")
+            params.append(minTimestamp)
+        if maxTimestamp:
+            conditions.append("tokenTimestamp<?")
+            params.append(maxTimestamp)
+        return conditions, params
+
+    def __where(self, conditions):
+        if conditions:
+            return "WHERE " + " AND ".join(conditions)
+        return ""
+
+    def iterRecords(self, minTimestamp, maxTimestamp, pageSize = None):
+        ### Generator over the (ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp)
+        ### rows with minTimestamp <= tokenTimestamp < maxTimestamp (None for no limit), ordered by tokenTimestamp, program,
+        ### zone and start time. Rows are read RecordsPageSize at a time so any range uses the same memory.
+        pageSize = pageSize or RMWaterLogTable.RecordsPageSize
+        afterKey = None
+        while True:
+            rows = self.getRecordsPage(minTimestamp, maxTimestamp, afterKey, pageSize)
+            for row in rows:
+                yield row
+            if len(rows) < pageSize:
+                return
+            lastRow = rows[-1]
+            afterKey = (lastRow[8], lastRow[1], lastRow[2], lastRow[0])
+
+    @rmReadOnly
+    def getRecordsPage(self, minTimestamp, maxTimestamp, afterKey, limit):
+        ### At most limit rows of iterRecords() after afterKey (tokenTimestamp, usersch_id, zid, ts_started) of the previous page
+        if(self.database.isOpen()):
+            conditions, params = self.__rangeCondition(minTimestamp, maxTimestamp)
+            if afterKey:
+                tokenTimestamp, pid, zid, startTime = afterKey
+                conditions.append("tokenTimestamp>=? AND (tokenTimestamp>? OR (tokenTimestamp=? AND "\
+                                  "(usersch_id>? OR (usersch_id=? AND (zid>? OR (zid=? AND ts_started>?))))))")
+                params += [tokenTimestamp, tokenTimestamp, tokenTimestamp, pid, pid, zid, zid, startTime]
+
+            return [tuple(row) for row in self.database.execute("SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp "\
+                                                                 "FROM %s %s ORDER BY tokenTimestamp, usersch_id, zid, ts_started LIMIT ?" %
+                                                                 (self._tableName, self.__where(conditions)), params + [limit])]
+        return []
+
+    def iterDays(self, minTimestamp, maxTimestamp):
+        ### Generator over the days of getRecords(), only the day being built is kept in memory
+        for day in self.__days(self.iterRecords(minTimestamp, maxTimestamp)):
+            yield day
+
+    def __days(self, rows):
+        ### Days built from the rows of iterRecords(), one at a time
+        dayTimestamp = None
+        tokens = None
+        for row in rows:
+            rowDayTimestamp = rmGetStartOfDay(int(row[8]))
+            if rowDayTimestamp != dayTimestamp:
+                if tokens:
+                    yield self.__buildDay(dayTimestamp, tokens)
+                dayTimestamp = rowDayTimestamp
+                tokens = OrderedDict()
+
+            programGroup = tokens.get(row[7], None)
+            if programGroup is None:
+                programGroup = OrderedDict()
+                tokens[row[7]] = programGroup
+
+            zones = programGroup.get(row[1], None)
+            if zones is None:
+                zones = OrderedDict()
+                programGroup[row[1]] = zones
+
+            zone = zones.get(row[2], None)
+            if zone is None:
+                zone = OrderedDict()
+                zone["uid"] = row[2]
+                zone["flag"] = row[6]
+                zone["cycles"] = []
+                zones[row[2]] = zone
+
+            cycles = zone["cycles"]
+
+            info = OrderedDict()
+
+            info["id"] = len(cycles) + 1
+            info["startTime"] = rmTimestampToDateAsString(row[0])
+            info["startTimestamp"] = row[0]
+            info["userDuration"] = row[3]
+            info["machineDuration"] = row[4]
+            info["realDuration"] = row[5]
+
+            cycles.append(info)
+
+        if tokens:
+            yield self.__buildDay(dayTimestamp, tokens)
+
+    @rmReadOnly
+    def getRecords(self, minTimestamp, maxTimestamp):
+        if(self.database.isOpen()):
+            # The whole read runs here, the rows come from the cursor without the pages of iterRecords()
+            conditions, params = self.__rangeCondition(minTimestamp, maxTimestamp)
+            rows = self.database.execute("SELECT ts_started, usersch_id, zid, user_sec, machine_sec, real_sec, flag, token, tokenTimestamp "\
+                                         "FROM %s %s ORDER BY tokenTimestamp, usersch_id, zid, ts_started" % (self._tableName, self.__where(conditions)), params)
+            return {"days": list(self.__days(rows))}
 
-                cycles.append(info)
+        return None
 
+    @rmReadOnly
+    def getRecordsEx(self, minTimestamp, maxTimestamp, withManualPrograms = False):
+        if(self.database.isOpen()):
             results = {"days": []}
-
-            for dayTimestamp in tempResults:
-                programs = []
-                day = {
+            for dayTimestamp, userDuration, machineDuration, realDuration, cycles in self.__sumDurations("day", minTimestamp, maxTimestamp, withManualPrograms):
+                results["days"].append({
+                    "dayTimestamp": dayTimestamp,
                     "date": rmTimestampToDateAsString(dayTimestamp, "%Y-%m-%d"),
-                    "dateTimestamp": dayTimestamp,
-                    "programs": programs
-                }
-                results["days"].append(day)
-
-                dayGroup = tempResults[dayTimestamp]
-                for token in dayGroup:
-
-                    tempPrograms = dayGroup[token]
-                    for programId in tempPrograms:
-                        zones = []
-                        program = OrderedDict()
-                        program["id"] = programId
-                        program["zones"] = zones
-                        programs.append(program)
-
-                        tempZones = tempPrograms[programId]
-                        for zoneId in tempZones:
-                            zones.append(tempZones[zoneId])
-
+                    "realDuration": realDuration,
+                    "userDuration": userDuration
+                })
             return results
 
         return None
 
-    def getRecordsEx(self, minTimestamp, maxTimestamp, withManualPrograms = False):
+    @rmReadOnly
+    def getDurationTotals(self, minTimestamp, maxTimestamp, groupBy = "day", withManualPrograms = True):
+        ### User, machine and real watering seconds and number of cycles summed by SQLite per "day", "zone" or "program"
         if(self.database.isOpen()):
-
-            #if withManualPrograms:
-            #    sqlCondition = " AND usersch_id != 0 "
-            #    sqlConditionForced = " WHERE usersch_id != 0"
-            #else:
-            #    sqlCondition = ""
-            #    sqlConditionForced = ""
-
-            if minTimestamp and maxTimestamp:
-                records = self.database.execute("SELECT tokenTimestamp, SUM(real_sec) realDuration, SUM(user_sec) userDuration, usersch_id FROM %s "\
-                                                 "WHERE ?<=tokenTimestamp AND tokenTimestamp<? GROUP BY tokenTimestamp "\
-                                                 "ORDER BY tokenTimestamp" % self._tableName, (minTimestamp, maxTimestamp)
-                                                )
-            elif minTimestamp:
-                records = self.database.execute("SELECT tokenTimestamp, SUM(real_sec) realDuration, SUM(user_sec) userDuration, usersch_id FROM %s "\
-                                                 "WHERE ?<=tokenTimestamp GROUP BY tokenTimestamp "\
-                                                 "ORDER BY tokenTimestamp" % self._tableName, (minTimestamp, )
-                                                )
-            elif maxTimestamp:
-                records = self.database.execute("SELECT tokenTimestamp, SUM(real_sec), SUM(user_sec) userDuration duration, usersch_id FROM %s "\
-                                                 "WHERE tokenTimestamp<? GROUP BY tokenTimestamp "\
-                                                 "ORDER BY tokenTimestamp" % self._tableName, (maxTimestamp, )
-                                                )
-            else:
-                records = self.database.execute("SELECT tokenTimestamp, SUM(real_sec) realDuration, SUM(user_sec) userDuration, usersch_id FROM %s "\
-                                                 "GROUP BY tokenTimestamp ORDER BY tokenTimestamp, usersch_id, zid" % self._tableName
-                                            )
-
-            tempResults = OrderedDict()
-
-            for row in records:
-                if not withManualPrograms and int(row[3]) == 0:
-                    continue
-
-                dayTimestamp = rmGetStartOfDay(int(row[0]))
-                totalDurations = tempResults.get(dayTimestamp, None) # List with real and user durations
-
-                if totalDurations is None:
-                    totalDurations = [int(row[1]), int(row[2])]
+            results = []
+            for key, userDuration, machineDuration, realDuration, cycles in self.__sumDurations(groupBy, minTimestamp, maxTimestamp, withManualPrograms):
+                total = OrderedDict()
+                if groupBy == "day":
+                    total["dayTimestamp"] = key
+                    total["date"] = rmTimestampToDateAsString(key, "%Y-%m-%d")
+                elif groupBy == "zone":
+                    total["zid"] = key
                 else:
-                    totalDurations[0] += int(row[1])
-                    totalDurations[1] += int(row[2])
-
-
-                tempResults[dayTimestamp] = totalDurations
-
-            results = {"days": []}
-
-            for dayTimestamp in tempResults:
-                date = rmTimestampToDateAsString(dayTimestamp, "%Y-%m-%d")
-
-                day = {
-                    "dayTimestamp": dayTimestamp,
-                    "date": date,
-                    "realDuration": tempResults.get(dayTimestamp)[0],
-                    "userDuration": tempResults.get(dayTimestamp)[1]
-                }
-                results["days"].append(day)
-
+                    total["pid"] = key
+                total["userDuration"] = userDuration
+                total["machineDuration"] = machineDuration
+                total["realDuration"] = realDuration
+                total["cycles"] = cycles
+                results.append(total)
             return results
 
         return None
 
+    @rmReadOnly
     def getZoneRealWateringTime(self, programID, zoneID, minTimestamp, maxTimestamp):
         if(self.database.isOpen()):
             if programID is None:
@@ -664,6 +722,7 @@ class RMWaterLogTable(RMTable):
         return None
 
 
+    @rmReadOnly
     def getLastWatering(self, withManualPrograms = False):
         if (self.database.isOpen()):
             record = self.database.execute("SELECT * FROM %s ORDER BY ts_started DESC LIMIT 1" % self._tableName).fetchone()
@@ -7,15 +7,41 @@
 from collections import OrderedDict
 
 from RMUtilsFramework.rmTimeUtils import rmTimestampToDateAsString
+from RMUtilsFramework.rmDownsample import rmDownsample, RMDownsampleModes
 from RMDataFramework.rmForecastInfo import RMForecastInfo
 from RMDataFramework.rmMixerData import RMMixerData
-from rmDatabase import RMTable
+from rmDatabase import RMTable, rmReadOnly
+from rmRollupTable import RMRollupTable
 from RMUtilsFramework.rmLogging import log
 
+##-----------------------------------------------------------------------------------------------------
+## Daily, weekly and monthly rollups of the mixer values, a day is the row of its last forecast.
+## All rollups have sourceID SourceID.
+##
+class RMMixerDataRollupTable(RMRollupTable):
+
+    TableName = "mixerDataRollup"
+    Fields = ("temperature", "rh", "wind", "solarRad", "skyCover", "rain", "et0", "pop", "qpf", "pressure", "dewPoint",
+              "minTemp", "maxTemp", "minRH", "maxRH", "et0calc", "et0final")
+    SourceID = 0
+
+    def _getDayAggregates(self, sourceID, dayTimestamp, nextDayTimestamp, keepArchived):
+        row = self.database.execute("SELECT %s FROM mixerData WHERE ?<=timestamp AND timestamp<? "\
+                                    "AND forecastID=(SELECT MAX(forecastID) FROM mixerData WHERE ?<=timestamp AND timestamp<?)" % self._aggregateColumns(),
+                                    (dayTimestamp, nextDayTimestamp, dayTimestamp, nextDayTimestamp, )).fetchone()
+        return self._aggregatesFromRow(row)
+
+    def _getRawDays(self, sourceID):
+        return self._daysFromTimestamps(self.database.execute("SELECT DISTINCT timestamp FROM mixerData ORDER BY timestamp"))
+
 ##-----------------------------------------------------------------------------------------------------
 ##
 ##
 class RMMixerDataTable(RMTable):
+
+    SeriesFields = ("temperature", "rh", "wind", "solarRad", "skyCover", "rain", "et0", "pop", "qpf", "condition", "pressure",
+                    "dewPoint", "minTemp", "maxTemp", "minRH", "maxRH", "et0calc", "et0final")
+
     def initialize(self):
         self.database.execute("CREATE TABLE IF NOT EXISTS mixerData ("\
                                             "forecastID INTEGER NOT NULL, "\
@@ -42,8 +68,15 @@ class RMMixerDataTable(RMTable):
                                             #"FOREIGN KEY(forecastID) REFERENCES forecast(ID), "\
                                             "PRIMARY KEY(forecastID, timestamp)"\
                                             ")")
+        self.createIndexes()
         self.database.commit()
 
+        self.rollupTable = RMMixerDataRollupTable(self.database)
+
+    def createIndexes(self):
+        # Timestamp ranges and GROUP BY timestamp with the last forecast: getLastRecordsByThreshold, getLastRecordForDayForSimulator
+        self.database.execute("CREATE INDEX IF NOT EXISTS mixerData_timestamp_forecastID ON mixerData(timestamp, forecastID)")
+
     def addRecords(self, forecastID, forecastTimestamp, values):
         if(self.database.isOpen()):
             valuesToInsert = [(forecastID,
@@ -69,11 +102,13 @@ class RMMixerDataTable(RMTable):
                                value.et0final
                                 ) for value in values]
 
-            self.database.executeMany("INSERT INTO mixerData(forecastID, forecastTimestamp, timestamp, "\
+            # A day mixed again for the same forecast replaces the previous values
+            self.database.executeMany("INSERT OR REPLACE INTO mixerData(forecastID, forecastTimestamp, timestamp, "\
                                       "temperature, rh, wind, solarRad, skyCover, rain, et0, pop, qpf, "\
                                       "condition, pressure, dewPoint, "\
                                       "minTemp, maxTemp, minRH, maxRH, et0calc, et0final) "\
                                       "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", valuesToInsert)
+            self.rollupTable.updateDays(RMMixerDataRollupTable.SourceID, [value.timestamp for value in values])
             self.database.commit()
 
     def deleteOlderDataByTimestampCollision(self, values):
@@ -81,8 +116,10 @@ class RMMixerDataTable(RMTable):
             timestampsToDelete = [(value.timestamp,) for value in values]
             self.database.executeMany("DELETE FROM mixerData "\
                                   "WHERE timestamp=? ", timestampsToDelete)
+            self.rollupTable.updateDays(RMMixerDataRollupTable.SourceID, [value.timestamp for value in values])
             self.database.commit()
 
+    @rmReadOnly
     def getRecordsByThreshold(self, minTimestamp = None, maxTimestamp = None, orderAsc = True, asDict = False):
         result = []
         if(self.database.isOpen()):
@@ -125,6 +162,7 @@ class RMMixerDataTable(RMTable):
 
         return result
 
+    @rmReadOnly
     def getLastRecordsByThreshold(self, minTimestamp = None, maxTimestamp = None, orderAsc = True, asDict = False, noOfRecords = None):
         if asDict:
             result = OrderedDict()
@@ -180,6 +218,39 @@ class RMMixerDataTable(RMTable):
 
         return result
 
+    @rmReadOnly
+    def getDownsampledRecords(self, field, minTimestamp, maxTimestamp, threshold, mode = "lttb"):
+        ### At most threshold (timestamp, value) points of a field from the last forecast of each day with
+        ### minTimestamp <= timestamp < maxTimestamp (None for no limit), reduced while reading (see rmDownsample)
+        if not field in RMMixerDataTable.SeriesFields or not mode in RMDownsampleModes:
+            log.error("Cannot downsample mixerData field %s with mode %s" % (`field`, `mode`))
+            return None
+
+        if(self.database.isOpen()):
+            params = []
+            conditions = []
+            if minTimestamp:
+                conditions.append("?<=timestamp")
+                params.append(minTimestamp)
+            if maxTimestamp:
+                conditions.append("timestamp<?")
+                params.append(maxTimestamp)
+            where = ""
+            if conditions:
+                where = "WHERE " + " AND ".join(conditions)
+
+            # The last forecast of each day is found in the index alone, then only its row is read by primary
+            # key (CROSS JOIN keeps that order). Only the reduced series is kept in memory.
+            series = "SELECT mixerData.timestamp, mixerData.%s FROM "\
+                     "(SELECT timestamp, MAX(forecastID) forecastID FROM mixerData %s GROUP BY timestamp) latest "\
+                     "CROSS JOIN mixerData ON mixerData.forecastID=latest.forecastID AND mixerData.timestamp=latest.timestamp "\
+                     "WHERE mixerData.%s IS NOT NULL" % (field, where, field)
+            count = self.database.execute("SELECT COUNT(*) FROM (%s)" % series, params).fetchone()[0]
+            rows = self.database.execute(series + " ORDER BY mixerData.timestamp", params)
+            return rmDownsample(((row[0], row[1]) for row in rows), count, threshold, mode)
+        return None
+
+    @rmReadOnly
     def getRecordsByForecast(self, useInsertOrder = False):
         result = OrderedDict()
         if(self.database.isOpen()):
@@ -219,6 +290,7 @@ class RMMixerDataTable(RMTable):
                     result[forecastID] = {"timestamp" : forecastTimestamp, "values": [mixerData, ]}
         return result
 
+    @rmReadOnly
     def getRecordsForLastForecast(self):
         forecast = None
         values = None
@@ -255,6 +327,7 @@ class RMMixerDataTable(RMTable):
 
         return forecast, values
 
+    @rmReadOnly
     def getLastRecordForDayForSimulator(self, dayTimestamp):
         result = OrderedDict()
 
@@ -298,6 +371,7 @@ class RMMixerDataTable(RMTable):
 
         return result
 
+    @rmReadOnly
     def getLastKnownConditionForDay(self, dayTimestamp):
         if(self.database.isOpen()):
             minTimestamp = dayTimestamp
@@ -342,6 +416,7 @@ class RMMixerDataTable(RMTable):
             if commit:
                 self.database.commit()
 
+    @rmReadOnly
     def getLastRecordsForecast(self):
         if self.database.isOpen():
             record = self.database.execute("SELECT MAX(forecastID), MAX(forecastTimestamp) FROM mixerData").fetchone()
@@ -351,6 +426,7 @@ class RMMixerDataTable(RMTable):
     def clear(self, commit):
         if(self.database.isOpen()):
             self.database.execute("DELETE FROM mixerData")
+            self.rollupTable.clear(False)
             if commit:
                 self.database.commit()
 
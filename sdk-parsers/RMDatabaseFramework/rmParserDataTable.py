@@ -11,7 +11,10 @@ from RMDataFramework.rmWeatherData import RMWeatherData
 from RMDataFramework.rmParserConfig import RMParserConfig
 from RMDataFramework.rmUserSettings import globalSettings
 from RMUtilsFramework.rmTimeUtils import rmTimestampToDateAsString, rmGetStartOfDay, rmCurrentDayTimestamp, rmNormalizeTimestamp
-from rmDatabase import RMTable
+from RMUtilsFramework.rmDownsample import rmDownsample, RMDownsampleModes
+from rmDatabase import RMTable, rmReadOnly
+from rmRollupTable import RMRollupTable
+from rmForecastAccuracyTable import RMForecastAccuracyTable
 from RMUtilsFramework.rmLogging import log
 
 ##-----------------------------------------------------------------------------------------------------
@@ -142,10 +145,39 @@ class RMParserUserDataTable(RMTable):
         return valuesToInsert
 
 
+##-----------------------------------------------------------------------------------------------------
+## Daily, weekly and monthly rollups of each parser (sourceID is the parser ID). A day is computed from
+## the rows of the forecast that history compaction keeps for it: the newest one with the last timestamp
+## of the day. Compacted days keep the rollup computed from their hourly rows before compaction.
+##
+class RMParserDataRollupTable(RMRollupTable):
+
+    TableName = "parserDataRollup"
+    Fields = ("temperature", "rh", "wind", "solarRad", "skyCover", "rain", "et0", "pop", "qpf", "pressure", "dewPoint")
+
+    def _getDayAggregates(self, parserID, dayTimestamp, nextDayTimestamp, keepArchived):
+        row = self.database.execute("SELECT forecastID, archived FROM parserData WHERE parserID=? AND ?<=timestamp AND timestamp<? "\
+                                    "ORDER BY timestamp DESC, forecastID DESC LIMIT 1", (parserID, dayTimestamp, nextDayTimestamp, )).fetchone()
+        if row is None:
+            return {}
+        if row[1] and keepArchived and self._hasDay(parserID, dayTimestamp):
+            return None
+
+        row = self.database.execute("SELECT %s FROM parserData WHERE parserID=? AND ?<=timestamp AND timestamp<? AND forecastID=?" % self._aggregateColumns(),
+                                    (parserID, dayTimestamp, nextDayTimestamp, row[0], )).fetchone()
+        return self._aggregatesFromRow(row)
+
+    def _getRawDays(self, parserID):
+        return self._daysFromTimestamps(self.database.execute("SELECT DISTINCT timestamp FROM parserData WHERE parserID=? ORDER BY timestamp", (parserID, )))
+
 ##-----------------------------------------------------------------------------------------------------
 ##
 ##
 class RMParserDataTable(RMTable):
+
+    SeriesFields = ("temperature", "minTemperature", "maxTemperature", "rh", "minRh", "maxRh", "wind", "solarRad", "skyCover",
+                    "rain", "et0", "pop", "qpf", "condition", "pressure", "dewPoint")
+
     def initialize(self):
         self.database.execute("CREATE TABLE IF NOT EXISTS parserData ("\
                                             "forecastID INTEGER NOT NULL, "\
@@ -173,8 +205,32 @@ class RMParserDataTable(RMTable):
                                             "FOREIGN KEY(parserID) REFERENCES parser(ID), "\
                                             "PRIMARY KEY(forecastID, parserID, timestamp)"\
                                             ")")
+        self.createIndexes()
+
+        # History compaction watermark: data from forecasts with ID <= forecastID is already compacted for that parser.
+        self.database.execute("CREATE TABLE IF NOT EXISTS parserDataCompaction ("\
+                                            "parserID INTEGER PRIMARY KEY, "\
+                                            "forecastID INTEGER NOT NULL DEFAULT 0"\
+                                            ")")
+
+        # Digest of the last result saved by each parser (see rmWeatherDataDigest), its forecast and the timestamp
+        # of the last run that returned the same result
+        self.database.execute("CREATE TABLE IF NOT EXISTS parserResultDigest ("\
+                                            "parserID INTEGER PRIMARY KEY, "\
+                                            "forecastID INTEGER NOT NULL, "\
+                                            "digest VARCHAR(40) NOT NULL, "\
+                                            "lastRunTimestamp INTEGER DEFAULT NULL"\
+                                            ")")
         self.database.commit()
 
+        self.rollupTable = RMParserDataRollupTable(self.database)
+        self.accuracyTable = RMForecastAccuracyTable(self.database)
+        self.__lastHistoryThreshold = None
+
+    def createIndexes(self):
+        # Lookups by parser and timestamp range: getMinMax, history compaction, getRecordsByParserID and deletes
+        self.database.execute("CREATE INDEX IF NOT EXISTS parserData_parserID_timestamp_forecastID ON parserData(parserID, timestamp, forecastID)")
+
     def addRecords(self, forecastID, parserID, values):
         if(self.database.isOpen()):
 
@@ -225,6 +281,8 @@ class RMParserDataTable(RMTable):
                                             "wind, solarRad, skyCover, rain, et0, pop, qpf, "\
                                             "condition, pressure, dewPoint, userData) "\
                                             "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", valuesToInsert)
+            self.rollupTable.updateDays(parserID, minMaxMap.keys())
+            self.accuracyTable.addForecast(parserID, forecastID, values)
             self.database.commit()
 
     def removeEntriesWithParserIdAndTimestamp(self, parserID, values):
@@ -234,11 +292,43 @@ class RMParserDataTable(RMTable):
                 timestamps.append((value.timestamp))
 
             minTS = int(min(timestamps))
+            maxTS = self.database.execute("SELECT MAX(timestamp) FROM parserData WHERE parserID=? AND timestamp>=?", (parserID, minTS)).fetchone()[0]
 
             self.database.execute("DELETE FROM parserData WHERE parserID=? AND timestamp>=?", (parserID, minTS))
+
+            # The days that lost their rows, rollups of the days with new values are updated again by addRecords()
+            if maxTS is not None:
+                dayTimestamps = []
+                dayTimestamp = rmGetStartOfDay(minTS)
+                while dayTimestamp <= maxTS:
+                    dayTimestamps.append(dayTimestamp)
+                    dayTimestamp = rmGetStartOfDay(dayTimestamp + 129600)
+                self.rollupTable.updateDays(parserID, dayTimestamps)
+
+            self.database.commit()
+
+
+
+    def setResultDigest(self, parserID, forecastID, digest):
+        if self.database.isOpen():
+            self.database.execute("INSERT OR REPLACE INTO parserResultDigest (parserID, forecastID, digest) VALUES(?, ?, ?)", (parserID, forecastID, digest, ))
             self.database.commit()
 
+    def setResultLastRun(self, parserID, forecastID, timestamp):
+        ### A run at timestamp returned the result already saved with forecastID
+        if self.database.isOpen():
+            self.database.execute("UPDATE parserResultDigest SET lastRunTimestamp=? WHERE parserID=? AND forecastID=?", (timestamp, parserID, forecastID, ))
+            self.database.commit()
 
+    @rmReadOnly
+    def getUnchangedResultForecastID(self, parserID, digest):
+        ### The forecast of the newest values saved by the parser if they were saved from a result with this digest
+        if self.database.isOpen():
+            row = self.database.execute("SELECT forecastID FROM parserResultDigest WHERE parserID=? AND digest=? "\
+                                        "AND forecastID=(SELECT MAX(forecastID) FROM parserData WHERE parserID=?)", (parserID, digest, parserID, )).fetchone()
+            if row:
+                return row[0]
+        return None
 
     def clearHistory(self, parserID, commit):
         if self.database.isOpen():
@@ -259,13 +349,26 @@ class RMParserDataTable(RMTable):
 
     def deleteRecordsHistoryByDayThreshold(self, parserID, minDayTimestampThresold, maxDayTimestampThresold, commit = True):
         if(self.database.isOpen()):
-            # Delete very old data
-            rows = self.database.execute("DELETE FROM parserData WHERE timestamp<?", (minDayTimestampThresold, ))
+            # Delete very old data, the threshold moves only once per day
+            if self.__lastHistoryThreshold != minDayTimestampThresold:
+                self.database.execute("DELETE FROM parserData WHERE timestamp<?", (minDayTimestampThresold, ))
+                self.accuracyTable.deletePendingByDayThreshold(minDayTimestampThresold)
+                self.__lastHistoryThreshold = minDayTimestampThresold
+
+            # Only the days with data from forecasts newer than the watermark can change. The unary + keeps
+            # the planner on the primary key (forecastID range) instead of walking the whole parser index.
+            row = self.database.execute("SELECT MIN(timestamp), MAX(timestamp) FROM parserData WHERE forecastID>? AND +parserID=?",
+                                        (self.__getCompactionWatermark(parserID), parserID, )).fetchone()
+            if row[0] is not None:
+                minTimestamp = rmGetStartOfDay(row[0])
+                maxTimestamp = rmGetStartOfDay(rmGetStartOfDay(row[1]) + 129600) # start of next day, DST safe
+            else:
+                minTimestamp = maxTimestamp = maxDayTimestampThresold
 #SELECT f.ID, f.timestamp, p.rowid, p.timestamp, p.temperature, p.rh, p.wind, p.solarRad, p.skyCover, p.rain, p.et0, p.pop, p.qpf, p.condition, p.pressure, p.dewPoint, p.archived FROM parserData p, forecast f WHERE f.ID=p.forecastID ORDER BY p.timestamp DESC, p.forecastID DESC
             # Compute new data
             query = "SELECT f.ID, f.timestamp, p.rowid, p.timestamp, p.temperature, p.rh, p.wind, p.solarRad, p.skyCover, p.rain, p.et0, p.pop, p.qpf, p.condition, p.pressure, p.dewPoint, p.archived "\
-                    "FROM parserData p, forecast f WHERE f.ID=p.forecastID AND p.parserID=? ORDER BY p.timestamp DESC, p.forecastID DESC"
-            rows = self.database.execute(query, (parserID, ))
+                    "FROM parserData p, forecast f WHERE f.ID=p.forecastID AND p.parserID=? AND ?<=p.timestamp AND p.timestamp<? ORDER BY p.timestamp DESC, p.forecastID DESC"
+            rows = self.database.execute(query, (parserID, minTimestamp, maxTimestamp, ))
 
             tempData = OrderedDict()
             rowIdsToDelete = []
@@ -274,11 +377,17 @@ class RMParserDataTable(RMTable):
 
             lastDayTimestamp = None
             lastForecastID = None
+            forecastDays = {}
 
             for row in rows:
                 forecastID = row[0]
-                forecastDayTimestamp = rmGetStartOfDay(row[1])
-                dayTimestamp = rmGetStartOfDay(row[3])
+                forecastDayTimestamp = forecastDays.get(forecastID)
+                if forecastDayTimestamp is None:
+                    forecastDayTimestamp = forecastDays[forecastID] = rmGetStartOfDay(row[1])
+
+                # Rows come in descending timestamp order so only compute the day when leaving the current one
+                if lastDayTimestamp is None or row[3] < lastDayTimestamp:
+                    dayTimestamp = rmGetStartOfDay(row[3])
 
                 if lastDayTimestamp != dayTimestamp: # Enter a new day
                     lastDayTimestamp = dayTimestamp
@@ -291,8 +400,7 @@ class RMParserDataTable(RMTable):
                     rowIdsToDelete.append(str(row[2]))
                     continue
 
-                timestamp = rmNormalizeTimestamp(row[3])
-                #timestampOffset = timestamp - dayTimestamp
+                #timestampOffset = rmNormalizeTimestamp(row[3]) - dayTimestamp
 
                 dayData = tempData.get(dayTimestamp, None)
                 if dayData is None:
@@ -349,6 +457,18 @@ class RMParserDataTable(RMTable):
                                     dayData["skyCover"], dayData["rain"], dayData["et0"], dayData["pop"], dayData["qpf"],
                                     dayData["condition"], dayData["pressure"], dayData["dewPoint"], dayData["rowid"]))
 
+            # The rollups of the days about to be compacted are computed while their hourly rows still exist,
+            # these final values are the observations the older forecasts of the days are compared with
+            compactedDays = [dayTimestamp for dayTimestamp in tempData if not tempData[dayTimestamp]["data"]["archived"]]
+            if compactedDays:
+                self.rollupTable.updateDays(parserID, compactedDays)
+                rollups = self.rollupTable.getRecords(parserID, "day", min(compactedDays), max(compactedDays) + 1)
+                observations = {}
+                for dayTimestamp in compactedDays:
+                    observed = dict((field, (values["count"], values["sum"])) for field, values in rollups.get(dayTimestamp, {}).items())
+                    observations[dayTimestamp] = (tempData[dayTimestamp]["data"]["forecastID"], observed)
+                self.accuracyTable.addObservations(parserID, observations)
+
             # Delete unnecessary data
             if rowIdsToDelete:
                 self.database.execute("DELETE FROM parserData WHERE rowid IN(%s)" % ",".join(rowIdsToDelete))
@@ -358,12 +478,34 @@ class RMParserDataTable(RMTable):
                 query = "UPDATE parserData SET timestamp=?, temperature=?, rh=?, wind=?, solarRad=?, skyCover=?, rain=?, et0=?, pop=?, qpf=?, condition=?, pressure=?, dewPoint=?, archived=1 WHERE rowid=?"
                 self.database.executeMany(query, newData)
 
-            self.database.execute("DELETE FROM forecast WHERE processed <> 0 AND ID NOT IN (SELECT DISTINCT forecastID FROM parserData)")
+            self.__setCompactionWatermark(parserID, self.__getForecastWatermark(maxDayTimestampThresold))
+
+            self.database.execute("DELETE FROM forecast WHERE processed <> 0 AND NOT EXISTS (SELECT 1 FROM parserData WHERE forecastID=forecast.ID)")
 
             if commit:
                 self.database.commit()
 
+    def __getCompactionWatermark(self, parserID):
+        row = self.database.execute("SELECT forecastID FROM parserDataCompaction WHERE parserID=?", (parserID, )).fetchone()
+        if row:
+            return row[0]
+        return 0
+
+    def __setCompactionWatermark(self, parserID, forecastID):
+        self.database.execute("INSERT OR REPLACE INTO parserDataCompaction (parserID, forecastID) VALUES(?, ?)", (parserID, forecastID, ))
+
+    def __getForecastWatermark(self, maxDayTimestampThresold):
+        ### Highest forecast ID that, together with all older forecasts, was issued before the threshold day.
+        row = self.database.execute("SELECT MIN(ID) FROM forecast WHERE timestamp>=?", (maxDayTimestampThresold, )).fetchone()
+        if row[0] is not None:
+            return row[0] - 1
+        row = self.database.execute("SELECT MAX(ID) FROM forecast").fetchone()
+        if row[0] is not None:
+            return row[0]
+        return 0
 
+
+    @rmReadOnly
     def getLastForecastByParser(self):
 
         if self.database.isOpen():
@@ -388,8 +530,12 @@ class RMParserDataTable(RMTable):
     #    return None
 
 
-            #SELECT pd.pID, f.* FROM (SELECT max(pd.forecastID) fID, pd.parserID pID FROM parserData pd  GROUP BY pd.parserID) pd, forecast f WHERE pd.fID=f.ID ORDER BY f.ID DESC, pd.pID DESC;
-            records = self.database.execute("SELECT pd.pID, f.* FROM (SELECT max(pd.forecastID) fID, pd.parserID pID FROM parserData pd  GROUP BY pd.parserID) pd, forecast f WHERE pd.fID=f.ID ORDER BY f.ID DESC, pd.pID DESC")
+            # The forecast timestamp is the one of the last run that returned the same result (see setResultLastRun)
+            records = self.database.execute("SELECT pd.pID, f.ID, MAX(f.timestamp, IFNULL(d.lastRunTimestamp, f.timestamp)), f.processed "\
+                                            "FROM (SELECT max(pd.forecastID) fID, pd.parserID pID FROM parserData pd  GROUP BY pd.parserID) pd "\
+                                            "JOIN forecast f ON pd.fID=f.ID "\
+                                            "LEFT JOIN parserResultDigest d ON d.parserID=pd.pID AND d.forecastID=pd.fID "\
+                                            "ORDER BY f.ID DESC, pd.pID DESC")
 
             for row in records:
                 allRecords[row[0]] = RMForecastInfo(row[1], row[2], row[3])
@@ -397,6 +543,7 @@ class RMParserDataTable(RMTable):
             return allRecords
         return None
 
+    @rmReadOnly
     def getLatestRecordsKeys(self):
         ### key[0] is forecastID, key[1] is parserID
         if self.database.isOpen():
@@ -414,6 +561,7 @@ class RMParserDataTable(RMTable):
             return allRecords
         return None
 
+    @rmReadOnly
     def getRecordsForKey(self, key, ignoreDisabledParser = False):
         ### key[0] is forecastID, key[1] is parserID
         if self.database.isOpen():
@@ -447,6 +595,7 @@ class RMParserDataTable(RMTable):
             return allRecords
         return None
 
+    @rmReadOnly
     def getRecordsByParserName(self, parserName):
         results = OrderedDict()
         if self.database.isOpen():
@@ -496,6 +645,7 @@ class RMParserDataTable(RMTable):
 
         return results
 
+    @rmReadOnly
     def getRecordsByParserID(self, parserID, minDayTimestamp = None, maxDayTimestamp = None):
         results = OrderedDict()
         if self.database.isOpen():
@@ -558,6 +708,79 @@ class RMParserDataTable(RMTable):
 
         return results
 
+    @rmReadOnly
+    def getLatestRecordsByParserID(self, parserID, minTimestamp, maxTimestamp):
+        ### Values with minTimestamp <= timestamp < maxTimestamp, from the newest forecast that has each timestamp
+        results = []
+        if self.database.isOpen():
+            records = self.database.execute("SELECT MAX(forecastID), * FROM parserData "\
+                                            "WHERE parserID=? AND ?<=timestamp AND timestamp<? GROUP BY timestamp ORDER BY timestamp",
+                                            (parserID, minTimestamp, maxTimestamp))
+            for row in records:
+                weatherData = RMWeatherData(row[3])
+                weatherData.temperature = row[4]
+                weatherData.minTemperature = row[5]
+                weatherData.maxTemperature = row[6]
+                weatherData.rh = row[7]
+                weatherData.minRh = row[8]
+                weatherData.maxRh = row[9]
+                weatherData.wind = row[10]
+                weatherData.solarRad = row[11]
+                weatherData.skyCover = row[12]
+                weatherData.rain = row[13]
+                weatherData.et0 = row[14]
+                weatherData.pop = row[15]
+                weatherData.qpf = row[16]
+                weatherData.condition = row[17]
+                weatherData.pressure = row[18]
+                weatherData.dewPoint = row[19]
+                weatherData.userData = row[20]
+
+                results.append(weatherData)
+
+        return results
+
+    @rmReadOnly
+    def getDownsampledRecordsByParserID(self, parserID, field, minTimestamp, maxTimestamp, threshold, mode = "lttb"):
+        ### At most threshold (timestamp, value) points of a field from the newest forecast of each timestamp with
+        ### minTimestamp <= timestamp < maxTimestamp (None for no limit), reduced while reading (see rmDownsample)
+        if not field in RMParserDataTable.SeriesFields or not mode in RMDownsampleModes:
+            log.error("Cannot downsample parserData field %s with mode %s" % (`field`, `mode`))
+            return None
+
+        if self.database.isOpen():
+            params = [parserID]
+            conditions = "parserID=?"
+            if minTimestamp:
+                conditions += " AND ?<=timestamp"
+                params.append(minTimestamp)
+            if maxTimestamp:
+                conditions += " AND timestamp<?"
+                params.append(maxTimestamp)
+
+            # The newest forecast of each timestamp is found in the index alone, then only its row is read by
+            # primary key (CROSS JOIN keeps that order, otherwise SQLite scans every row of the parser).
+            # Only the reduced series is kept in memory, the rows are read from the cursor.
+            params.append(parserID)
+            series = "SELECT parserData.timestamp, parserData.%s FROM "\
+                     "(SELECT timestamp, MAX(forecastID) forecastID FROM parserData WHERE %s GROUP BY timestamp) latest "\
+                     "CROSS JOIN parserData ON parserData.forecastID=latest.forecastID AND parserData.parserID=? "\
+                     "AND parserData.timestamp=latest.timestamp WHERE parserData.%s IS NOT NULL" % (field, conditions, field)
+            count = self.database.execute("SELECT COUNT(*) FROM (%s)" % series, params).fetchone()[0]
+            rows = self.database.execute(series + " ORDER BY parserData.timestamp", params)
+            return rmDownsample(((row[0], row[1]) for row in rows), count, threshold, mode)
+        return None
+
+    @rmReadOnly
+    def getTimestampRangeByForecast(self, forecastIDs):
+        ### Oldest and newest value timestamps saved with these forecasts
+        if self.database.isOpen() and forecastIDs:
+            ids = ",".join([str(id) for id in forecastIDs])
+            row = self.database.execute("SELECT MIN(timestamp), MAX(timestamp) FROM parserData WHERE forecastID IN(%s)" % ids).fetchone()
+            return row[0], row[1]
+        return None, None
+
+    @rmReadOnly
     def getMinMax(self, parserID, dayTimestamp):
         ### Min and Max are computed only from the last forecast for that day.
 
@@ -615,11 +838,18 @@ class RMParserDataTable(RMTable):
     def deleteRecordsByParser(self, parserID):
         if(self.database.isOpen()):
             self.database.execute("DELETE FROM parserData WHERE parserID=?", (parserID, ))
+            self.database.execute("DELETE FROM parserDataCompaction WHERE parserID=?", (parserID, ))
+            self.rollupTable.deleteRecords(parserID, False)
+            self.accuracyTable.deleteRecords(parserID, False)
+            self.database.execute("DELETE FROM parserResultDigest WHERE parserID=?", (parserID, ))
             self.database.commit()
 
     def clear(self, commit):
         if(self.database.isOpen()):
             self.database.execute("DELETE FROM parserData")
+            self.rollupTable.clear(False)
+            self.accuracyTable.clear(False)
+            self.database.execute("DELETE FROM parserResultDigest")
             if commit:
                 self.database.commit()
 
@@ -665,4 +895,108 @@ class RMParserDataTable(RMTable):
             return b
         if b == None:
             return a
-        return max(a, b)
\ No newline at end of file
+        return max(a, b)
+
+#-----------------------------------------------------------------------------------------------------------
+# Main Test Unit
+#
+if __name__ == "__main__":
+    import random, time, rmDatabase
+    from rmDatabase import RMParsersDatabase
+    from rmForecastInfoTable import RMForecastTable
+
+    rmDatabase.USE_COMMAND_THREAD__ = False
+    random.seed(1)
+
+    simulatedDay = [rmGetStartOfDay(int(time.time()) - 400 * 86400)]
+    rmCurrentDayTimestamp = lambda: simulatedDay[0] # used by clearHistory()
+
+    def openDatabase():
+        database = RMParsersDatabase(":memory:")
+        database.open()
+        parserTable = RMParserTable(database)
+        for parserID in range(1, 21):
+            parserTable.addParser("parser%d.py" % parserID, "Parser %d" % parserID, True)
+        return RMForecastTable(database), RMParserDataTable(database)
+
+    def forecastValues(timestamp, hours):
+        timestamp = timestamp - (timestamp % 3600)
+        values = []
+        for hour in range(1, hours + 1):
+            value = RMWeatherData(timestamp + hour * 3600)
+            value.temperature = round(random.uniform(-5, 35), 2)
+            value.rh = round(random.uniform(20, 100), 2)
+            value.wind = round(random.uniform(0, 8), 2)
+            value.qpf = random.choice([0, 0, 1.5])
+            value.condition = random.choice([None, 1, 2])
+            values.append(value)
+        return values
+
+    compactionTime = [0]
+    clearHistory = RMParserDataTable.clearHistory
+    def timedClearHistory(self, parserID, commit):
+        startTime = time.time()
+        clearHistory(self, parserID, commit)
+        compactionTime[0] += time.time() - startTime
+    RMParserDataTable.clearHistory = timedClearHistory
+
+    def simulateRun(tables, parserIDs, hour, fullHistory):
+        ### One parser manager run: a new forecast and 10 days of hourly values for each parser.
+        values = forecastValues(simulatedDay[0] + hour * 3600, 240)
+        for forecastTable, parserDataTable in tables:
+            forecast = forecastTable.addRecord(simulatedDay[0] + hour * 3600)
+            for parserID in parserIDs:
+                if fullHistory: # compact everything, like before the watermark existed
+                    parserDataTable.database.execute("DELETE FROM parserDataCompaction")
+                if parserID % 2:
+                    parserDataTable.removeEntriesWithParserIdAndTimestamp(parserID, values)
+                parserDataTable.addRecords(forecast.id, parserID, values)
+            forecastTable.markRecordsAsProcessed([forecast.id])
+
+    def nextDay():
+        simulatedDay[0] = rmGetStartOfDay(simulatedDay[0] + 129600)
+
+    #-------------------------------------------------------------------------------------------------------
+    # Incremental compaction must leave the same data as compacting the whole history on every run.
+    incremental = openDatabase()
+    full = openDatabase()
+    for day in range(12):
+        for hour in (1, 7, 13, 19):
+            random.seed(day * 24 + hour)
+            simulateRun([incremental], [1, 2, 3], hour, False)
+            random.seed(day * 24 + hour)
+            simulateRun([full], [1, 2, 3], hour, True)
+        nextDay()
+
+    query = "SELECT * FROM parserData ORDER BY parserID, timestamp, forecastID"
+    incrementalRows = [tuple(row) for row in incremental[1].database.execute(query)]
+    fullRows = [tuple(row) for row in full[1].database.execute(query)]
+    print "Incremental compaction matches full compaction: %s (%d rows)" % (incrementalRows == fullRows, len(fullRows))
+
+    #-------------------------------------------------------------------------------------------------------
+    # Per run latency with 20 parsers and 365 days of compacted history.
+    forecastTable, parserDataTable = openDatabase()
+    database = parserDataTable.database
+    parserIDs = range(1, 21)
+
+    simulatedDay[0] = rmGetStartOfDay(int(time.time()) - 3 * 86400)
+    dayTimestamp = rmGetStartOfDay(simulatedDay[0] - 364 * 86400)
+    while dayTimestamp < simulatedDay[0]:
+        forecast = forecastTable.addRecord(dayTimestamp)
+        database.executeMany("INSERT INTO parserData(forecastID, parserID, timestamp, temperature, rh, wind, qpf, archived) VALUES(?, ?, ?, ?, ?, ?, ?, 1)",
+                             [(forecast.id, parserID, dayTimestamp, random.uniform(-5, 35), random.uniform(20, 100), random.uniform(0, 8), 0) for parserID in parserIDs])
+        dayTimestamp = rmGetStartOfDay(dayTimestamp + 129600)
+    forecastTable.markRecordsAsProcessed(range(1, forecast.id + 1))
+    database.commit()
+
+    for day in range(2):
+        for hour in (1, 7, 13, 19):
+            simulateRun([(forecastTable, parserDataTable)], parserIDs, hour, False)
+        nextDay()
+
+    for name, fullHistory in (("whole history", True), ("incremental", False)):
+        compactionTime[0] = 0
+        for hour in (1, 7, 13, 19):
+            simulateRun([(forecastTable, parserDataTable)], parserIDs, hour, fullHistory)
+        nextDay()
+        print "Compacting %s: %.1f ms per run (%d parsers, %d rows)" % (name, compactionTime[0] * 250, len(parserIDs), database.execute("SELECT COUNT(*) FROM parserData").fetchone()[0])
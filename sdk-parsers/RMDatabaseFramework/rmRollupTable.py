@@ -0,0 +1,211 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+from collections import OrderedDict
+
+from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay, rmGetStartOfWeek, rmGetStartOfMonth, rmYMDFromTimestamp, rmYMDToTimestamp
+from rmDatabase import RMTable, rmReadOnly
+from RMUtilsFramework.rmLogging import log
+
+RMRollupPeriods = ("day", "week", "month")
+
+##-----------------------------------------------------------------------------------------------------
+## Count, sum, min and max of each field for every day, ISO week and month of a source (a parser, or the
+## mixer). The day rollups are computed from the raw rows of a single forecast, chosen by the subclass
+## in _getDayAggregates(), the weeks and months are summed from the day rollups. The rollups are kept
+## when the raw rows are deleted because they are older than the history size.
+##
+class RMRollupTable(RMTable):
+
+    TableName = None
+    Fields = ()
+
+    def initialize(self):
+        self.database.execute("CREATE TABLE IF NOT EXISTS %s ("\
+                                            "sourceID INTEGER NOT NULL, "\
+                                            "period VARCHAR(8) NOT NULL, "\
+                                            "timestamp INTEGER NOT NULL, "\
+                                            "field VARCHAR(16) NOT NULL, "\
+                                            "count INTEGER NOT NULL, "\
+                                            "sum DECIMAL DEFAULT NULL, "\
+                                            "min DECIMAL DEFAULT NULL, "\
+                                            "max DECIMAL DEFAULT NULL, "\
+                                            "PRIMARY KEY(sourceID, period, timestamp, field)"\
+                                            ")" % self.TableName)
+        self.database.commit()
+
+    def updateDays(self, sourceID, dayTimestamps):
+        ### Recomputes these days from the raw rows, then the weeks and months that contain them. Not committed.
+        if self.database.isOpen():
+            weeks = set()
+            months = set()
+            for dayTimestamp in set(rmGetStartOfDay(timestamp) for timestamp in dayTimestamps):
+                aggregates = self._getDayAggregates(sourceID, dayTimestamp, self.__nextPeriod("day", dayTimestamp), True)
+                if aggregates is None: # unchanged
+                    continue
+                self.__setPeriod(sourceID, "day", dayTimestamp, aggregates)
+                weeks.add(rmGetStartOfWeek(dayTimestamp))
+                months.add(rmGetStartOfMonth(dayTimestamp))
+
+            for period, timestamps in (("week", weeks), ("month", months)):
+                for timestamp in timestamps:
+                    self.__setPeriod(sourceID, period, timestamp, self.__sumDays(sourceID, timestamp, self.__nextPeriod(period, timestamp)))
+
+    def rebuild(self, sourceID):
+        ### Computes the rollups of all the days that still have raw rows
+        if self.database.isOpen():
+            self.updateDays(sourceID, self._getRawDays(sourceID))
+            self.database.commit()
+
+    @rmReadOnly
+    def getRecords(self, sourceID, period, minTimestamp = None, maxTimestamp = None):
+        ### {periodTimestamp: {field: {count, sum, min, max, mean}}} with minTimestamp <= periodTimestamp < maxTimestamp
+        results = OrderedDict()
+        if self.database.isOpen():
+            query = "SELECT timestamp, field, count, sum, min, max FROM %s WHERE sourceID=? AND period=?" % self.TableName
+            params = [sourceID, period]
+            if minTimestamp is not None:
+                query += " AND ?<=timestamp"
+                params.append(minTimestamp)
+            if maxTimestamp is not None:
+                query += " AND timestamp<?"
+                params.append(maxTimestamp)
+
+            for row in self.database.execute(query + " ORDER BY timestamp", params):
+                values = results.get(row[0])
+                if values is None:
+                    values = results[row[0]] = {}
+                values[row[1]] = {
+                    "count": row[2],
+                    "sum": row[3],
+                    "min": row[4],
+                    "max": row[5],
+                    "mean": row[3] / float(row[2]) if row[3] is not None and row[2] else None
+                }
+        return results
+
+    @rmReadOnly
+    def verify(self, sourceID):
+        ### Consistency check: the days that have raw rows are recomputed from them and the weeks and months
+        ### from the day rollups. Returns the (period, timestamp, field, stored, expected) differences.
+        differences = []
+        if self.database.isOpen():
+            days = self.getRecords(sourceID, "day")
+            weeks = set()
+            months = set()
+            for dayTimestamp in self._getRawDays(sourceID):
+                expected = self._getDayAggregates(sourceID, dayTimestamp, self.__nextPeriod("day", dayTimestamp), True)
+                if expected is None: # archived, only the rollup must exist
+                    if not dayTimestamp in days:
+                        differences.append(("day", dayTimestamp, None, None, None))
+                    continue
+                differences.extend(self.__compare("day", dayTimestamp, days.get(dayTimestamp, {}), expected))
+
+            for dayTimestamp in days:
+                weeks.add(rmGetStartOfWeek(dayTimestamp))
+                months.add(rmGetStartOfMonth(dayTimestamp))
+
+            for period, timestamps in (("week", weeks), ("month", months)):
+                stored = self.getRecords(sourceID, period)
+                for timestamp in set(stored.keys()) | timestamps:
+                    expected = self.__sumDays(sourceID, timestamp, self.__nextPeriod(period, timestamp))
+                    differences.extend(self.__compare(period, timestamp, stored.get(timestamp, {}), expected))
+
+            for difference in differences:
+                log.error("%s rollup for source %s differs: %s" % (self.TableName, sourceID, difference))
+        return differences
+
+    def deleteRecords(self, sourceID, commit = True):
+        if self.database.isOpen():
+            self.database.execute("DELETE FROM %s WHERE sourceID=?" % self.TableName, (sourceID, ))
+            if commit:
+                self.database.commit()
+
+    def clear(self, commit):
+        if self.database.isOpen():
+            self.database.execute("DELETE FROM %s" % self.TableName)
+            if commit:
+                self.database.commit()
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Implemented by the subclasses
+    #
+    def _getDayAggregates(self, sourceID, dayTimestamp, nextDayTimestamp, keepArchived):
+        ### {field: (count, sum, min, max)} of the day, {} for no data, None when the raw rows were compacted
+        ### and keepArchived (the stored rollup was computed before and is kept)
+        return {}
+
+    def _getRawDays(self, sourceID):
+        ### Start of the days with raw rows
+        return []
+
+    def _aggregateColumns(self):
+        return ", ".join(["COUNT(%s), SUM(%s), MIN(%s), MAX(%s)" % (field, field, field, field) for field in self.Fields])
+
+    def _aggregatesFromRow(self, row):
+        aggregates = {}
+        for index, field in enumerate(self.Fields):
+            column = index * 4
+            if row[column]:
+                aggregates[field] = (row[column], row[column + 1], row[column + 2], row[column + 3])
+        return aggregates
+
+    def _hasDay(self, sourceID, dayTimestamp):
+        return self.database.execute("SELECT 1 FROM %s WHERE sourceID=? AND period='day' AND timestamp=? LIMIT 1" % self.TableName,
+                                     (sourceID, dayTimestamp, )).fetchone() is not None
+
+    def _daysFromTimestamps(self, rows):
+        ### Start of the days of the timestamps in the first column of rows, ordered by timestamp
+        days = []
+        nextDayTimestamp = None
+        for row in rows:
+            if nextDayTimestamp is None or row[0] >= nextDayTimestamp:
+                days.append(rmGetStartOfDay(row[0]))
+                nextDayTimestamp = self.__nextPeriod("day", days[-1])
+        return days
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def __setPeriod(self, sourceID, period, timestamp, aggregates):
+        self.database.execute("DELETE FROM %s WHERE sourceID=? AND period=? AND timestamp=?" % self.TableName, (sourceID, period, timestamp, ))
+        if aggregates:
+            self.database.executeMany("INSERT INTO %s (sourceID, period, timestamp, field, count, sum, min, max) VALUES(?, ?, ?, ?, ?, ?, ?, ?)" % self.TableName,
+                                      [(sourceID, period, timestamp, field) + values for field, values in aggregates.items()])
+
+    def __sumDays(self, sourceID, minTimestamp, maxTimestamp):
+        rows = self.database.execute("SELECT field, SUM(count), SUM(sum), MIN(min), MAX(max) FROM %s "\
+                                     "WHERE sourceID=? AND period='day' AND ?<=timestamp AND timestamp<? GROUP BY field" % self.TableName,
+                                     (sourceID, minTimestamp, maxTimestamp, ))
+        return dict((row[0], (row[1], row[2], row[3], row[4])) for row in rows)
+
+    def __nextPeriod(self, period, timestamp):
+        if period == "day":
+            return rmGetStartOfDay(timestamp + 129600) # DST safe
+        if period == "week":
+            return rmGetStartOfDay(timestamp + 7 * 86400 + 43200)
+        year, month, day = rmYMDFromTimestamp(timestamp)
+        return rmYMDToTimestamp(year + month // 12, month % 12 + 1, 1)
+
+    def __compare(self, period, timestamp, stored, expected):
+        differences = []
+        for field in set(stored.keys()) | set(expected.keys()):
+            storedValues = stored.get(field)
+            if storedValues is not None:
+                storedValues = (storedValues["count"], storedValues["sum"], storedValues["min"], storedValues["max"])
+            expectedValues = expected.get(field)
+
+            if storedValues is None or expectedValues is None or \
+               any(not self.__equal(a, b) for a, b in zip(storedValues, expectedValues)):
+                differences.append((period, timestamp, field, storedValues, expectedValues))
+        return differences
+
+    def __equal(self, a, b):
+        if a is None or b is None:
+            return a is b
+        return abs(a - b) <= 1e-6 * max(1.0, abs(a), abs(b)) # sums are added in a different order
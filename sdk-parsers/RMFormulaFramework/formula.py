@@ -6,6 +6,12 @@
 #
 
 import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Unused parameters should be passed as None
 ##########################asceDaily#######################################################
 #parameters
@@ -26,9 +32,12 @@ import math
 #   fKrs - 0.17 [] - constant used for solar radiation/temperature estimation. If == None the used value is 0.17
 #   fTDewpointC = 5.0 [degC] - dew point temperature - used for Ea estimation
 
+def asceDayOfYear(year, month, day):
+    return day - 32 + math.floor(275 * month / 9.0) + 2 * math.floor(3.0 / (month + 1)) + math.floor(month / 100.0 - (year % 4) / 4.0 + 0.975) # Eq.25
+
 def asceDaily(year, month, day, fTMinC, fTMaxC, fU2z, fU2m, fLat, fElevation, fRs, fEa, fRHMin, fRHMax, fPressure, fKrs, fTDewpointC):
     #//////////day of year////////////
-    fJ = day - 32 + math.floor(275 * month / 9.0) + 2 * math.floor(3.0 / (month + 1)) + math.floor(month / 100.0 - (year % 4) / 4.0 + 0.975) # Eq.25
+    fJ = asceDayOfYear(year, month, day)
     #print("->Day of year:", fJ)
     #/////////temperatures////////////
     fTMeanC = (fTMinC + fTMaxC) / 2
@@ -161,6 +170,132 @@ def asceDaily(year, month, day, fTMinC, fTMaxC, fU2z, fU2m, fLat, fElevation, fR
     return fETos
 
 ##########################end of asceDaily#######################################################
+
+##########################asceDailyBatch##################################################
+# Same computation as asceDaily for many days/locations at once. Every parameter can be
+# a sequence (one value per row, None for a missing value), a scalar shared by all rows
+# or None for all rows missing. The None fallback rules of asceDaily are applied per row.
+# fJ is the day of year as returned by asceDayOfYear().
+# Returns a numpy array with ET0 for each row or a list when numpy is not available.
+
+def asceDailyBatch(fJ, fTMinC, fTMaxC, fU2z = None, fU2m = None, fLat = None, fElevation = None, fRs = None, fEa = None,
+                   fRHMin = None, fRHMax = None, fPressure = None, fKrs = None, fTDewpointC = None):
+    if numpy is None:
+        return __asceDailyRows(fJ, fTMinC, fTMaxC, fU2z, fU2m, fLat, fElevation, fRs, fEa, fRHMin, fRHMax, fPressure, fKrs, fTDewpointC)
+
+    size = __batchSize((fJ, fTMinC, fTMaxC, fU2z, fU2m, fLat, fElevation, fRs, fEa, fRHMin, fRHMax, fPressure, fKrs, fTDewpointC))
+
+    fJ = __column(fJ, size)
+    fTMinC = __column(fTMinC, size)
+    fTMaxC = __column(fTMaxC, size)
+    fU2z = __column(fU2z, size)
+    fU2m = __column(fU2m, size)
+    fLat = __column(fLat, size)
+    fElevation = __column(fElevation, size)
+    fRs = __column(fRs, size)
+    fEa = __column(fEa, size)
+    fRHMin = __column(fRHMin, size)
+    fRHMax = __column(fRHMax, size)
+    fPressure = __column(fPressure, size)
+    fKrs = __column(fKrs, size)
+    fTDewpointC = __column(fTDewpointC, size)
+
+    #/////////temperatures////////////
+    fTMeanC = (fTMinC + fTMaxC) / 2
+    fTMinK = 273.16 + fTMinC
+    fTMaxK = 273.16 + fTMaxC
+    #/////////delta///////////////////
+    fDelta = 2503.0 * numpy.exp(17.27 * fTMeanC / (fTMeanC + 237.3)) / numpy.power(fTMeanC + 237.3, 2) # Eq.5
+    #//////// es /////////////////////
+    fETMax = 0.6108 * numpy.exp(17.27 * fTMaxC / (fTMaxC + 237.3)) # Eq.7
+    fETMin = 0.6108 * numpy.exp(17.27 * fTMinC / (fTMinC + 237.3)) # Eq.7
+    fEs = (fETMax + fETMin) / 2 # Eq.6
+
+    hasRHMax = ~numpy.isnan(fRHMax)
+    hasRHMin = ~numpy.isnan(fRHMin)
+    hasDewpoint = ~numpy.isnan(fTDewpointC)
+    fTDew = numpy.where(hasDewpoint, fTDewpointC, fTMinC) # Eq.8 TDew approximated with TMin
+    fEa = numpy.where(~numpy.isnan(fEa), fEa,
+                      numpy.where(hasRHMax,
+                                  numpy.where(hasRHMin,
+                                              (fETMax * fRHMin / 100 + fETMin * fRHMax / 100) / 2,  # Eq.11
+                                              fETMin * fRHMax / 100),  # Eq.18
+                                  0.6108 * numpy.exp(17.27 * fTDew / (fTDew + 237.3))))  # Eq.8
+
+    #////////u2//////////////////////
+    fU2m = numpy.where(numpy.isnan(fU2m), 10.0, fU2m)
+    fU2 = numpy.where(numpy.isnan(fU2z), 2.0, fU2z * 4.87 / numpy.log(67.8 * fU2m - 5.42)) # Eq.33
+    fU2 = numpy.where(fU2 < 2.0, 2.0, fU2)
+
+    #////////dr, declin, omegas///////
+    fDr = 1.0 + 0.033 * numpy.cos(2 * math.pi / 365 * fJ)  # Eq.23
+    fDeclin = 0.409 * numpy.sin(2 * math.pi / 365 * fJ - 1.39)  # Eq.24
+    fLatRadian = math.pi / 180.0 * fLat
+    fOmegaS = numpy.arccos(numpy.clip(-numpy.tan(fLatRadian) * numpy.tan(fDeclin), -1.0, 1.0))  # Eq.27
+
+    #////////radiation stuff ////////////
+    fRa = 24.0 / math.pi * 4.92 * fDr * (fOmegaS * numpy.sin(fLatRadian) * numpy.sin(fDeclin) +
+                                         numpy.cos(fLatRadian) * numpy.cos(fDeclin) * numpy.sin(fOmegaS))  # Eq.21
+    hasElevation = ~numpy.isnan(fElevation)
+    fRSo = numpy.where(hasElevation, (0.75 + 2.0 * fElevation / 100000.0) * fRa, 0.75 * fRa)  # Eq.19
+
+    fKrs = numpy.where(numpy.isnan(fKrs), 0.17, fKrs)
+    fRsEstimated = fKrs * numpy.sqrt(fTMaxC - fTMinC) * fRa  # eq 4/appendix.pdf
+    fRsEstimated = numpy.where(fRsEstimated < 0, 0.0, fRsEstimated)
+    fRsEstimated = numpy.where(fRsEstimated > fRSo, fRSo, fRsEstimated)
+    fRs = numpy.where(numpy.isnan(fRs), fRsEstimated, fRs)
+
+    hasRSo = fRSo != 0
+    fFcd = 1.35 * fRs / numpy.where(hasRSo, fRSo, 1.0) - 0.35
+    fFcd = numpy.where(hasRSo, fFcd, 0.0)
+    fFcd = numpy.where(fFcd < 0.05, 0.05, fFcd)
+    fFcd = numpy.where(fFcd > 1, 1.0, fFcd)
+
+    SIGMA_DAY = 0.000000004901
+    fRnl = SIGMA_DAY * ((numpy.power(fTMinK, 4) + numpy.power(fTMaxK, 4)) / 2) * fFcd * (0.34 - 0.14 * numpy.sqrt(fEa))  # Eq.17
+    fRn = 0.77 * fRs - fRnl  # Eq.15, Eq.16
+
+    #///////////Pressure//////////////////
+    fPressure = numpy.where(numpy.isnan(fPressure), 101.3 * numpy.power((293 - 0.0065 * fElevation) / 293, 5.25), fPressure)  # Eq.3
+    PSYCON = 0.000665
+    fPsyCon = PSYCON * fPressure  # Eq.4
+
+    #///////////ET//////////////////
+    fCn = 900.0
+    fCd = 0.34
+    fETos = 0.408 * fDelta * fRn + fPsyCon * fCn / (fTMeanC + 273) * fU2 * (fEs - fEa)
+    fETos = fETos / (fDelta + fPsyCon * (1 + fCd * fU2))
+
+    return numpy.where(fETos < 0.0, 0.0, fETos)  # don't allow negative ET0
+
+def __column(values, size):
+    if values is None:
+        return numpy.full(size, numpy.nan)
+    # None entries become NaN and act as the missing value masks.
+    return numpy.broadcast_to(numpy.array(values, dtype=float), (size, ))
+
+def __batchSize(columns):
+    ### Number of rows: the length of the first sequence parameter, any of them can be a scalar
+    for column in columns:
+        if column is not None and hasattr(column, "__len__"):
+            try:
+                return len(column)
+            except TypeError: # 0-d numpy array
+                continue
+    return 1
+
+def __asceDailyRows(*columns):
+    size = __batchSize(columns)
+    rows = []
+    for column in columns:
+        if column is None or not hasattr(column, "__len__"):
+            column = [column] * size
+        rows.append([None if value is None else float(value) for value in column])
+
+    # asceDaily wants year/month/day, January 1st of a non leap year plus fJ - 1 days gives the same day of year.
+    return [asceDaily(2001, 1, row[0], *row[1:]) for row in zip(*rows)]
+
+##########################end of asceDailyBatch###########################################
 # Test code
 if __name__ == '__main__':
     #               year  ,month,day  ,minT ,maxT ,wind ,windalt,lat deg,elev(m),solar rad  , Ea(hum), RhMin ,RhMax  ,pressure   ,Krs  , TDew
@@ -175,3 +310,60 @@ if __name__ == '__main__':
     et0 = asceDaily(2012.0, 10.0, 15.0, 10.7, 27.3, None, None, 36.82, 98.5, None, None, None, None, None, None, None)
     print("Everything from temp \t\tET0=%f" % et0)
 
+
+    #--------------------------------------------------------------------------------------
+    # Batch vs scalar on a golden set covering all the None fallback paths
+    import random, time
+    random.seed(1)
+    def maybe(value):
+        return value if random.random() < 0.6 else None
+
+    golden = []
+    for i in range(5000):
+        tMin = random.uniform(-10, 25)
+        golden.append((random.randint(1, 365), tMin, tMin + random.uniform(0, 20), maybe(random.uniform(0, 12)),
+                       maybe(random.choice([2, 10])), random.uniform(-60, 60), maybe(random.uniform(0, 2000)),
+                       maybe(random.uniform(1, 30)), maybe(random.uniform(0.2, 3)), maybe(random.uniform(10, 60)),
+                       maybe(random.uniform(60, 100)), maybe(random.uniform(80, 105)), maybe(0.19), maybe(tMin - 2)))
+    # Pressure is required when elevation is missing
+    golden = [row if row[6] is not None or row[11] is not None else row[:11] + (101.3, ) + row[12:] for row in golden]
+
+    expected = [asceDaily(2001, 1, *row) for row in golden]
+    batch = asceDailyBatch(*[list(column) for column in zip(*golden)])
+    maxError = max(abs(e - b) for e, b in zip(expected, batch))
+    print("Batch vs scalar on %d rows \tmax error=%g (%s)" % (len(golden), maxError, "OK" if maxError < 1e-9 else "FAILED"))
+
+    # Scalar temperatures with sequence parameters
+    mixed = [(day, 10.7, 27.3, wind, 2, 36.82, 98.5) for day, wind in ((100, 2.3), (200, None), (300, 5.1))]
+    expected = [asceDaily(2001, 1, *(row + (None, None, None, None, None, None, None))) for row in mixed]
+    batch = asceDailyBatch([row[0] for row in mixed], 10.7, 27.3, [row[3] for row in mixed], 2, 36.82, 98.5)
+    maxError = max(abs(e - b) for e, b in zip(expected, batch))
+    print("Scalar and sequence parameters \tmax error=%g (%s)" % (maxError, "OK" if len(batch) == len(mixed) and maxError < 1e-9 else "FAILED"))
+
+    #--------------------------------------------------------------------------------------
+    # Throughput
+    for rowCount in (10000, 1000000):
+        if numpy is not None:
+            columns = numpy.random.RandomState(1).uniform(size=(4, rowCount))
+            fJ = numpy.floor(columns[0] * 365) + 1
+            fTMinC = columns[1] * 20
+            fTMaxC = fTMinC + columns[2] * 15
+            fU2z = columns[3] * 8
+        else:
+            fJ = [random.randint(1, 365) for i in range(rowCount)]
+            fTMinC = [random.uniform(0, 20) for i in range(rowCount)]
+            fTMaxC = [t + random.uniform(0, 15) for t in fTMinC]
+            fU2z = [random.uniform(0, 8) for i in range(rowCount)]
+
+        startTime = time.time()
+        asceDailyBatch(fJ, fTMinC, fTMaxC, fU2z, 10, 36.82, 98.5)
+        batchTime = time.time() - startTime
+
+        scalarRows = min(rowCount, 10000)
+        startTime = time.time()
+        for i in range(scalarRows):
+            asceDaily(2001, 1, fJ[i], fTMinC[i], fTMaxC[i], fU2z[i], 10, 36.82, 98.5, None, None, None, None, None, None, None)
+        scalarTime = (time.time() - startTime) * rowCount / scalarRows
+
+        print("%d rows \t\t\tbatch %.3fs (%d rows/s), scalar %.3fs (%d rows/s)" %
+              (rowCount, batchTime, rowCount / batchTime, scalarTime, rowCount / scalarTime))
@@ -0,0 +1,187 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# RMMixer checks on temporary databases:
+#  - fixture: 4 parsers with priorities, one of them observed, over yesterday and tomorrow. Each mixed
+#    field is compared with the value computed by hand in the table below, et0calc with asceDaily()
+#  - incremental: a new forecast from one parser mixes only its days, the result is the same as mixing
+#    all days again
+#  - determinism: the parsers order doesn't change the mixed values
+#  - benchmark: 20 parsers with 30 days of hourly values, all days mixed against the days of one parser run
+#
+
+import sys, time, random, shutil, tempfile, logging
+sys.path.append('../')
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp, rmGetStartOfDay, rmTimestampToYearMonthDay
+from RMUtilsFramework.rmCommandThread import RMCommandThread
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMDataFramework.rmUserSettings import globalSettings
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMDatabaseFramework.rmForecastInfoTable import RMForecastTable
+from RMDatabaseFramework.rmParserDataTable import RMParserTable, RMParserDataTable
+from RMDatabaseFramework.rmMixerDataTable import RMMixerDataTable
+from RMFormulaFramework.formula import asceDaily
+from RMParserFramework.rmMixer import RMMixer, RMMixerSource
+
+log.setLevel(logging.CRITICAL)
+
+databasePath = tempfile.mkdtemp()
+globalSettings.databasePath = databasePath
+globalSettings.location.latitude = 44.43
+globalSettings.location.elevation = 85.0
+RMCommandThread.createInstance()
+globalDbManager.initialize(databasePath)
+
+parserTable = RMParserTable(globalDbManager.parserDatabase)
+forecastTable = RMForecastTable(globalDbManager.parserDatabase)
+parserDataTable = RMParserDataTable(globalDbManager.parserDatabase)
+mixerDataTable = RMMixerDataTable(globalDbManager.mixerDatabase)
+mixer = RMMixer(parserDataTable, mixerDataTable)
+
+todayTimestamp = rmCurrentDayTimestamp()
+yesterdayTimestamp = rmGetStartOfDay(todayTimestamp - 43200)
+tomorrowTimestamp = rmGetStartOfDay(todayTimestamp + 129600)
+
+failed = False
+
+def check(name, value, expected):
+    global failed
+    ok = value == expected or (value is not None and expected is not None and abs(value - expected) < 1e-6)
+    if not ok:
+        failed = True
+        print "  %-30s %s, expected %s" % (name, value, expected)
+    return ok
+
+def weatherData(timestamp, **fields):
+    value = RMWeatherData(timestamp)
+    for field in fields:
+        setattr(value, field, fields[field])
+    return value
+
+def addParser(name):
+    parserConfig, isNew = parserTable.addParser(name + ".py", name, True)
+    return parserConfig.dbID
+
+def addForecast(parserValues):
+    ### parserValues: [(parserID, [RMWeatherData])]
+    forecast = forecastTable.addRecord()
+    for parserID, values in parserValues:
+        parserDataTable.addRecords(forecast.id, parserID, values)
+    return forecast
+
+def fields(values):
+    return [[getattr(value, field) for field in ("timestamp", "et0calc", "et0final") + RMMixer.MixedFields] for value in values]
+
+#-----------------------------------------------------------------------------------------------------------
+# Fixture
+#
+forecastA, forecastB, observedC, forecastD = [addParser(name) for name in ("Forecast A", "Forecast B", "Observed C", "Forecast D")]
+sources = [RMMixerSource(forecastA, 1), RMMixerSource(forecastB, 1), RMMixerSource(observedC, 0, True), RMMixerSource(forecastD, 0)]
+
+forecast = addForecast([
+    (forecastA, [weatherData(yesterdayTimestamp + 12 * 3600, temperature = 15.0, qpf = 5.0),
+                 weatherData(tomorrowTimestamp + 6 * 3600, temperature = 10.0, rh = 80.0, qpf = 1.0, wind = 2.0, condition = 1),
+                 weatherData(tomorrowTimestamp + 18 * 3600, temperature = 20.0, rh = 60.0, qpf = 2.0, wind = 4.0, condition = 2)]),
+    (forecastB, [weatherData(yesterdayTimestamp + 12 * 3600, temperature = 17.0),
+                 weatherData(tomorrowTimestamp + 12 * 3600, temperature = 18.0, rh = 70.0, qpf = 0.5, pop = 40.0, condition = 3)]),
+    (observedC, [weatherData(yesterdayTimestamp, temperature = 12.0, rain = 1.0),
+                 weatherData(yesterdayTimestamp + 12 * 3600, temperature = 16.0, rain = 2.0)]),
+    (forecastD, [weatherData(tomorrowTimestamp + 12 * 3600, temperature = 100.0, pressure = 101.0)])
+])
+
+expected = {
+    # past day: the observation parser wins over the forecasts even with a lower priority, forecasts fill the fields it doesn't have
+    yesterdayTimestamp: {"temperature": 14.0, "minTemp": 12.0, "maxTemp": 16.0, "rain": 3.0, "qpf": 5.0, "rh": None, "condition": None},
+    # next day: only the priority 1 forecasts are averaged (A: daily mean 15, sum 3.0, min 10, max 20), D only for the pressure
+    tomorrowTimestamp: {"temperature": 16.5, "minTemp": 14.0, "maxTemp": 19.0, "rh": 70.0, "minRH": 65.0, "maxRH": 75.0, "qpf": 1.75,
+                        "pop": 40.0, "wind": 3.0, "pressure": 101.0, "condition": 1, "rain": None}
+}
+
+values = mixer.run(forecast, sources, [yesterdayTimestamp, tomorrowTimestamp])
+print "fixture: %d days mixed" % len(values)
+check("days", [value.timestamp for value in values], [yesterdayTimestamp, tomorrowTimestamp])
+location = globalSettings.location
+for value in values:
+    for field in expected[value.timestamp]:
+        check("%d %s" % (value.timestamp, field), getattr(value, field), expected[value.timestamp][field])
+
+    year, month, day = rmTimestampToYearMonthDay(value.timestamp)
+    et0 = asceDaily(year, month, day, value.minTemp, value.maxTemp, value.wind, None, location.latitude, location.elevation,
+                    value.solarRad, None, value.minRH, value.maxRH, value.pressure, location.krs, value.dewPoint)
+    check("%d et0calc" % value.timestamp, value.et0calc, et0)
+    check("%d et0final" % value.timestamp, value.et0final, et0)
+
+check("saved", fields(mixerDataTable.getRecordsByForecast().get(forecast.id, {}).get("values", [])), fields(values))
+
+#-----------------------------------------------------------------------------------------------------------
+# Incremental mix and determinism
+#
+newForecast = addForecast([(forecastB, [weatherData(tomorrowTimestamp + 12 * 3600, temperature = 24.0, rh = 50.0, qpf = 0.0, condition = 3)])])
+incremental = mixer.run(newForecast, sources, [tomorrowTimestamp])
+full = mixer.mix(sources, [yesterdayTimestamp, tomorrowTimestamp], todayTimestamp)
+print "incremental: %d days mixed" % len(incremental)
+check("incremental days", [value.timestamp for value in incremental], [tomorrowTimestamp])
+check("incremental temperature", incremental[0].temperature, 19.5)
+check("incremental == full", fields(incremental), fields(full[1:]))
+check("yesterday unchanged", fields(full[:1]), fields(values[:1]))
+
+for attempt in range(10):
+    shuffled = list(sources)
+    random.shuffle(shuffled)
+    check("shuffled sources", fields(mixer.mix(shuffled, [yesterdayTimestamp, tomorrowTimestamp], todayTimestamp)), fields(full))
+
+print "FAILED" if failed else "OK"
+
+#-----------------------------------------------------------------------------------------------------------
+# Benchmark: 20 parsers x 30 days (10 past days), one parser run updates 7 days
+#
+rng = random.Random(1)
+days = [todayTimestamp]
+while len(days) < 30:
+    days.append(rmGetStartOfDay(days[-1] + 129600))
+firstDayTimestamp = days[0]
+for day in range(10):
+    firstDayTimestamp = rmGetStartOfDay(firstDayTimestamp - 43200)
+    days.insert(0, firstDayTimestamp)
+days = days[:30]
+
+def hourlyValues(days):
+    values = []
+    for dayTimestamp in days:
+        for hour in range(24):
+            values.append(weatherData(dayTimestamp + hour * 3600, temperature = rng.uniform(5, 30), rh = rng.uniform(30, 95),
+                                      wind = rng.uniform(0, 8), qpf = rng.choice([0.0, 0.0, 0.3]), pop = rng.uniform(0, 100),
+                                      pressure = rng.uniform(99, 102), dewPoint = rng.uniform(0, 15), condition = rng.randint(1, 5)))
+    return values
+
+benchmarkSources = []
+parserValues = []
+for index in range(20):
+    parserID = addParser("Benchmark %d" % index)
+    benchmarkSources.append(RMMixerSource(parserID, index % 3, index < 4))
+    parserValues.append((parserID, hourlyValues(days)))
+forecast = addForecast(parserValues)
+
+runs = 5
+startTime = time.time()
+for run in range(runs):
+    mixer.run(forecast, benchmarkSources, days)
+fullTime = (time.time() - startTime) / runs
+
+updatedDays = [day for day in days if day >= todayTimestamp][:7]
+forecast = addForecast([(benchmarkSources[10].parserID, hourlyValues(updatedDays))])
+startTime = time.time()
+for run in range(runs):
+    mixer.run(forecast, benchmarkSources, updatedDays)
+incrementalTime = (time.time() - startTime) / runs
+
+print "benchmark 20 parsers x 30 days: all days %.1f ms, days of one parser run (%d) %.1f ms" % \
+      (fullTime * 1000, len(updatedDays), incrementalTime * 1000)
+
+RMCommandThread.instance.stop()
+shutil.rmtree(databasePath)
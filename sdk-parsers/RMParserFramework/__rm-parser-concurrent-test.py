@@ -0,0 +1,169 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Concurrent parser runs:
+#  - RMWorkerPool: never more than maxWorkers commands run at once, a command abandoned after its deadline
+#    doesn't take a worker from the pool and its worker exits when it finishes
+#  - RMParserManager.CONCURRENT_RUN: a parser that misses PARSER_TIMEOUT is counted as failed and the values
+#    of its late finish are not stored, even when it finishes before the results are stored. The next run
+#    stores its values again.
+#
+
+import sys, os, imp, random, shutil, sqlite3, tempfile, threading, logging
+sys.path.append('../')
+
+import time
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMUtilsFramework.rmWorkerPool import RMWorkerPool
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMParserFramework.rmParserManager import RMParserManager
+imp.load_source("rmParserTestUtils", os.path.join(os.path.dirname(os.path.abspath(__file__)), "__rm-parser-test-utils.py"))
+from rmParserTestUtils import RMTestParser, createParserManager, runInChild
+
+log.setLevel(logging.CRITICAL)
+
+failed = False
+
+def check(name, ok):
+    global failed
+    if not ok:
+        print "  %s FAILED" % name
+        failed = True
+    return ok
+
+class ActiveCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.maxActive = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.active += 1
+            self.maxActive = max(self.maxActive, self.active)
+
+    def __exit__(self, *args):
+        with self.lock:
+            self.active -= 1
+
+def poolWorkers(name):
+    return len([thread for thread in threading.enumerate() if thread.name.startswith(name + "-")])
+
+#-----------------------------------------------------------------------------------------------------------
+# RMWorkerPool
+#
+counter = ActiveCounter()
+def task(duration):
+    with counter:
+        time.sleep(duration)
+    return duration
+
+pool = RMWorkerPool("pool", 3)
+startTime = time.time()
+commands = [pool.submit(RMCommand("task-%d" % index, True, task, (0.05, ))) for index in range(12)]
+finished = all([pool.waitForCommand(command, 5) for command in commands])
+elapsed = time.time() - startTime
+print "pool of 3: 12 commands in %.2f s, at most %d at once" % (elapsed, counter.maxActive)
+check("all commands finished", finished)
+check("at most 3 commands at once", counter.maxActive == 3)
+check("3 commands at once", elapsed < 12 * 0.05)
+
+release = threading.Event()
+slow = pool.submit(RMCommand("slow", True, release.wait))
+check("slow command abandoned", not pool.waitForCommand(slow, 0.1) and slow.abandoned)
+
+counter = ActiveCounter()
+commands = [pool.submit(RMCommand("task-%d" % index, True, task, (0.1, ))) for index in range(3)]
+finished = all([pool.waitForCommand(command, 5) for command in commands])
+print "abandoned command still running: %d workers, at most %d commands at once" % (poolWorkers("pool"), counter.maxActive)
+check("pool capacity preserved", finished and counter.maxActive == 3)
+
+release.set()
+slow.wait()
+time.sleep(0.1)
+print "abandoned command finished: %d workers" % poolWorkers("pool")
+check("abandoned worker exited", poolWorkers("pool") == 3)
+pool.stop()
+
+#-----------------------------------------------------------------------------------------------------------
+# RMParserManager.CONCURRENT_RUN
+#
+dayTimestamp = rmCurrentDayTimestamp()
+parserCounter = ActiveCounter()
+slowParserRelease = threading.Event()
+
+def generate(parser):
+    with parserCounter:
+        if parser.index == 0 and parser.runs == 0:
+            slowParserRelease.wait() # released after its deadline
+        time.sleep(0.05)
+
+    rng = random.Random(parser.runs * 100 + parser.index)
+    values = []
+    for hour in range(24):
+        value = RMWeatherData(dayTimestamp + hour * 3600)
+        value.temperature = round(rng.uniform(-5, 35), 2)
+        values.append(value)
+    return values
+
+def savedParsers(databasePath, forecastID):
+    ### Parsers with values saved with the forecast
+    connection = sqlite3.connect(os.path.join(databasePath, "rainmachine-parser.sqlite"))
+    rows = connection.execute("SELECT DISTINCT parserID FROM parserData WHERE forecastID=?", (forecastID, )).fetchall()
+    connection.close()
+    return set(row[0] for row in rows)
+
+def concurrentRun(databasePath):
+    RMParserManager.CONCURRENT_RUN = True
+    RMParserManager.MAX_CONCURRENT_PARSERS = 2
+    RMParserManager.PARSER_TIMEOUT = 0.3
+    manager = createParserManager(databasePath, [RMTestParser(index, generate) for index in range(4)])
+
+    # The slow parser finishes after its deadline, right before the parser results are stored
+    storeParserValues = manager._RMParserManager__storeParserValues
+    def finishLateThenStore(parserConfig, parser, *args):
+        if parser.index == 0 and not slowParserRelease.isSet():
+            slowParserRelease.set()
+            while parser.isRunning:
+                time.sleep(0.01)
+        return storeParserValues(parserConfig, parser, *args)
+    manager._RMParserManager__storeParserValues = finishLateThenStore
+
+    result = []
+    for run in range(2):
+        for parserConfig in manager.parsers:
+            if parserConfig.lastFailTimestamp is not None:
+                parserConfig.lastFailTimestamp -= 3600 # retry delay expired
+        newForecast, mixerDataValues = manager.run()
+        parserConfigs = manager.parsers.keys()
+        saved = savedParsers(databasePath, newForecast.id)
+        result.append({
+            "failCounters": [parserConfig.failCounter for parserConfig in parserConfigs],
+            "errors": [parser.lastKnownError for parser in manager.parsers.values()],
+            "saved": [parserConfig.dbID in saved for parserConfig in parserConfigs],
+            "maxActive": parserCounter.maxActive
+        })
+    RMCommandThread.instance.stop()
+    return result
+
+databasePath = tempfile.mkdtemp()
+result = runInChild(concurrentRun, databasePath)
+shutil.rmtree(databasePath)
+
+if check("RMParserManager.run()", result is not None):
+    first, second = result
+    for run, runResult in enumerate(result):
+        print "run %d: fail counters %s, values saved %s, at most %d parsers at once" % \
+              (run + 1, runResult["failCounters"], runResult["saved"], runResult["maxActive"])
+    check("timeout counted as a fail", first["failCounters"] == [1, 0, 0, 0] and first["errors"][0] == "Error: Timeout")
+    check("late values not stored", first["saved"] == [False, True, True, True])
+    check("stored on the next run", second["failCounters"] == [0, 0, 0, 0] and all(second["saved"]))
+    check("at most MAX_CONCURRENT_PARSERS", second["maxActive"] == 2)
+
+print "FAILED" if failed else "OK"
@@ -0,0 +1,124 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# 24 hourly runs of 5 parsers whose upstream model is updated every 6 hours, so most runs return the
+# result of the previous run, with and without skipping the results already saved:
+#  - the newest parser values and the mixer values must be the same
+#  - benchmark: rows written (inserted, updated or deleted) and time per run
+#  - the last run of an unchanged result is saved: after a restart the parser is not due before its interval
+#
+
+import sys, os, imp, random, shutil, sqlite3, tempfile, logging
+sys.path.append('../')
+
+import time
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp
+from RMUtilsFramework.rmCommandThread import RMCommandThread
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMParserFramework import rmParserManager
+imp.load_source("rmParserTestUtils", os.path.join(os.path.dirname(os.path.abspath(__file__)), "__rm-parser-test-utils.py"))
+from rmParserTestUtils import RMTestParser, createParserManager, runInChild
+
+log.setLevel(logging.CRITICAL)
+
+dayTimestamp = rmCurrentDayTimestamp()
+runs = 24
+modelInterval = 6 # runs between model updates
+
+def generate(parser):
+    model = parser.runs // modelInterval
+    rng = random.Random(model * 100 + parser.index)
+    values = []
+    for hour in range(240):
+        value = RMWeatherData(dayTimestamp + model * modelInterval * 3600 + hour * 3600)
+        value.temperature = round(rng.uniform(-5, 35), 2)
+        value.rh = round(rng.uniform(20, 100), 2)
+        value.qpf = rng.choice([0, 0, 1.5])
+        values.append(value)
+    return values
+
+def snapshot(databasePath):
+    ### Newest parser value of each timestamp and mixer value of each day
+    connection = sqlite3.connect(os.path.join(databasePath, "rainmachine-parser.sqlite"))
+    values = [list(row)[1:] for row in connection.execute("SELECT MAX(forecastID), parserID, timestamp, temperature, rh, qpf FROM parserData "\
+                                                           "GROUP BY parserID, timestamp ORDER BY parserID, timestamp")]
+    connection.close()
+    connection = sqlite3.connect(os.path.join(databasePath, "rainmachine-mixer.sqlite"))
+    mixerValues = [list(row)[1:] for row in connection.execute("SELECT MAX(forecastID), timestamp, temperature, rh, qpf FROM mixerData "\
+                                                                "GROUP BY timestamp ORDER BY timestamp")]
+    connection.close()
+    return [values, mixerValues]
+
+def benchmarkRun(databasePath, skipUnchanged):
+    manager = createParserManager(databasePath, [RMTestParser(index, generate) for index in range(5)])
+
+    if not skipUnchanged:
+        # Every result is saved again, as before the digests
+        manager.parserDataTable.getUnchangedResultForecastID = lambda parserID, digest: None
+
+    connection = globalDbManager.parserDatabase.connection
+    changes = connection.total_changes
+    unchanged = 0
+    startTime = time.time()
+    for run in range(runs):
+        manager.run()
+        unchanged += manager.lastRunStats["unchanged"]
+    elapsed = time.time() - startTime
+    changes = connection.total_changes - changes
+    RMCommandThread.instance.stop()
+
+    return {"rows": changes, "time": elapsed * 1000 / runs, "unchanged": unchanged, "snapshot": snapshot(databasePath)}
+
+def restartRun(databasePath):
+    ### Hourly runs of a parser with an hourly interval on a simulated clock, then its state is loaded again by preRun()
+    clock = [dayTimestamp + 3600]
+    rmParserManager.rmCurrentTimestamp = lambda: clock[0]
+    rmParserManager.RMParserManager.FORCE_RUN_PARSERS = False # run by parserInterval like on device
+    manager = createParserManager(databasePath, [RMTestParser(0, generate, 3600)])
+    lastRuns = []
+    for run in range(3):
+        manager.run()
+        lastRuns.append(manager.parsers.keys()[0].runtimeLastForecastInfo.timestamp)
+        clock[0] += 3600
+
+    clock[0] -= 1800 # half an hour after the last run
+    for parserConfig in manager.parsers:
+        parserConfig.runtimeLastForecastInfo = None
+    manager.preRun()
+    reloaded = manager.parsers.keys()[0].runtimeLastForecastInfo.timestamp
+    due = manager.isRunDue(clock[0])
+    RMCommandThread.instance.stop()
+    return {"lastRuns": lastRuns, "reloaded": reloaded, "due": due, "unchanged": manager.lastRunStats["unchanged"]}
+
+results = {}
+for skipUnchanged in (False, True):
+    databasePath = tempfile.mkdtemp(dir = os.path.dirname(os.path.abspath(__file__))) # not on a tmpfs
+    results[skipUnchanged] = runInChild(benchmarkRun, databasePath, skipUnchanged)
+    shutil.rmtree(databasePath)
+    print "%-24s %3d unchanged results  %7d rows written  %7.1f ms per run" % ("skip unchanged results" if skipUnchanged else "save every result",
+                                                                              results[skipUnchanged]["unchanged"], results[skipUnchanged]["rows"],
+                                                                              results[skipUnchanged]["time"])
+
+failed = False
+if results[True]["snapshot"] != results[False]["snapshot"]:
+    print "Different parser or mixer values"
+    failed = True
+if results[True]["unchanged"] != 5 * (runs - runs // modelInterval):
+    print "Unchanged results were saved"
+    failed = True
+
+databasePath = tempfile.mkdtemp()
+restart = runInChild(restartRun, databasePath)
+shutil.rmtree(databasePath)
+print "restart: last runs %s, reloaded last run %s, due half an hour later %s" % (restart["lastRuns"], restart["reloaded"], restart["due"])
+if restart["unchanged"] != 1 or restart["reloaded"] != restart["lastRuns"][-1] or restart["due"]:
+    print "Last run of an unchanged result lost on restart"
+    failed = True
+
+print "FAILED" if failed else "OK"
@@ -0,0 +1,154 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Parser runs on a simulated clock with the main loop sleeping until RMParserManager.getNextRunTimestamp()
+# compared to calling RMParserManager.run():
+#  - every second: the reference, run() itself decides at full resolution which parsers are eligible
+#    (intervals, 120-300s retry delays, 1 day lockout after 100 fails). The scheduler must produce exactly
+#    the same runs: same parsers, same order, same timestamps, same outcomes. With FORCE_RUN_PARSERS
+#    run() runs all parsers on each call, the reference is then the run every minute below.
+#  - every minute: the main loop before the scheduler. Same runs in the same order when all deadlines
+#    fall on the minute, otherwise its runs are late by up to a minute: each parser must run the same
+#    sequence with the scheduler, never later.
+# Wake ups are counted for each loop.
+#
+
+import sys, os, imp, shutil, tempfile, logging
+sys.path.append('../')
+
+from collections import OrderedDict
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay, rmCurrentTimestamp
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMParserFramework import rmParserManager
+from RMParserFramework.rmParserManager import RMParserManager
+imp.load_source("rmParserTestUtils", os.path.join(os.path.dirname(os.path.abspath(__file__)), "__rm-parser-test-utils.py"))
+from rmParserTestUtils import RMTestParser, createParserManager, runInChild
+from RMCore.rmMainManager import RMMainManager
+
+log.setLevel(logging.CRITICAL)
+
+startTimestamp = rmGetStartOfDay(rmCurrentTimestamp()) - 2 * 86400
+durations = {False: 2 * 86400, True: 6 * 3600} # with FORCE_RUN_PARSERS all parsers store values each minute
+clock = [startTimestamp]
+runs = []
+
+def generator(fails):
+    ### fails: run number -> True if that run returns no values
+    def values(parser):
+        failed = fails(parser.runs)
+        runs.append((clock[0], parser.parserName, not failed))
+        if failed:
+            return []
+        result = []
+        for hour in range(3):
+            value = RMWeatherData(clock[0] + hour * 3600)
+            value.temperature = 20 + (parser.runs + 1) % 10
+            result.append(value)
+        return result
+    return values
+
+scenarios = OrderedDict([
+    ("intervals", [600, 3600, 3 * 3600, 6 * 3600, 6 * 3600, 6 * 3600]),
+    ("intervals, retries and lockout", [600, 3600, 3 * 3600, 6 * 3600, 6 * 3600, 6 * 3600,
+                                        (3600, lambda run: run % 7 in (1, 2, 3, 4)), # 120, 150, 180, 210s retries
+                                        (3 * 3600, lambda run: run % 11 >= 2),       # up to the 300s retries
+                                        (6 * 3600, lambda run: run < 150)])          # 100 fails then 1 day lockout
+])
+
+def setup(databasePath, parsers):
+    rmParserManager.rmCurrentTimestamp = lambda: clock[0]
+    testParsers = []
+    for index, parser in enumerate(parsers):
+        interval, fails = parser if isinstance(parser, tuple) else (parser, lambda run: False)
+        testParsers.append(RMTestParser(index, generator(fails), interval))
+    manager = createParserManager(databasePath, testParsers)
+    manager.preRun() # as RMParserThread does on start
+    return manager
+
+def inChild(function, *args):
+    ### Runs function in a new process with its own database, returns its JSON result
+    databasePath = tempfile.mkdtemp()
+    result = runInChild(function, databasePath, *args)
+    shutil.rmtree(databasePath)
+    return result
+
+def pollingLoop(databasePath, parsers, forceRunParsers, duration, period):
+    RMParserManager.FORCE_RUN_PARSERS = forceRunParsers
+    manager = setup(databasePath, parsers)
+    wakeups = 0
+    for timestamp in xrange(startTimestamp, startTimestamp + duration, period):
+        clock[0] = timestamp
+        manager.run()
+        wakeups += 1
+    return {"runs": runs, "wakeups": wakeups}
+
+def scheduledLoop(databasePath, parsers, forceRunParsers, duration):
+    ### The RMMainManager loop without commands
+    RMParserManager.FORCE_RUN_PARSERS = forceRunParsers
+    manager = setup(databasePath, parsers)
+    wakeups = {"deadline": 0, "watchdog": 0}
+    timestamp = startTimestamp
+    while timestamp < startTimestamp + duration:
+        clock[0] = timestamp
+        if manager.isRunDue():
+            manager.run()
+
+        nextRunTimestamp = manager.getNextRunTimestamp()
+        if nextRunTimestamp is None or nextRunTimestamp - timestamp > RMMainManager.MaxWaitTime:
+            timestamp += RMMainManager.MaxWaitTime
+            wakeups["watchdog"] += 1
+        elif nextRunTimestamp > timestamp:
+            timestamp = nextRunTimestamp
+            wakeups["deadline"] += 1
+    return {"runs": runs, "wakeups": wakeups}
+
+def byParser(runs):
+    result = {}
+    for timestamp, name, ok in runs:
+        result.setdefault(name, []).append((timestamp, ok))
+    return result
+
+def compareByParser(reference, runs):
+    ### Delays of each parser's n-th run compared to the reference (None if the outcomes differ)
+    reference = byParser(reference)
+    delays = []
+    for name, parserRuns in byParser(runs).items():
+        for (timestamp, ok), (referenceTimestamp, referenceOk) in zip(parserRuns, reference.get(name, [])):
+            if ok != referenceOk:
+                return None
+            delays.append(timestamp - referenceTimestamp)
+    return delays
+
+failed = False
+for forceRunParsers in (False, True):
+    for name, parsers in scenarios.items():
+        duration = durations[forceRunParsers]
+        minute = inChild(pollingLoop, parsers, forceRunParsers, duration, 60)
+        if forceRunParsers:
+            exact = minute
+        else:
+            exact = inChild(pollingLoop, parsers, forceRunParsers, duration, 1)
+        scheduled = inChild(scheduledLoop, parsers, forceRunParsers, duration)
+
+        sameAsExact = scheduled["runs"] == exact["runs"]
+        sameAsMinute = scheduled["runs"] == minute["runs"]
+        delays = compareByParser(scheduled["runs"], minute["runs"])
+        neverLater = delays is not None and min(delays) >= 0
+        failed = failed or not sameAsExact or not neverLater
+
+        print "%s%s: %d runs in %d hours" % (name, " (FORCE_RUN_PARSERS)" if forceRunParsers else "", len(scheduled["runs"]), duration / 3600)
+        if not forceRunParsers:
+            print "  scheduler vs run() every second: %s" % ("identical runs" if sameAsExact else "DIFFERENT RUNS")
+        print "  scheduler vs run() every minute: %s, %s, minute loop late on %d runs (max %ds, mean %.1fs)" % \
+              ("identical runs" if sameAsMinute else "different timestamps",
+               "same runs per parser, never later" if neverLater else "RUNS DIFFER OR LATER",
+               len([delay for delay in delays or [] if delay > 0]), max(delays or [0]), float(sum(delays or [0])) / max(len(delays or []), 1))
+        print "  wake ups: every minute %d, scheduler %d (deadline %d, watchdog %d)" % \
+              (minute["wakeups"], sum(scheduled["wakeups"].values()), scheduled["wakeups"]["deadline"], scheduled["wakeups"]["watchdog"])
+
+print "FAILED" if failed else "OK"
@@ -0,0 +1,91 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# RMParserManager.run() with RMParser subclasses, whose values are views on their RMWeatherDataFrame, run one
+# after another and concurrently. Each run must save the values of every parser, mix their days and schedule
+# the next run.
+#
+
+import sys, os, imp, random, shutil, sqlite3, tempfile, logging
+sys.path.append('../')
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp, rmGetStartOfDay
+from RMUtilsFramework.rmCommandThread import RMCommandThread
+from RMDataFramework.rmWeatherData import RMWeatherData
+from RMParserFramework.rmParserManager import RMParserManager
+imp.load_source("rmParserTestUtils", os.path.join(os.path.dirname(os.path.abspath(__file__)), "__rm-parser-test-utils.py"))
+from rmParserTestUtils import RMTestParser, createParserManager, runInChild
+
+log.setLevel(logging.CRITICAL)
+
+dayTimestamp = rmCurrentDayTimestamp()
+runs = 3
+
+def generate(parser):
+    rng = random.Random(parser.runs * 100 + parser.index)
+    values = []
+    for hour in range(72):
+        value = RMWeatherData(dayTimestamp + hour * 3600)
+        value.temperature = round(rng.uniform(-5, 35), 2)
+        value.rh = round(rng.uniform(20, 100), 2)
+        value.qpf = rng.choice([0, 0, 1.5])
+        values.append(value)
+    return values
+
+def expectedValues(index, run):
+    parser = RMTestParser(index)
+    parser.runs = run
+    return [[value.timestamp, value.temperature, value.rh, value.qpf] for value in generate(parser)]
+
+def savedValues(databasePath, parserID, forecastID):
+    connection = sqlite3.connect(os.path.join(databasePath, "rainmachine-parser.sqlite"))
+    rows = [list(row) for row in connection.execute("SELECT timestamp, temperature, rh, qpf FROM parserData WHERE parserID=? AND forecastID=? "\
+                                                     "ORDER BY timestamp", (parserID, forecastID))]
+    connection.close()
+    return rows
+
+def managerRun(databasePath, concurrent):
+    RMParserManager.CONCURRENT_RUN = concurrent
+    manager = createParserManager(databasePath, [RMTestParser(index, generate) for index in range(3)])
+
+    result = []
+    for run in range(runs):
+        newForecast, mixerDataValues = manager.run()
+        result.append({
+            "values": [savedValues(databasePath, parserConfig.dbID, newForecast.id) for parserConfig in manager.parsers],
+            "mixedDays": sorted(value.timestamp for value in mixerDataValues or []),
+            "nextRunTimestamp": manager.getNextRunTimestamp()
+        })
+    RMCommandThread.instance.stop()
+    return result
+
+failed = False
+days = sorted(set(rmGetStartOfDay(dayTimestamp + hour * 3600) for hour in range(72)))
+for concurrent in (False, True):
+    databasePath = tempfile.mkdtemp()
+    result = runInChild(managerRun, databasePath, concurrent)
+    name = "concurrent run" if concurrent else "serial run"
+
+    if result is None:
+        print "%s: RMParserManager.run() failed" % name
+        failed = True
+    else:
+        for run, runResult in enumerate(result):
+            for index in range(3):
+                if runResult["values"][index] != expectedValues(index, run):
+                    print "%s %d: values of parser %d not saved" % (name, run, index)
+                    failed = True
+            if runResult["mixedDays"] != days:
+                print "%s %d: mixed days %s, expected %s" % (name, run, runResult["mixedDays"], days)
+                failed = True
+            if runResult["nextRunTimestamp"] is None:
+                print "%s %d: next run not scheduled" % (name, run)
+                failed = True
+        print "%s: %d runs of 3 parsers saved and mixed" % (name, len(result))
+    shutil.rmtree(databasePath)
+
+print "FAILED" if failed else "OK"
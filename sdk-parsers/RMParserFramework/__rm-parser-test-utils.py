@@ -0,0 +1,83 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import os, json, tempfile
+from collections import OrderedDict
+
+from RMUtilsFramework.rmCommandThread import RMCommandThread
+from RMDataFramework.rmUserSettings import globalSettings
+from RMDataFramework.rmWeatherDataFrame import RMWeatherDataFrame
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMParserFramework.rmParser import RMParser
+from RMParserFramework.rmParserManager import RMParserManager
+
+#-----------------------------------------------------------------------------------------------------------
+# Helpers for the RMParserManager test scripts, loaded with imp.load_source() as rmParserTestUtils.
+#
+# RMTestParser is a real RMParser: the values returned by generate(parser) ([RMWeatherData], parser.runs
+# is the number of previous runs) are added with addValue() to the parser RMWeatherDataFrame, so
+# RMParserManager gets the same frame backed views as from the parsers in parsers/.
+#
+class RMTestParser(RMParser):
+    parserName = "Test"
+    parserForecast = True
+    parserInterval = 0
+
+    def __init__(self, index = 0, generate = None, interval = 0):
+        RMParser.__init__(self)
+        self.parserName = "Test %d" % index
+        self.parserInterval = interval
+        self.index = index
+        self.generate = generate
+        self.runs = 0
+
+    def perform(self):
+        values = []
+        if self.generate is not None:
+            values = self.generate(self)
+        self.runs += 1
+
+        for value in values:
+            for key, attribute in RMWeatherDataFrame.NumericColumns.items() + RMWeatherDataFrame.ObjectColumns.items():
+                fieldValue = getattr(value, attribute)
+                if fieldValue is not None:
+                    self.addValue(key, value.timestamp, fieldValue)
+
+RMParser.parsers.pop() # registered by the class creation, it is not a parser to load
+
+def createParserManager(databasePath, parsers):
+    ### RMParserManager on the databases in databasePath that runs only the given parsers, in their order
+    globalSettings.databasePath = databasePath
+    RMCommandThread.createInstance()
+    globalDbManager.initialize(databasePath)
+
+    RMParserManager._RMParserManager__load = lambda self, parserDir: None
+    manager = RMParserManager()
+    manager.parsers = OrderedDict()
+    for parser in parsers:
+        parserConfig, isNew = manager.parserTable.addParser("test%d.py" % parser.index, parser.parserName, True)
+        manager.parsers[parserConfig] = parser
+    return manager
+
+def runInChild(function, *args):
+    ### Runs function in a new process (the command thread doesn't survive a fork), returns its JSON result
+    ### or None if the process exited before returning
+    resultFile = tempfile.mktemp()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            result = function(*args)
+            with open(resultFile, "w") as f:
+                json.dump(result, f)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    if not os.path.exists(resultFile):
+        return None
+    with open(resultFile) as f:
+        result = json.load(f)
+    os.remove(resultFile)
+    return result
@@ -0,0 +1,168 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# NOAA and DWD parsers with responses the HTTP cache reports as unchanged: the response is not parsed again
+# and the parser returns the same values as when it was parsed. A changed response, or for NOAA a new day,
+# is parsed again. The parser run time is compared for parsed and unchanged responses.
+#
+
+import sys, os, imp, time, zipfile, logging
+sys.path.append('../')
+
+from StringIO import StringIO
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp
+from RMDataFramework.rmUserSettings import globalSettings
+from RMDataFramework.rmWeatherData import rmWeatherDataDigest
+from RMParserFramework.rmParser import RMParser
+
+log.setLevel(logging.CRITICAL)
+
+parsersDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parsers")
+noaaModule = imp.load_source("noaa_parser", os.path.join(parsersDir, "noaa-parser.py"))
+dwdModule = imp.load_source("dwd_parser", os.path.join(parsersDir, "dwd-parser.py"))
+
+todayTimestamp = rmCurrentDayTimestamp()
+failed = False
+
+def check(name, ok):
+    global failed
+    if not ok:
+        print "  %s FAILED" % name
+        failed = True
+    return ok
+
+def date(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(timestamp))
+
+def noaaResponses(version, days = 7):
+    ### Hourly and daily DWML responses, their values change with version
+    layouts = {"k-p1h": (1, 0, 0), "k-p6h": (6, 0, 6), "k-p12h": (12, 0, 12), "k-p24h-max": (24, 7, 12), "k-p24h-min": (24, 19, 12)}
+    parameters = [("temperature", "hourly", "k-p1h"), ("temperature", "dew point", "k-p1h"), ("temperature", "maximum", "k-p24h-max"),
+                  ("temperature", "minimum", "k-p24h-min"), ("precipitation", "liquid", "k-p6h"), ("wind-speed", "sustained", "k-p1h"),
+                  ("probability-of-precipitation", "12 hour", "k-p12h"), ("humidity", "relative", "k-p1h"),
+                  ("humidity", "maximum relative", "k-p24h-max"), ("humidity", "minimum relative", "k-p24h-min")]
+
+    def document(parameters, valueTag, value):
+        xml = ['<?xml version="1.0"?>\n<dwml version="1.0"><data>']
+        for key, (step, first, length) in sorted(layouts.items()):
+            xml.append('<time-layout time-coordinate="local"><layout-key>%s</layout-key>' % key)
+            for hours in range(first, days * 24, step):
+                xml.append('<start-valid-time>%s</start-valid-time><end-valid-time>%s</end-valid-time>' %
+                           (date(todayTimestamp + hours * 3600), date(todayTimestamp + (hours + length) * 3600)))
+            xml.append('</time-layout>')
+        xml.append('<parameters applicable-location="point1">')
+        for index, (tag, type, key) in enumerate(parameters):
+            step, first, length = layouts[key]
+            xml.append('<%s type="%s" time-layout="%s">' % (tag, type, key))
+            for hours in range(first, days * 24, step):
+                xml.append('<%s>%s</%s>' % (valueTag, value(hours, index), valueTag))
+            xml.append('</%s>' % tag)
+        xml.append('</parameters></data></dwml>')
+        return "\n".join(xml)
+
+    hourly = document(parameters, "value", lambda hours, index: (hours * 7 + index * 13 + version) % 90)
+    icons = ["skc", "bkn", "ovc", "shra", "tsra"]
+    daily = document([("conditions-icon", "forecast-NWS", "k-p24h-max")], "icon-link",
+                     lambda hours, index: "http://forecast.weather.gov/images/wtf/%s%d.png" % (icons[(hours / 24 + version) % len(icons)], hours % 10))
+    return hourly, daily
+
+def dwdResponse(version, station = "10637", steps = 240):
+    names = ["TTT", "TN", "TX", "FF", "RRdc", "PPPP", "Td"]
+    kml = ['<?xml version="1.0" encoding="ISO-8859-1"?>',
+           '<kml:kml xmlns:dwd="https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd" '
+           'xmlns:kml="http://www.opengis.net/kml/2.2"><kml:Document><kml:ExtendedData><dwd:ProductDefinition><dwd:ForecastTimeSteps>']
+    kml += ['<dwd:TimeStep>%s</dwd:TimeStep>' % time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(todayTimestamp + step * 3600))
+            for step in range(steps)]
+    kml.append('</dwd:ForecastTimeSteps></dwd:ProductDefinition></kml:ExtendedData><kml:Placemark><kml:name>%s</kml:name><kml:ExtendedData>' % station)
+    for index, name in enumerate(names):
+        values = ["%.2f" % (270 + (step * 7 + index * 13 + version) % 30) for step in range(steps)]
+        kml.append('<dwd:Forecast dwd:elementName="%s"><dwd:value> %s</dwd:value></dwd:Forecast>' % (name, " ".join(values)))
+    kml.append('</kml:ExtendedData></kml:Placemark></kml:Document></kml:kml>')
+
+    data = StringIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as kmz:
+        kmz.writestr("MOSMIX_L_LATEST_%s.kml" % station, "\n".join(kml))
+    return data.getvalue()
+
+def response(body, unchanged):
+    result = StringIO(body)
+    result.unchanged = unchanged
+    return result
+
+def parserRun(parser):
+    parser.clearValues()
+    parser.settings = globalSettings.getSettings()
+    parser.runtime[RMParser.RuntimeDayTimestamp] = rmCurrentDayTimestamp()
+    startTime = time.time()
+    parser.perform()
+    elapsed = time.time() - startTime
+    return rmWeatherDataDigest(parser.getValues()), len(parser.getValues()), elapsed
+
+def countCalls(parser, methodName):
+    calls = [0]
+    method = getattr(parser, methodName)
+    def counted(*args, **kwargs):
+        calls[0] += 1
+        return method(*args, **kwargs)
+    setattr(parser, methodName, counted)
+    return calls
+
+def unchangedTest(name, parser, parseMethodName, responses, newDay = None):
+    ### responses(version, unchanged) sets the parser responses of a run
+    parses = countCalls(parser, parseMethodName)
+    runs = [(0, False), (0, True), (0, True), (1, False), (1, True)]
+    results = []
+    for version, unchanged in runs:
+        responses(version, unchanged)
+        before = parses[0]
+        digest, count, elapsed = parserRun(parser)
+        results.append((digest, count, elapsed, parses[0] - before))
+
+    parsedTime = sum(result[2] for result, (version, unchanged) in zip(results, runs) if not unchanged) / 2
+    unchangedTime = sum(result[2] for result, (version, unchanged) in zip(results, runs) if unchanged) / 3
+    print "%s: %d values, %.1f ms per parsed run, %.1f ms per unchanged run, %s responses parsed" % \
+          (name, results[0][1], parsedTime * 1000, unchangedTime * 1000, [result[3] for result in results])
+
+    check("%s values" % name, results[0][1] > 0)
+    check("%s unchanged responses not parsed" % name, [result[3] > 0 for result in results] == [True, False, False, True, False])
+    check("%s same values for unchanged responses" % name, results[0][0] == results[1][0] == results[2][0] and results[3][0] == results[4][0])
+    check("%s changed response values" % name, results[0][0] != results[3][0])
+
+    if newDay is not None:
+        newDay()
+        before = parses[0]
+        parserRun(parser)
+        check("%s unchanged response parsed on a new day" % name, parses[0] > before)
+
+#-----------------------------------------------------------------------------------------------------------
+# NOAA: hourly and daily responses
+#
+noaa = noaaModule.NOAA()
+noaaBodies = dict((version, noaaResponses(version)) for version in (0, 1))
+def noaaResponse(version, unchanged):
+    def openURL(url, params = None, encodeParameters = True, headers = {}, useCache = True):
+        return response(noaaBodies[version][0 if "ndfdXMLclient" in url else 1], unchanged)
+    noaa.openURL = openURL
+
+def noaaNewDay():
+    for parsed in noaa.parsedResponses.values():
+        parsed["dayTimestamp"] -= 86400
+
+unchangedTest("NOAA", noaa, "_NOAA__parseDocument", noaaResponse, noaaNewDay)
+
+#-----------------------------------------------------------------------------------------------------------
+# DWD
+#
+dwd = dwdModule.DWDParser()
+dwdBodies = dict((version, dwdResponse(version)) for version in (0, 1))
+def dwdOpenURL(version, unchanged):
+    dwd.openURL = lambda url, *args, **kwargs: response(dwdBodies[version], unchanged)
+
+unchangedTest("DWD", dwd, "_DWDParser__parseKML", dwdOpenURL)
+
+print "FAILED" if failed else "OK"
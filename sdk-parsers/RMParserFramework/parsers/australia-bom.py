@@ -1,6 +1,7 @@
 from RMParserFramework.rmParser import RMParser  # Mandatory include for parser definition
 from RMUtilsFramework.rmLogging import log       # Optional include for logging
 from RMUtilsFramework.rmTimeUtils import *
+from RMParserFramework.rmSpatialIndex import RMSpatialIndex
 from xml.etree import ElementTree as elementTree   # Your parser needed libraries
 import math
 import json
@@ -18,6 +19,7 @@ class AustraliaBOM(RMParser):
 
     longitude = None
     latitude = None
+    wmoIndex = None
 
     defaultParams = {"Forecast Area": "Terrey Hills" 
                 , "State" : "NSW" } 
@@ -72,7 +74,7 @@ class AustraliaBOM(RMParser):
         """
         lat1, lon1 = origin
         lat2, lon2 = destination
-        radius = 6371  # km
+        radius = RMSpatialIndex.EarthRadius  # km
 
         dlat = math.radians(lat2 - lat1)
         dlon = math.radians(lon2 - lon1)
@@ -84,7 +86,7 @@ class AustraliaBOM(RMParser):
 
         return d
     
-    def __getNearestWMO(self, lat, lon):
+    def __getWMOLocations(self):
         # From here: http://www.bom.gov.au/climate/data/stations/
         # filtered on files that are available, and ones that have temp and rain
         # Sites with air temp ftp://ftp.bom.gov.au/anon2/home/ncc/metadata/lists_by_element/alpha/alphaAUS_3.txt
@@ -843,19 +845,14 @@ class AustraliaBOM(RMParser):
             ("YULARA AIRPORT", -25.189600, 130.973700, "NT", 94462),
             ("YUNTA AIRSTRIP", -32.570700, 139.564500, "SA", 94684)
         }
-        closest_wmo = None
-        closest_distance = 9999999
-        for i in wmo_locations:
-            wmo_location = i[0]
-            wmo_lat = i[1]
-            wmo_lon = i[2]
-            wmo_state = i[3]
-            wmo_id = i[4]
+        return wmo_locations
+
+    def __getNearestWMO(self, lat, lon):
+        # Built once, the station list doesn't change
+        if AustraliaBOM.wmoIndex is None:
+            AustraliaBOM.wmoIndex = RMSpatialIndex([(i[1], i[2], i) for i in sorted(self.__getWMOLocations())])
 
-            distance = self.__distanceBetween((lat, lon), (wmo_lat, wmo_lon))
-            if distance < closest_distance:
-                closest_distance = distance
-                closest_wmo = i
+        closest_distance, closest_wmo = AustraliaBOM.wmoIndex.nearest(lat, lon)[0]
         if self.parserDebug:
             log.debug("Found closest observatory (%s km) %s " % (str(closest_distance), closest_wmo[0]))
         
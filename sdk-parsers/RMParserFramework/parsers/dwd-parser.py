@@ -17,7 +17,10 @@
 from RMParserFramework.rmParser import RMParser  # Mandatory include for parser definition
 from RMUtilsFramework.rmLogging import log       # Optional include for logging
 import zipfile
-from xml.etree import ElementTree
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
 from RMUtilsFramework.rmTimeUtils import rmTimestampFromDateAsString, rmGetStartOfDay
 from io import BytesIO, SEEK_SET, SEEK_END
 
@@ -110,6 +113,7 @@ class DWDParser(RMParser):
     parserDebug = False
     params = {"station": None}
     defaultParams = {"station": "10637"}
+    parsedResponse = None # (url, [(key, timestamp, value)]) of the last parsed response, added again while it's unchanged
 
     def perform(self):
         station = self.params.get("station", None)
@@ -124,78 +128,225 @@ class DWDParser(RMParser):
             if datafile is None:
                 self.lastKnownError = "Cannot read data from DWD Service."
                 return
+            elif getattr(datafile, "unchanged", False) and self.parsedResponse is not None and self.parsedResponse[0] == url:
+                log.debug("KML file unchanged, using its parsed values")
+                for key, timestamp, value in self.parsedResponse[1]:
+                    self.addValue(key, timestamp, value)
             else:
                 log.debug("Successfully loaded the KML file")
                 kmz = zipfile.ZipFile(BufferedRandomReader(datafile), 'r')
-                for name in kmz.namelist():
-                    kml = kmz.read(name)
 
-                root = ElementTree.fromstring(kml)
+                # The KML is inflated while it's parsed
+                kml = kmz.open(kmz.namelist()[-1])
+                timestamps, forecasts = self.__parseKML(kml, str(station))
+                kml.close()
+                kmz.close()
 
-                ns = {'xmlns': "http://www.opengis.net/kml/2.2",
-                      'dwd': 'https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd'}
-
-                # temporary storage of forecast values
-                tmp = dict()
-                forecastDict = dict()
-                timestamps = []
-                forecasts = dict()
-
-                # Find all forecasts
-                for element in root.findall('.//dwd:Forecast', ns):
-                    forecasts.update({element.attrib['{https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd}elementName']:element[0].text.split()})
-
-                # Find all timestamps
-                for element in root.findall('.//dwd:TimeStep', namespaces=ns):
-                    timestamps.append(element.text)
-
-                for timestep in timestamps:
-                    for measure, values in forecasts.iteritems():
-                        tmp.update({measure: values.pop(0)})
-                    forecastDict.update({timestep: dict(tmp)})
+                if forecasts is None:
+                    self.lastKnownError = "Station %s not found in DWD data." % station
+                    return
 
                 # Add retreived data to DB
-                for time, forecast in forecastDict.iteritems():
+                parsedValues = []
+                for index, time in enumerate(timestamps):
+                    forecast = dict((measure, values[index]) for measure, values in forecasts.iteritems())
                     timestamp = rmTimestampFromDateAsString(time[:-5], "%Y-%m-%dT%H:%M:%S")
-                    yesterdayTimestamp = rmGetStartOfDay(timestamp - 12 * 60 * 60)
                     if timestamp is None:
                         log.debug("Cannot convert timestamp: %s to unix timestamp" % time)
                         continue
+                    yesterdayTimestamp = rmGetStartOfDay(timestamp - 12 * 60 * 60)
                     # Temperature
                     if forecast['TTT'] != '-':
                         TTT = float(forecast['TTT']) - 273.15
-                        self.addValue(RMParser.dataType.TEMPERATURE, timestamp, TTT)
+                        parsedValues.append((RMParser.dataType.TEMPERATURE, timestamp, TTT))
                     # Minimum temperature last 24h
                     if forecast['TN'] != '-':
                         TN = float(forecast['TN']) - 273.15
-                        self.addValue(RMParser.dataType.MINTEMP, timestamp - 12 * 60 * 60, TN)
+                        parsedValues.append((RMParser.dataType.MINTEMP, timestamp - 12 * 60 * 60, TN))
                     # Maximum temperature last 24h
                     if forecast['TX'] != '-':
                         TX = float(forecast['TX']) - 273.15
-                        self.addValue(RMParser.dataType.MINTEMP, timestamp - 12 * 60 * 60, TX)
+                        parsedValues.append((RMParser.dataType.MINTEMP, timestamp - 12 * 60 * 60, TX))
                     # Windspeed
                     if forecast['FF'] != '-':
                         FF = float(forecast['FF'])
-                        self.addValue(RMParser.dataType.WIND, timestamp, FF)
+                        parsedValues.append((RMParser.dataType.WIND, timestamp, FF))
                     # Precipation last 24h
                     if forecast['RRdc'] != '-':
                         RRdc = float(forecast['RRdc'])
-                        self.addValue(RMParser.dataType.QPF, yesterdayTimestamp, RRdc)
+                        parsedValues.append((RMParser.dataType.QPF, yesterdayTimestamp, RRdc))
                     # Atmospheric pressure
                     if forecast['PPPP'] != '-':
                         PPPP = float(forecast['PPPP'])/1000
-                        self.addValue(RMParser.dataType.PRESSURE, timestamp, PPPP)
+                        parsedValues.append((RMParser.dataType.PRESSURE, timestamp, PPPP))
                     # Dewpoint
                     if forecast['Td'] != '-':
                         Td = float(forecast['Td']) - 273.15
-                        self.addValue(RMParser.dataType.DEWPOINT, timestamp, Td)
+                        parsedValues.append((RMParser.dataType.DEWPOINT, timestamp, Td))
 
+                for key, timestamp, value in parsedValues:
+                    self.addValue(key, timestamp, value)
+                self.parsedResponse = (url, parsedValues)
 
         except Exception as e:
             log.error("*** Error running DWD parser")
             log.exception(e)
 
-
+    # Streams the KML and returns the forecast time steps and {elementName: [values]} of the station placemark,
+    # (timeSteps, None) if the station is not in the file. Parsing stops at the station placemark so in the
+    # all stations MOSMIX files the following placemarks are never read. A single station file is used even
+    # if its placemark has a different name, like before.
+    def __parseKML(self, kml, station):
+        kmlNS = "{http://www.opengis.net/kml/2.2}"
+        dwdNS = "{https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd}"
+        timeStepTag = dwdNS + "TimeStep"
+        forecastTag = dwdNS + "Forecast"
+        elementNameAttribute = dwdNS + "elementName"
+        placemarkTag = kmlNS + "Placemark"
+        nameTag = kmlNS + "name"
+
+        timeSteps = []
+        placemarks = 0
+        placemarkName = None
+        forecasts = None
+        firstForecasts = None
+
+        for event, element in ElementTree.iterparse(kml, events=("start", "end")):
+            tag = element.tag
+            if event == "start":
+                if tag == placemarkTag:
+                    placemarks += 1
+                    placemarkName = None
+                    forecasts = {}
+                continue
+
+            # Only whole Forecast and Placemark elements are cleared, their children are still needed until their end
+            if tag == timeStepTag:
+                timeSteps.append(element.text)
+                element.clear()
+            elif forecasts is None:
+                continue
+            elif tag == nameTag and placemarkName is None:
+                placemarkName = (element.text or "").strip()
+            elif tag == forecastTag:
+                if placemarkName == station or placemarks == 1:
+                    forecasts[element.attrib[elementNameAttribute]] = element[0].text.split()
+                element.clear()
+            elif tag == placemarkTag:
+                if placemarkName == station:
+                    return timeSteps, forecasts
+                if placemarks == 1:
+                    firstForecasts = forecasts
+                forecasts = None
+                element.clear()
+
+        if placemarks == 1:
+            return timeSteps, firstForecasts
+        return timeSteps, None
+
+
+# Run the parser or, with "benchmark [saved MOSMIX kmz files]", compare the streaming KML parsing with the
+# previous ElementTree.fromstring() one. Without files a MOSMIX_L single station file and a 300 stations
+# MOSMIX_S like file are generated.
 if __name__ == "__main__":
-    p = DWDParser()
-    p.perform()
\ No newline at end of file
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] != "benchmark":
+        p = DWDParser()
+        p.perform()
+        sys.exit(0)
+
+    import os, time, gc, random
+    from StringIO import StringIO
+
+    def generateKMZ(stations, elements, station, steps = 240):
+        names = ["TTT", "TN", "TX", "FF", "RRdc", "PPPP", "Td"] + ["E%03d" % i for i in range(elements - 7)]
+        kml = ['<?xml version="1.0" encoding="ISO-8859-1" standalone="no"?>',
+               '<kml:kml xmlns:dwd="https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd" '
+               'xmlns:kml="http://www.opengis.net/kml/2.2"><kml:Document><kml:ExtendedData><dwd:ProductDefinition>'
+               '<dwd:Issuer>Deutscher Wetterdienst</dwd:Issuer><dwd:ProductID>MOSMIX</dwd:ProductID><dwd:ForecastTimeSteps>']
+        kml += ['<dwd:TimeStep>%s</dwd:TimeStep>' % time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(1560000000 + step * 3600))
+                for step in range(steps)]
+        kml.append('</dwd:ForecastTimeSteps></dwd:ProductDefinition></kml:ExtendedData>')
+        for index in range(stations):
+            name = station if index == stations // 2 else "%05d" % (index + 20000)
+            random.seed(name) # same values for a station in all files
+            kml.append('<kml:Placemark><kml:name>%s</kml:name><kml:description>STATION %d</kml:description><kml:ExtendedData>' % (name, index))
+            for element in names:
+                values = ["-" if random.random() < 0.05 else "%.2f" % random.uniform(270, 300) for step in range(steps)]
+                kml.append('<dwd:Forecast dwd:elementName="%s"><dwd:value>     %s</dwd:value></dwd:Forecast>' % (element, "     ".join(values)))
+            kml.append('</kml:ExtendedData><kml:Point><kml:coordinates>8.6,50.05,111.0</kml:coordinates></kml:Point></kml:Placemark>')
+        kml.append('</kml:Document></kml:kml>')
+
+        data = StringIO()
+        with zipfile.ZipFile(data, "w", zipfile.ZIP_DEFLATED) as kmz:
+            kmz.writestr("MOSMIX_LATEST.kml", "\n".join(kml))
+        return data.getvalue()
+
+    def parseWithTree(data, station):
+        ### Previous implementation: whole KML in memory, all forecasts of the file, values.pop(0) per time step
+        from xml.etree import ElementTree as pyElementTree
+        kmz = zipfile.ZipFile(BufferedRandomReader(StringIO(data)), 'r')
+        for name in kmz.namelist():
+            kml = kmz.read(name)
+        root = pyElementTree.fromstring(kml)
+        ns = {'xmlns': "http://www.opengis.net/kml/2.2",
+              'dwd': 'https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd'}
+        tmp = dict()
+        forecastDict = dict()
+        timestamps = []
+        forecasts = dict()
+        for element in root.findall('.//dwd:Forecast', ns):
+            forecasts.update({element.attrib['{https://opendata.dwd.de/weather/lib/pointforecast_dwd_extension_V1_0.xsd}elementName']:element[0].text.split()})
+        for element in root.findall('.//dwd:TimeStep', namespaces=ns):
+            timestamps.append(element.text)
+        for timestep in timestamps:
+            for measure, values in forecasts.iteritems():
+                tmp.update({measure: values.pop(0)})
+            forecastDict.update({timestep: dict(tmp)})
+        return forecastDict
+
+    def parseWithStream(data, station):
+        kmz = zipfile.ZipFile(BufferedRandomReader(StringIO(data)), 'r')
+        kml = kmz.open(kmz.namelist()[-1])
+        timestamps, forecasts = parser._DWDParser__parseKML(kml, station)
+        kml.close()
+        return dict((time, dict((measure, values[index]) for measure, values in forecasts.iteritems()))
+                    for index, time in enumerate(timestamps))
+
+    def measure(function, data, station):
+        ### CPU time and peak RSS growth of one call, measured in a child process
+        pipeRead, pipeWrite = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            gc.collect()
+            startTime = time.clock()
+            function(data, station)
+            os.write(pipeWrite, "%f\n" % ((time.clock() - startTime) * 1000))
+            os._exit(0)
+        pid, status, usage = os.wait4(pid, 0)
+        return float(os.read(pipeRead, 64)), usage.ru_maxrss
+
+    parser = DWDParser()
+    station = "10637"
+    if len(sys.argv) > 2:
+        files = [(fileName, open(fileName, "rb").read(), None) for fileName in sys.argv[2:]]
+    else:
+        files = [("MOSMIX_L single station", generateKMZ(1, 115, station), "tree"),
+                 ("MOSMIX_S 300 stations", generateKMZ(300, 40, station), "single station")]
+
+    idleMemory = measure(lambda data, station: None, "", station)[1]
+    for name, data, reference in files:
+        result = parseWithStream(data, station)
+        if reference == "tree":
+            print "%s: %s" % (name, "same values as the previous implementation" if result == parseWithTree(data, station) else "values DIFFERENT")
+        elif reference == "single station":
+            # The previous implementation returns the values of the last placemark for files with many stations
+            single = generateKMZ(1, 40, station)
+            expected = parseWithStream(single, station)
+            print "%s: station values %s" % (name, "found" if result == expected else "DIFFERENT")
+
+        print "%s (%d KB kmz, %d time steps, %d elements):" % (name, len(data) / 1024, len(result), len(result.values()[0]))
+        for label, function in (("ElementTree.fromstring", parseWithTree), ("iterparse streaming", parseWithStream)):
+            cpu, memory = measure(function, data, station)
+            print "\t%-24s %9.2f ms CPU %8d KB peak memory" % (label, cpu, memory - idleMemory)
\ No newline at end of file
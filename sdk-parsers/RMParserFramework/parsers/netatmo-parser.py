@@ -7,6 +7,7 @@ from RMParserFramework.rmParser import RMParser
 from RMUtilsFramework.rmLogging import log
 from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp
 from RMParserFramework.rmParserManager import  RMParserManager
+from RMParserFramework.rmConnectionPool import globalConnectionPool
 import urllib2, json, time, ssl
 from urllib import urlencode
 
@@ -297,15 +298,14 @@ class Netatmo(RMParser):
         req = urllib2.Request(url=url, data=params, headers=headers)
 
         try:
-            response = urllib2.urlopen(req)
+            response = globalConnectionPool.open(req)
             log.debug("%s?%s" % (response.geturl(), params))
             return json.loads(response.read())
         except urllib2.URLError, e:
             log.debug(e)
             if hasattr(ssl, '_create_unverified_context'): #for mac os only in order to ignore invalid certificates
                 try:
-                    context = ssl._create_unverified_context()
-                    response = urllib2.urlopen(req, context=context)
+                    response = globalConnectionPool.open(req, verify=False)
                     return json.loads(response.read())
                 except Exception, e:
                     log.exception(e)
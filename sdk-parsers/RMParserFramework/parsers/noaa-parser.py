@@ -13,8 +13,12 @@ from RMUtilsFramework.rmUtils import convertKnotsToMS, convertFahrenheitToCelsiu
 from RMDataFramework.rmLimits import RMWeatherDataLimits
 from RMDataFramework.rmWeatherData import RMWeatherDataType
 
-import datetime, time
-from xml.etree import ElementTree as e
+import copy, datetime, time
+from StringIO import StringIO
+try:
+    from xml.etree import cElementTree as e
+except ImportError:
+    from xml.etree import ElementTree as e
 
 
 class NOAA(RMParser):
@@ -29,6 +33,25 @@ class NOAA(RMParser):
 
     skippedDays = {} # keep track of incomplete days
     intervalsCache = {} # keep track of intervals in the current day
+    parsedResponses = {} # values parsed from the last response of each request, added again while it's unchanged
+
+    # (tag, type, subtag) of the weather values extracted from each response
+    hourlyWeatherTags = [
+        ("precipitation", "liquid", "value"),
+        ("temperature", "maximum", "value"),
+        ("temperature", "minimum", "value"),
+        ("temperature", "hourly", "value"),
+        ("temperature", "dew point", "value"),
+        ("wind-speed", "sustained", "value"),
+        ("probability-of-precipitation", "12 hour", "value"),
+        ("humidity", "relative", "value"),
+        ("humidity", "minimum relative", "value"),
+        ("humidity", "maximum relative", "value"),
+    ]
+
+    dailyWeatherTags = [
+        ("conditions-icon", "forecast-NWS", "icon-link"),
+    ]
 
     def isEnabledForLocation(self, timezone, lat, long):
         if NOAA.parserEnabled and timezone:
@@ -152,19 +175,25 @@ class NOAA(RMParser):
         d = self.openURL(URL, URLParams, headers=headers)
         if d is None:
             return False
+
+        requestKey = (URL, tuple(URLParams), headers.get("Host"))
+        if self.__addParsedResponse(d, requestKey, NOAA.hourlyWeatherTags):
+            return True
+        parsedSkippedDays = dict(self.skippedDays)
+
+        #d = open("/tmp/noaa-fl-2019-06-04-1.xml")
+
+        if self.parserDebug:
+            d = self.__saveResponse(d, 'noaa-' + str(rmTimestampToDateAsString(rmCurrentTimestamp())) + ".xml")
+
         try:
-            tree = e.parse(d)
+            document = self.__parseDocument(d, NOAA.hourlyWeatherTags)
         except:
             return False
 
-        #tree = e.parse("/tmp/noaa-fl-2019-06-04-1.xml")
-
-        if tree.getroot().tag == 'error':
+        if document is None:
             log.error("*** No hourly information found in response!")
             self.lastKnownError = "Retrying hourly data retrieval"
-            tree.getroot().clear()
-            del tree
-            tree = None
             return False
 
         # Reset lastKnownError from a previous function call
@@ -181,55 +210,50 @@ class NOAA(RMParser):
         # Algorithm allows multiple partial days to be skipped because incomplete but we currently only skip today
 
         # QPF needs to be the first tag parsed to build the skippedDays structure
-        qpf = self.__parseWeatherTag(tree, 'precipitation', 'liquid', skippedDays=self.skippedDays, addToSkippedDays=True)
+        qpf = self.__parseWeatherTag(document, 'precipitation', 'liquid', skippedDays=self.skippedDays, addToSkippedDays=True)
         qpf = convertInchesToMM(qpf)
 
-        maxt = self.__parseWeatherTag(tree, 'temperature', 'maximum', skippedDays=self.skippedDays)
+        maxt = self.__parseWeatherTag(document, 'temperature', 'maximum', skippedDays=self.skippedDays)
         maxt = convertFahrenheitToCelsius(maxt)
 
-        mint = self.__parseWeatherTag(tree, 'temperature', 'minimum', useStartTimes=False, skippedDays=self.skippedDays) # for mint we want the end-time to be saved in DB
+        mint = self.__parseWeatherTag(document, 'temperature', 'minimum', useStartTimes=False, skippedDays=self.skippedDays) # for mint we want the end-time to be saved in DB
         mint = convertFahrenheitToCelsius(mint)
 
-        temp = self.__parseWeatherTag(tree, 'temperature', 'hourly', skippedDays=self.skippedDays)
+        temp = self.__parseWeatherTag(document, 'temperature', 'hourly', skippedDays=self.skippedDays)
         temp = convertFahrenheitToCelsius(temp)
 
-        dew = self.__parseWeatherTag(tree, 'temperature', 'dew point', skippedDays=self.skippedDays)
+        dew = self.__parseWeatherTag(document, 'temperature', 'dew point', skippedDays=self.skippedDays)
         dew = convertFahrenheitToCelsius(dew)
 
-        wind = self.__parseWeatherTag(tree, 'wind-speed', 'sustained', skippedDays=self.skippedDays)
+        wind = self.__parseWeatherTag(document, 'wind-speed', 'sustained', skippedDays=self.skippedDays)
         wind = convertKnotsToMS(wind)
 
         # These are as percentages
-        pop = self.__parseWeatherTag(tree, 'probability-of-precipitation', '12 hour', skippedDays=self.skippedDays)
+        pop = self.__parseWeatherTag(document, 'probability-of-precipitation', '12 hour', skippedDays=self.skippedDays)
         pop = convertToInt(pop)
 
-        humidity = self.__parseWeatherTag(tree, 'humidity', 'relative', skippedDays=self.skippedDays)
+        humidity = self.__parseWeatherTag(document, 'humidity', 'relative', skippedDays=self.skippedDays)
         humidity = convertToFloat(humidity)
 
-        minHumidity = self.__parseWeatherTag(tree, 'humidity', 'minimum relative', skippedDays=self.skippedDays)
+        minHumidity = self.__parseWeatherTag(document, 'humidity', 'minimum relative', skippedDays=self.skippedDays)
         minHumidity = convertToFloat(minHumidity)
 
-        maxHumidity = self.__parseWeatherTag(tree, 'humidity', 'maximum relative', skippedDays=self.skippedDays)
+        maxHumidity = self.__parseWeatherTag(document, 'humidity', 'maximum relative', skippedDays=self.skippedDays)
         maxHumidity = convertToFloat(maxHumidity)
 
-        if self.parserDebug:
-            tree.write('noaa-' + str(rmTimestampToDateAsString(rmCurrentTimestamp())) + ".xml")
-
-        tree.getroot().clear()
-        del tree
-        tree = None
-
         # Save
-        self.addValues(RMParser.dataType.MINTEMP, mint)
-        self.addValues(RMParser.dataType.MAXTEMP, maxt)
-        self.addValues(RMParser.dataType.TEMPERATURE, temp)
-        self.addValues(RMParser.dataType.QPF, qpf)
-        self.addValues(RMParser.dataType.DEWPOINT, dew)
-        self.addValues(RMParser.dataType.WIND, wind)
-        self.addValues(RMParser.dataType.POP, pop)
-        self.addValues(RMParser.dataType.RH, humidity)
-        self.addValues(RMParser.dataType.MINRH, minHumidity)
-        self.addValues(RMParser.dataType.MAXRH, maxHumidity)
+        self.__saveParsedResponse(requestKey, NOAA.hourlyWeatherTags, parsedSkippedDays, [
+            (RMParser.dataType.MINTEMP, mint),
+            (RMParser.dataType.MAXTEMP, maxt),
+            (RMParser.dataType.TEMPERATURE, temp),
+            (RMParser.dataType.QPF, qpf),
+            (RMParser.dataType.DEWPOINT, dew),
+            (RMParser.dataType.WIND, wind),
+            (RMParser.dataType.POP, pop),
+            (RMParser.dataType.RH, humidity),
+            (RMParser.dataType.MINRH, minHumidity),
+            (RMParser.dataType.MAXRH, maxHumidity)
+        ])
 
         return True
 
@@ -239,25 +263,28 @@ class NOAA(RMParser):
     #
     def getDailyData(self, URLDaily, URLParams, headers):
         d = self.openURL(URLDaily, URLParams, headers=headers)
+
+        requestKey = (URLDaily, tuple(URLParams), headers.get("Host"))
+        if self.__addParsedResponse(d, requestKey, NOAA.dailyWeatherTags):
+            return True
+        parsedSkippedDays = dict(self.skippedDays)
+
+        #d = open("/tmp/noaa-fl-2019-06-04-daily-1.xml")
+
         try:
-            tree = e.parse(d)
+            document = self.__parseDocument(d, NOAA.dailyWeatherTags)
         except:
             return False
 
-        if tree.getroot().tag == 'error':
+        if document is None:
             log.error("*** No daily information found in response!")
             self.lastKnownError = "Retrying daily brief"
-            tree.getroot().clear()
-            del tree
-            tree = None
             return False
 
-        #tree = e.parse("/tmp/noaa-fl-2019-06-04-daily-1.xml")
-
         # Reset lastKnownError from a previous function call
         self.lastKnownError = ""
 
-        conditions = self.__parseWeatherTag(tree, 'conditions-icon', 'forecast-NWS', 'icon-link', skippedDays=self.skippedDays)
+        conditions = self.__parseWeatherTag(document, 'conditions-icon', 'forecast-NWS', skippedDays=self.skippedDays)
         parsedConditions = []
 
         for c in conditions:
@@ -269,14 +296,47 @@ class NOAA(RMParser):
 
                 parsedConditions.append((c[0], cv))
 
-        tree.getroot().clear()
-        del tree
-        tree = None
+        self.__saveParsedResponse(requestKey, NOAA.dailyWeatherTags, parsedSkippedDays, [(RMParser.dataType.CONDITION, parsedConditions)])
 
-        self.addValues(RMParser.dataType.CONDITION, parsedConditions)
+        return True
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # A response the HTTP cache reports as unchanged is not parsed again, the values parsed from it are added
+    # instead. They depend on the current day, the days skipped by the previous responses of this run and the
+    # cached intervals of the response tags as well, if any of them is different the response is parsed again.
+    #
+    def __addParsedResponse(self, response, requestKey, weatherTags):
+        if response is None or not getattr(response, "unchanged", False):
+            return False
+
+        parsed = self.parsedResponses.get(requestKey)
+        if parsed is None or parsed["dayTimestamp"] != rmCurrentDayTimestamp() or parsed["skippedDaysBefore"] != self.skippedDays \
+                or parsed["intervalsCache"] != self.__cachedIntervals(weatherTags):
+            return False
 
+        log.debug("Response from %s unchanged, using its parsed values" % requestKey[0])
+        self.lastKnownError = ""
+        self.skippedDays.update(parsed["skippedDays"])
+        for key, values in parsed["values"]:
+            self.addValues(key, values)
         return True
 
+    def __saveParsedResponse(self, requestKey, weatherTags, skippedDaysBefore, values):
+        for key, keyValues in values:
+            self.addValues(key, keyValues)
+
+        self.parsedResponses[requestKey] = {
+            "dayTimestamp": rmCurrentDayTimestamp(),
+            "skippedDaysBefore": skippedDaysBefore,
+            "skippedDays": dict(self.skippedDays),
+            "intervalsCache": self.__cachedIntervals(weatherTags),
+            "values": values
+        }
+
+    def __cachedIntervals(self, weatherTags):
+        return dict((tag + type, copy.deepcopy(self.intervalsCache.get(tag + type))) for tag, type, subtag in weatherTags)
+
 
     def __parseDateTime(self, str, roundToHour = True):
         #NOAA reports in location local time needs UTC conversion
@@ -289,34 +349,97 @@ class NOAA(RMParser):
         else:
             return timestamp
 
-    def __parseTimeLayout(self, tree, key, useStartTimes = True):
-        found = False
-        validDates = []
+    def __saveResponse(self, d, fileName):
+        data = d.read()
+        with open(fileName, "w") as f:
+            f.write(data)
+        return StringIO(data)
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Single streaming pass over a DWML response. Builds the layout-key -> (start-valid-time, end-valid-time)
+    # index and extracts the values of all requested (tag, type, subtag) weather tags, clearing the elements
+    # as soon as they are read. Returns None if the response is an error document.
+    #
+    def __parseDocument(self, source, weatherTags):
+        subtags = {} # tag -> type -> subtag
+        for tag, type, subtag in weatherTags:
+            subtags.setdefault(tag, {})[type] = subtag
+
+        layouts = {} # layout-key -> ([start-valid-time], [end-valid-time]) as strings
+        series = {} # (tag, type) -> [layout-key, [values]]
+
+        root = None
+        inTimeLayout = False
+        layout = None
+        weather = None
+        weatherSubtag = None
+
+        for event, element in e.iterparse(source, events=("start", "end")):
+            tag = element.tag
+            if event == "start":
+                if root is None:
+                    root = element
+                    if tag == "error":
+                        return None
+                elif tag == "time-layout":
+                    inTimeLayout = True
+                    layout = None
+                elif weather is None and tag in subtags:
+                    type = element.get("type")
+                    weatherSubtag = subtags[tag].get(type)
+                    if weatherSubtag is not None:
+                        # Values of repeated tags are appended, the last time layout is used for all
+                        weather = series.setdefault((tag, type), [None, []])
+                        weather[0] = element.get("time-layout")
+                continue
+
+            if inTimeLayout:
+                if tag == "layout-key":
+                    if element.text not in layouts: # first layout with a key wins
+                        layout = layouts[element.text] = ([], [])
+                elif tag == "start-valid-time":
+                    if layout is not None:
+                        layout[0].append(element.text)
+                elif tag == "end-valid-time":
+                    if layout is not None:
+                        layout[1].append(element.text)
+                elif tag == "time-layout":
+                    inTimeLayout = False
+            elif weather is not None:
+                if tag == weatherSubtag:
+                    weather[1].append(element.text)
+                elif tag in subtags:
+                    weather = None
+
+            element.clear()
+
+        return {"layouts": layouts, "series": series, "timestamps": {}}
+
+    def __parseTimeLayout(self, document, key, useStartTimes = True):
+        layout = document["layouts"].get(key)
+        if layout is None:
+            return []
 
         # We can index by using "start-valid-time" or by "end-valid-time"
         if useStartTimes:
-            dateTagName =  "start-valid-time"
+            dates = layout[0]
         else:
-            dateTagName =  "end-valid-time"
-
-        for timeElement in tree.getroot().getiterator(tag = "time-layout"):
-            for timeData in timeElement.getchildren():
-                if timeData.tag == "layout-key" and timeData.text == key:
-                    found = True
-                elif timeData.tag == dateTagName and found:
-                    validDates.append(self.__parseDateTime(timeData.text))
-
-            if found:
-                break
+            dates = layout[1]
 
+        # Most layouts share the same dates, convert each one once
+        timestamps = document["timestamps"]
+        validDates = []
+        for date in dates:
+            timestamp = timestamps.get(date, -1)
+            if timestamp == -1:
+                timestamp = timestamps[date] = self.__parseDateTime(date)
+            validDates.append(timestamp)
 
         return validDates
 
     # skippedDays will hold the days skipped by other entries (qpf, temp).
-    def __parseWeatherTag(self, tree, tag, type, subtag = "value", useStartTimes = True, typeConvert = None, skippedDays = {}, addToSkippedDays = False):
-        values = []
-        forecastTimes = []
-        timeLayoutKey = None
+    def __parseWeatherTag(self, document, tag, type, useStartTimes = True, skippedDays = {}, addToSkippedDays = False):
         cacheKey = tag + type
 
         todayTimestamp = rmCurrentDayTimestamp()
@@ -327,25 +450,9 @@ class NOAA(RMParser):
             self.intervalsCache[cacheKey] = {} # forget older days
             self.intervalsCache[cacheKey][todayTimestamp] = {}
 
-        # Build forecast time intervals list and values list
-        for w in tree.getroot().getiterator(tag = tag):
-            if w.attrib['type'] != type:
-                continue
-
-            timeLayoutKey = w.attrib['time-layout']
-            forecastTimes = self.__parseTimeLayout(tree, timeLayoutKey, useStartTimes=useStartTimes)
-
-            for wval in w.getiterator(tag = subtag):
-                try:
-                    val = wval.text
-                    if typeConvert == 'int':
-                        val = int(val)
-                    if typeConvert == 'float':
-                        val = float(val)
-                except:
-                    val = None
-
-                values.append(val)
+        # Forecast time intervals list and values list
+        timeLayoutKey, values = document["series"].get((tag, type), (None, []))
+        forecastTimes = self.__parseTimeLayout(document, timeLayoutKey, useStartTimes=useStartTimes)
 
         result = zip(forecastTimes, values)
         result.sort(key=lambda z: z[0]) # Sort by timestamp
@@ -478,6 +585,124 @@ class NOAA(RMParser):
             return  RMParser.conditionType.Unknown
 
 
+#-----------------------------------------------------------------------------------------------
+#
+# Run the parser or, with "benchmark [saved NDFD responses]", compare the streaming parsing stage with
+# the previous ElementTree.parse() one. Without files a 7 day time-series response is generated.
+#
 if __name__ == "__main__":
+    import sys, os, resource, gc
+
+    if len(sys.argv) < 2 or sys.argv[1] != "benchmark":
+        parser = NOAA()
+        parser.perform()
+        sys.exit(0)
+
+    def generateResponse(days = 7, offset = "-04:00"):
+        start = datetime.datetime.combine(datetime.date.today(), datetime.time(0))
+        def date(hours):
+            return (start + datetime.timedelta(hours = hours)).strftime("%Y-%m-%dT%H:%M:%S") + offset
+
+        layouts = [("k-p24h-n%d-1" % days, 24, 7, 12), ("k-p24h-n%d-2" % days, 24, 19, 12),
+                   ("k-p1h-n%d-3" % (days * 24), 1, 0, 0), ("k-p6h-n%d-4" % (days * 4), 6, 0, 6),
+                   ("k-p12h-n%d-5" % (days * 2), 12, 6, 12)]
+        parameters = [("temperature", "maximum", 0), ("temperature", "minimum", 1), ("temperature", "hourly", 2),
+                      ("temperature", "dew point", 2), ("precipitation", "liquid", 3), ("wind-speed", "sustained", 2),
+                      ("probability-of-precipitation", "12 hour", 4), ("humidity", "relative", 2),
+                      ("humidity", "maximum relative", 0), ("humidity", "minimum relative", 1)]
+
+        xml = ['<?xml version="1.0"?>\n<dwml version="1.0" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">',
+               '<head><product srsName="WGS 1984" concise-name="time-series" operational-mode="official">',
+               '<title>NOAA\'s National Weather Service Forecast Data</title></product></head>',
+               '<data><location><location-key>point1</location-key><point latitude="27.00" longitude="-80.00"/></location>']
+        for key, step, first, length in layouts:
+            xml.append('<time-layout time-coordinate="local" summarization="none"><layout-key>%s</layout-key>' % key)
+            for hours in range(first, days * 24, step):
+                xml.append('<start-valid-time>%s</start-valid-time>' % date(hours))
+                if length:
+                    xml.append('<end-valid-time>%s</end-valid-time>' % date(hours + length))
+            xml.append('</time-layout>')
+
+        xml.append('<parameters applicable-location="point1">')
+        for index, (tag, type, layout) in enumerate(parameters):
+            key, step, first, length = layouts[layout]
+            xml.append('<%s type="%s" units="" time-layout="%s"><name>%s %s</name>' % (tag, type, key, tag, type))
+            for hours in range(first, days * 24, step):
+                if (hours + index) % 17 == 0:
+                    xml.append('<value xsi:nil="true"/>')
+                else:
+                    xml.append('<value>%d</value>' % ((hours * 7 + index * 13) % 90))
+            xml.append('</%s>' % tag)
+        xml.append('</parameters></data></dwml>')
+        return "\n".join(xml)
+
+    def parseWithTree(data, weatherTags):
+        ### Previous implementation: whole tree in memory, every tag rescans the tree and its time layout.
+        from xml.etree import ElementTree
+        tree = ElementTree.parse(StringIO(data))
+        result = {}
+        for tag, type, subtag in weatherTags:
+            for useStartTimes in (True, False):
+                dateTagName = "start-valid-time" if useStartTimes else "end-valid-time"
+                values = []
+                forecastTimes = []
+                for w in tree.getroot().getiterator(tag = tag):
+                    if w.attrib['type'] != type:
+                        continue
+                    found = False
+                    forecastTimes = []
+                    for timeElement in tree.getroot().getiterator(tag = "time-layout"):
+                        for timeData in timeElement.getchildren():
+                            if timeData.tag == "layout-key" and timeData.text == w.attrib['time-layout']:
+                                found = True
+                            elif timeData.tag == dateTagName and found:
+                                forecastTimes.append(parser._NOAA__parseDateTime(timeData.text))
+                        if found:
+                            break
+                    for wval in w.getiterator(tag = subtag):
+                        values.append(wval.text)
+                result[(tag, type, useStartTimes)] = sorted(zip(forecastTimes, values), key=lambda z: z[0])
+        tree.getroot().clear()
+        return result
+
+    def parseWithStream(data, weatherTags):
+        document = parser._NOAA__parseDocument(StringIO(data), weatherTags)
+        result = {}
+        for tag, type, subtag in weatherTags:
+            for useStartTimes in (True, False):
+                key, values = document["series"].get((tag, type), (None, []))
+                forecastTimes = parser._NOAA__parseTimeLayout(document, key, useStartTimes)
+                result[(tag, type, useStartTimes)] = sorted(zip(forecastTimes, values), key=lambda z: z[0])
+        return result
+
+    def measure(function, data, count):
+        ### CPU time per call and peak RSS growth, measured in a child process so each run starts from the same heap
+        pid = os.fork()
+        if pid == 0:
+            gc.collect()
+            startTime = time.clock()
+            for i in range(count):
+                function(data, NOAA.hourlyWeatherTags)
+            os.write(pipeWrite, "%f\n" % ((time.clock() - startTime) * 1000 / count))
+            os._exit(0)
+        pid, status, usage = os.wait4(pid, 0)
+        return float(os.read(pipeRead, 64)), usage.ru_maxrss
+
     parser = NOAA()
-    parser.perform()
\ No newline at end of file
+    if len(sys.argv) > 2:
+        responses = [(fileName, open(fileName).read()) for fileName in sys.argv[2:]]
+    else:
+        responses = [("generated %d days" % days, generateResponse(days)) for days in (7, 14)]
+
+    pipeRead, pipeWrite = os.pipe()
+    idleMemory = measure(lambda data, weatherTags: None, "", 1)[1]
+
+    for name, data in responses:
+        if parseWithTree(data, NOAA.hourlyWeatherTags) != parseWithStream(data, NOAA.hourlyWeatherTags):
+            print "%s: streaming values differ from ElementTree.parse() values" % name
+            continue
+
+        print "%s (%d KB): same values with both implementations" % (name, len(data) / 1024)
+        for label, function in (("ElementTree.parse", parseWithTree), ("iterparse single pass", parseWithStream)):
+            cpu, memory = measure(function, data, 20)
+            print "\t%-25s %8.2f ms CPU %8d KB peak memory" % (label, cpu, memory - idleMemory)
\ No newline at end of file
@@ -0,0 +1,395 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import ssl
+import time
+import socket
+import httplib, urllib, urllib2
+from threading import Condition
+
+from RMUtilsFramework.rmLogging import log
+
+#-----------------------------------------------------------------------------------------------
+#
+# Shared pool of HTTP/1.1 keep-alive connections used by the parser downloads. Connections are
+# kept per (scheme, host, SSL context), at most MaxConnectionsPerHost at a time, and are closed after
+# IdleTimeout seconds without use. The SSL contexts (verified and unverified) are created once and
+# shared by all HTTPS connections. A connection goes back to the pool once its response body is read to
+# the end, a response closed before that closes its connection.
+#
+class RMConnectionPool:
+
+    MaxConnectionsPerHost = 2
+    IdleTimeout = 60 # seconds
+
+    def __init__(self):
+        self.__condition = Condition()
+        self.__idle = {}    # (scheme, host, verify) -> [(lastUsedTimestamp, connection)]
+        self.__active = {}  # (scheme, host, verify) -> number of connections in use or idle
+        self.__contexts = {}
+
+        self.__openers = {}
+        for verify in (True, False):
+            self.__openers[verify] = urllib2.build_opener(RMKeepAliveHTTPHandler(self, verify), RMKeepAliveHTTPSHandler(self, verify))
+
+        self.stats = {"requests": 0, "connections": 0, "reused": 0}
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Same as urllib2.urlopen(request, timeout). With verify=False server certificates are not checked.
+    #
+    def open(self, request, timeout = 60, verify = True):
+        return self.__openers[verify].open(request, timeout=timeout)
+
+    def getContext(self, verify):
+        context = self.__contexts.get(verify)
+        if context is None:
+            if not verify and hasattr(ssl, '_create_unverified_context'):
+                context = ssl._create_unverified_context()
+            elif hasattr(ssl, 'create_default_context'):
+                context = ssl.create_default_context()
+            self.__contexts[verify] = context
+        return context
+
+    def closeAll(self):
+        with self.__condition:
+            for key in self.__idle:
+                for lastUsed, connection in self.__idle[key]:
+                    connection.close()
+                    self.__active[key] -= 1
+            self.__idle = {}
+            self.__condition.notifyAll()
+
+    def getStats(self):
+        with self.__condition:
+            return dict(self.stats)
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Sends the request on a pooled connection. A GET on a reused connection that was closed by the
+    # server is sent again once on a new connection. Returns the response body as an RMPooledResponse.
+    #
+    def request(self, key, connectionFactory, method, selector, data, headers, timeout):
+        connection, reused = self.__acquire(key, connectionFactory, timeout)
+        try:
+            try:
+                response = self.__send(connection, method, selector, data, headers, timeout)
+            except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error):
+                if not reused or method not in ("GET", "HEAD"):
+                    raise
+                log.debug("Connection pool: %s closed by server, reconnecting" % key[1])
+                connection.close()
+                response = self.__send(connection, method, selector, data, headers, timeout)
+        except:
+            connection.close()
+            self.release(key, None)
+            raise
+
+        return response, RMPooledResponse(self, key, connection, response)
+
+    def __send(self, connection, method, selector, data, headers, timeout):
+        connection.timeout = timeout
+        if connection.sock is None:
+            connection.connect()
+            # Small requests on a kept alive connection shouldn't wait for the delayed ACK of the previous one
+            connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            connection.sock.settimeout(timeout)
+        connection.request(method, selector, data, headers)
+        try:
+            return connection.getresponse(buffering=True)
+        except TypeError:
+            return connection.getresponse()
+
+    def __acquire(self, key, connectionFactory, timeout):
+        deadline = time.time() + timeout
+        with self.__condition:
+            self.stats["requests"] += 1
+            while True:
+                self.__closeIdle()
+                idle = self.__idle.get(key)
+                if idle:
+                    self.stats["reused"] += 1
+                    return idle.pop()[1], True
+
+                if self.__active.get(key, 0) < RMConnectionPool.MaxConnectionsPerHost:
+                    self.__active[key] = self.__active.get(key, 0) + 1
+                    self.stats["connections"] += 1
+                    return connectionFactory(), False
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise urllib2.URLError("timeout waiting for a connection to %s" % key[1])
+                self.__condition.wait(remaining)
+
+    def release(self, key, connection):
+        ### connection can serve the next request, None when it was closed
+        with self.__condition:
+            if connection is None:
+                self.__active[key] -= 1
+            else:
+                self.__idle.setdefault(key, []).append((time.time(), connection))
+            self.__condition.notify()
+
+    def __closeIdle(self):
+        minTimestamp = time.time() - RMConnectionPool.IdleTimeout
+        for key, idle in self.__idle.items():
+            while idle and idle[0][0] < minTimestamp:
+                idle.pop(0)[1].close()
+                self.__active[key] -= 1
+            if not idle:
+                del self.__idle[key]
+
+#-----------------------------------------------------------------------------------------------
+#
+# Body of a response received on a pooled connection. The connection is given back to the pool when
+# the body is read to the end, when it's closed before that the connection is closed.
+#
+class RMPooledResponse:
+
+    def __init__(self, pool, key, connection, response):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        if response.length == 0: # 204, 304 and HEAD responses have no body to read
+            self.__finish(True)
+
+    def read(self, size = -1):
+        if self.response is None:
+            return ""
+        try:
+            if size is None or size < 0:
+                data = self.response.read()
+            else:
+                data = self.response.read(size)
+        except:
+            self.__finish(False)
+            raise
+        if self.response.isclosed():
+            self.__finish(True)
+        return data
+
+    recv = read # for socket._fileobject
+
+    def close(self):
+        self.__finish(False)
+
+    def __del__(self):
+        self.__finish(False)
+
+    def __finish(self, complete):
+        if self.response is None:
+            return
+        if complete and not self.response.will_close:
+            self.pool.release(self.key, self.connection)
+        else:
+            self.connection.close()
+            self.pool.release(self.key, None)
+        self.response.close()
+        self.response = None
+        self.connection = None
+
+#-----------------------------------------------------------------------------------------------
+#
+# urllib2 handlers sending requests through RMConnectionPool. Same as urllib2 do_open() without
+# the "Connection: close" header.
+#
+class RMKeepAliveHandlerMixin:
+
+    def openPooled(self, req, scheme, connectionFactory):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items() if k not in headers))
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        key = (scheme, host, self.verify)
+        try:
+            response, body = self.pool.request(key, lambda: connectionFactory(host, req.timeout),
+                                               req.get_method(), req.get_selector(), req.data, headers, req.timeout)
+        except socket.error, err:
+            raise urllib2.URLError(err)
+
+        # Like urllib2 do_open() the body is read through a socket file object which adds readline()
+        result = urllib.addinfourl(socket._fileobject(body, close=True), response.msg, req.get_full_url())
+        result.code = response.status
+        result.msg = response.reason
+        return result
+
+
+class RMKeepAliveHTTPHandler(RMKeepAliveHandlerMixin, urllib2.HTTPHandler):
+
+    def __init__(self, pool, verify):
+        urllib2.HTTPHandler.__init__(self)
+        self.pool = pool
+        self.verify = verify
+
+    def http_open(self, req):
+        if req._tunnel_host: # Proxies are not pooled
+            return urllib2.HTTPHandler.http_open(self, req)
+        return self.openPooled(req, "http", lambda host, timeout: httplib.HTTPConnection(host, timeout=timeout))
+
+
+class RMKeepAliveHTTPSHandler(RMKeepAliveHandlerMixin, urllib2.HTTPSHandler):
+
+    def __init__(self, pool, verify):
+        self.pool = pool
+        self.verify = verify
+        self.context = pool.getContext(verify)
+        if self.context is None: # ssl without SSLContext support
+            urllib2.HTTPSHandler.__init__(self)
+        else:
+            urllib2.HTTPSHandler.__init__(self, context=self.context)
+
+    def https_open(self, req):
+        if req._tunnel_host:
+            return urllib2.HTTPSHandler.https_open(self, req)
+        if self.context is None:
+            return self.openPooled(req, "https", lambda host, timeout: httplib.HTTPSConnection(host, timeout=timeout))
+        return self.openPooled(req, "https", lambda host, timeout: httplib.HTTPSConnection(host, timeout=timeout, context=self.context))
+
+
+globalConnectionPool = RMConnectionPool()
+
+
+#-----------------------------------------------------------------------------------------------
+# Main Test Unit: latency of 50 sequential requests to a local HTTPS server (self signed certificate)
+# with a new connection and SSL context per request like before, and with the connection pool.
+# Then large bodies read in parts, responses closed before their end and responses without a body.
+#
+if __name__ == "__main__":
+    import os, sys, shutil, tempfile, subprocess, logging
+    from threading import Thread
+    from SocketServer import ThreadingMixIn
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+    log.setLevel(logging.INFO)
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from RMParserFramework.rmConnectionPool import globalConnectionPool # the instance used by RMParser
+
+    certDir = tempfile.mkdtemp()
+    certFile = os.path.join(certDir, "server.pem")
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                           "-keyout", certFile, "-out", certFile], stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+
+    body = '{"body": {"home": "%s"}}' % ("x" * 2000)
+    largeBody = "".join("line %d\n" % i for i in range(200000))
+    connections = [0]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        wbufsize = -1 # one write per response
+
+        def setup(self):
+            connections[0] += 1
+            BaseHTTPRequestHandler.setup(self)
+
+        def do_GET(self):
+            if self.path.endswith("/notmodified"):
+                self.send_response(304)
+                self.end_headers()
+                return
+            data = largeBody if self.path.endswith("/large") else body
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", len(data))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            pass # kept alive connections closed by the client
+
+    server = Server(("127.0.0.1", 0), Handler)
+    server.socket = ssl.wrap_socket(server.socket, certfile=certFile, server_side=True)
+    serverThread = Thread(target=server.serve_forever)
+    serverThread.daemon = True
+    serverThread.start()
+    url = "https://localhost:%d/api/getmeasure" % server.server_port
+
+    def oldOpenURL():
+        # RMParser.openURL before the pool: verified attempt fails on the self signed certificate,
+        # then a new unverified context and connection
+        request = urllib2.Request(url=url)
+        try:
+            return urllib2.urlopen(url=request, timeout=60)
+        except Exception:
+            return urllib2.urlopen(url=request, timeout=60, context=ssl._create_unverified_context())
+
+    def newConnection():
+        return urllib2.urlopen(url=urllib2.Request(url=url), timeout=60, context=ssl._create_unverified_context())
+
+    def pooled():
+        return globalConnectionPool.open(urllib2.Request(url=url), verify=False)
+
+    for label, function in (("openURL before the pool", oldOpenURL), ("new connection", newConnection), ("connection pool", pooled)):
+        connections[0] = 0
+        latencies = []
+        for i in range(50):
+            startTime = time.time()
+            if function().read() != body:
+                print "Wrong body"
+            latencies.append((time.time() - startTime) * 1000)
+        latencies.sort()
+        print "%-24s mean %6.2f ms  median %6.2f ms  max %6.2f ms  %2d connections" % \
+              (label, sum(latencies) / len(latencies), latencies[len(latencies) / 2], latencies[-1], connections[0])
+
+    print "Pool stats:", globalConnectionPool.getStats()
+
+    failed = False
+    def check(name, ok):
+        global failed
+        if not ok:
+            print "  %s FAILED" % name
+            failed = True
+
+    def openPath(path):
+        return globalConnectionPool.open(urllib2.Request(url=url.replace("/api/getmeasure", path)), verify=False)
+
+    def newConnections(function):
+        before = globalConnectionPool.getStats()["connections"]
+        function()
+        return globalConnectionPool.getStats()["connections"] - before
+
+    def readParts():
+        response = openPath("/large")
+        check("large body lines", [response.readline() for i in range(3)] == ["line 0\n", "line 1\n", "line 2\n"])
+        parts = []
+        while True:
+            part = response.read(65536)
+            if not part:
+                break
+            parts.append(part)
+        check("large body", "".join(parts) == largeBody[len("line 0\nline 1\nline 2\n"):])
+
+    check("large body read in parts reuses the connection", newConnections(readParts) == 0)
+    check("next request reuses the connection", newConnections(lambda: openPath("/large").read()) == 0)
+
+    response = openPath("/large")
+    response.read(1000)
+    response.close()
+    check("response closed before its end closes the connection", newConnections(lambda: pooled().read()) == 1)
+
+    def notModified():
+        try:
+            openPath("/notmodified")
+        except urllib2.HTTPError, e:
+            check("not modified status", e.code == 304)
+    check("response without a body reuses the connection", newConnections(notModified) + newConnections(lambda: pooled().read()) == 0)
+    print "Pool stats:", globalConnectionPool.getStats()
+
+    globalConnectionPool.closeAll()
+    server.shutdown()
+    shutil.rmtree(certDir)
+    print "FAILED" if failed else "OK"
@@ -0,0 +1,458 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import urllib, urllib2
+import mimetools
+from email.utils import parsedate_tz, mktime_tz
+from StringIO import StringIO
+from threading import Lock
+
+from RMUtilsFramework.rmLogging import log
+
+#-----------------------------------------------------------------------------------------------
+#
+# On-disk cache of parser HTTP responses. Each entry keeps the body and the response headers of
+# the last 200 response of an URL (plus the request headers that select a variant like Host).
+# Fresh entries (Cache-Control max-age / Expires) are returned without any request, stale ones are
+# revalidated with If-None-Match / If-Modified-Since and returned as they are on 304 Not Modified.
+# Responses without validators or freshness information are not stored and, like the no-store and
+# larger than MaxEntrySize ones, are returned as they are received without being read in memory.
+#
+class RMHTTPCache:
+
+    MaxCacheSize = 4 * 1024 * 1024  # bytes, least recently used entries are removed above this
+    MaxEntrySize = 1024 * 1024      # larger responses are not cached
+
+    def __init__(self, cacheDir = None):
+        self.cacheDir = cacheDir
+        self.enabled = True
+        self.clock = time.time
+
+        self.__lock = Lock()
+        self.__cacheSize = None
+        self.resetStats()
+
+    def setCacheDir(self, cacheDir):
+        self.cacheDir = cacheDir
+        self.__cacheSize = None
+
+    def resetStats(self):
+        self.stats = {
+            "requests": 0,          # open() calls
+            "fresh": 0,             # served from cache without contacting the server
+            "notModified": 0,       # revalidated with a 304 response
+            "downloaded": 0,        # full 200 responses
+            "bytesDownloaded": 0,   # body bytes received from the servers
+            "bytesFromCache": 0,    # body bytes served from the cache
+        }
+
+    def getStats(self):
+        with self.__lock:
+            return dict(self.stats)
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Opens url with urllib2 opener function openFunction(request) going through the cache. Returns
+    # a response object like urllib2.urlopen() with an extra 'unchanged' attribute set to True when
+    # the body is the same as the one returned by the previous call for this url.
+    #
+    def open(self, request, openFunction):
+        url = request.get_full_url()
+        key = self.__key(url, request.header_items())
+        entry = self.__load(key) if self.__isUsable(request) else None
+
+        self.__count("requests")
+
+        if entry is not None:
+            if entry["expires"] > self.clock():
+                log.debug("HTTP cache: %s is fresh" % url)
+                return self.__cachedResponse(key, entry, "fresh")
+
+            if entry["etag"]:
+                request.add_header("If-None-Match", entry["etag"])
+            if entry["lastModified"]:
+                request.add_header("If-Modified-Since", entry["lastModified"])
+
+        try:
+            response = openFunction(request)
+        except urllib2.HTTPError, e:
+            if e.code != 304 or entry is None:
+                raise
+            log.debug("HTTP cache: %s not modified" % url)
+            self.__revalidated(key, entry, e.info())
+            return self.__cachedResponse(key, entry, "notModified")
+
+        headers = response.info()
+        contentLength = self.__contentLength(headers)
+        if not self.__isUsable(request) or response.getcode() != 200 or not self.__isStorable(headers, contentLength):
+            self.__count("downloaded", "bytesDownloaded", contentLength or 0)
+            response.unchanged = False
+            return response
+
+        # Without a Content-Length the body is stored only if it ends within MaxEntrySize
+        body = response.read(RMHTTPCache.MaxEntrySize + 1)
+        if len(body) > RMHTTPCache.MaxEntrySize:
+            self.__count("downloaded", "bytesDownloaded", len(body))
+            result = urllib.addinfourl(RMPrefixedFile(body, response), headers, response.geturl(), response.getcode())
+            result.unchanged = False
+            return result
+
+        self.__count("downloaded", "bytesDownloaded", len(body))
+        response.close()
+
+        unchanged = entry is not None and entry.get("hash") == hashlib.sha1(body).hexdigest()
+        self.__store(key, url, headers, body)
+
+        result = urllib.addinfourl(StringIO(body), headers, response.geturl(), response.getcode())
+        result.unchanged = unchanged
+        return result
+
+    def clear(self):
+        with self.__lock:
+            for fileName in self.__entries():
+                self.__remove(fileName)
+            self.__cacheSize = 0
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def __isUsable(self, request):
+        return self.enabled and self.cacheDir is not None and request.get_method() == "GET"
+
+    def __isStorable(self, headers, contentLength):
+        ### True for a response with validators or freshness information the cache can keep
+        cacheControl = (headers.getheader("Cache-Control") or "").lower()
+        if "no-store" in cacheControl or (contentLength is not None and contentLength > RMHTTPCache.MaxEntrySize):
+            return False
+        return bool(headers.getheader("ETag") or headers.getheader("Last-Modified") or self.__expires(headers))
+
+    def __contentLength(self, headers):
+        try:
+            return int(headers.getheader("Content-Length"))
+        except (TypeError, ValueError):
+            return None
+
+    def __key(self, url, headers):
+        # Headers like Host select a different response for the same url
+        headers = sorted((name.lower(), value) for name, value in headers if name.lower() != "user-agent")
+        return hashlib.sha1(url + "\n" + `headers`).hexdigest()
+
+    def __path(self, key, extension):
+        return os.path.join(self.cacheDir, key + extension)
+
+    def __count(self, name, bytesName = None, size = 0):
+        with self.__lock:
+            self.stats[name] += 1
+            if bytesName is not None:
+                self.stats[bytesName] += size
+
+    def __load(self, key):
+        try:
+            with open(self.__path(key, ".meta")) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if not os.path.exists(self.__path(key, ".body")):
+            return None
+        return entry
+
+    def __cachedResponse(self, key, entry, statName):
+        try:
+            with open(self.__path(key, ".body"), "rb") as f:
+                body = f.read()
+        except IOError, e:
+            log.error("HTTP cache: cannot read %s: %s" % (entry["url"], e))
+            body = ""
+
+        self.__count(statName, "bytesFromCache", len(body))
+        os.utime(self.__path(key, ".meta"), None) # least recently used order
+
+        response = urllib.addinfourl(StringIO(body), mimetools.Message(StringIO(entry["headers"])), entry["url"], 200)
+        response.unchanged = True
+        return response
+
+    def __revalidated(self, key, entry, headers):
+        # A 304 can update the validators and the freshness of the stored response
+        if headers is not None:
+            entry["etag"] = headers.getheader("ETag") or entry["etag"]
+            entry["lastModified"] = headers.getheader("Last-Modified") or entry["lastModified"]
+            expires = self.__expires(headers)
+            if expires is not None:
+                entry["expires"] = expires
+        self.__write(self.__path(key, ".meta"), json.dumps(entry))
+
+    def __expires(self, headers):
+        ### Returns the timestamp until the response is fresh, 0 if it must always be revalidated and None if unknown.
+        cacheControl = (headers.getheader("Cache-Control") or "").lower()
+        if "no-cache" in cacheControl:
+            return 0
+
+        maxAge = re.search(r"max-age\s*=\s*(\d+)", cacheControl)
+        if maxAge is not None:
+            try:
+                age = int(headers.getheader("Age") or 0)
+            except ValueError:
+                age = 0
+            return self.clock() + int(maxAge.group(1)) - age
+
+        expires = headers.getheader("Expires")
+        if expires:
+            parsed = parsedate_tz(expires)
+            return mktime_tz(parsed) if parsed is not None else 0
+
+        return None
+
+    def __store(self, key, url, headers, body):
+        entry = {
+            "url": url,
+            "etag": headers.getheader("ETag"),
+            "lastModified": headers.getheader("Last-Modified"),
+            "expires": self.__expires(headers) or 0,
+            "hash": hashlib.sha1(body).hexdigest(),
+            "headers": "".join(headers.headers),
+        }
+
+        try:
+            if not os.path.exists(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            oldSize = self.__size(key)
+            self.__write(self.__path(key, ".body"), body)
+            self.__write(self.__path(key, ".meta"), json.dumps(entry))
+        except (IOError, OSError), e:
+            log.error("HTTP cache: cannot store %s: %s" % (url, e))
+            return
+
+        with self.__lock:
+            if self.__cacheSize is None:
+                self.__cacheSize = sum(self.__size(fileName[:-5]) for fileName in self.__entries())
+            else:
+                self.__cacheSize += len(body) - oldSize
+            if self.__cacheSize > RMHTTPCache.MaxCacheSize:
+                self.__prune()
+
+    def __write(self, path, data):
+        # Readers on other threads never see a partially written file and concurrent writers of the same
+        # entry each use their own temporary file
+        fd, tmpPath = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.rename(tmpPath, path)
+        except:
+            try:
+                os.remove(tmpPath)
+            except OSError:
+                pass
+            raise
+
+    def __size(self, key):
+        try:
+            return os.path.getsize(self.__path(key, ".body"))
+        except OSError:
+            return 0
+
+    def __entries(self):
+        try:
+            return [fileName for fileName in os.listdir(self.cacheDir) if fileName.endswith(".meta")]
+        except OSError:
+            return []
+
+    def __remove(self, fileName):
+        for path in (os.path.join(self.cacheDir, fileName), os.path.join(self.cacheDir, fileName[:-5] + ".body")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def __prune(self):
+        entries = []
+        for fileName in self.__entries():
+            try:
+                entries.append((os.path.getmtime(os.path.join(self.cacheDir, fileName)), fileName))
+            except OSError:
+                pass
+
+        for mtime, fileName in sorted(entries):
+            if self.__cacheSize <= RMHTTPCache.MaxCacheSize / 2:
+                break
+            self.__cacheSize -= self.__size(fileName[:-5])
+            self.__remove(fileName)
+
+
+#-----------------------------------------------------------------------------------------------
+#
+# File object returning the already read prefix and then the rest of fileObject.
+#
+class RMPrefixedFile:
+
+    def __init__(self, prefix, fileObject):
+        self.prefix = StringIO(prefix)
+        self.fileObject = fileObject
+
+    def read(self, size = -1):
+        if size is None or size < 0:
+            return self.prefix.read() + self.fileObject.read()
+        data = self.prefix.read(size)
+        if len(data) < size:
+            data += self.fileObject.read(size - len(data))
+        return data
+
+    def readline(self, size = -1):
+        line = self.prefix.readline()
+        if not line.endswith("\n"):
+            line += self.fileObject.readline()
+        return line
+
+    def readlines(self, sizehint = 0):
+        return list(iter(self.readline, ""))
+
+    def close(self):
+        self.fileObject.close()
+
+
+globalHTTPCache = RMHTTPCache()
+
+
+#-----------------------------------------------------------------------------------------------
+# Main Test Unit: a simulated day of parser runs every 30 minutes against a local stand-in server
+# for NOAA (ETag), met.no (Last-Modified and Expires) and DWD MOSMIX (ETag, max-age) which refresh
+# their data every few hours. Transfers are slowed down to 30 ms latency and 4 MB/s.
+# Then responses that cannot be stored (without validators, larger than MaxEntrySize with or without
+# a Content-Length) and entries written by several threads at once.
+#
+if __name__ == "__main__":
+    import sys, shutil, tempfile, logging
+    from threading import Thread
+    from email.utils import formatdate
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+    log.setLevel(logging.INFO)
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from RMParserFramework.rmParser import RMParser
+    from RMParserFramework.rmHTTPCache import globalHTTPCache # the instance used by RMParser, not this __main__ one
+
+    simulatedTime = [1500000000]
+    upstreams = {
+        # path: (refresh interval, body size, headers(version, nextRefresh))
+        "/noaa": (6 * 3600, 150 * 1024, lambda version, nextRefresh: {"ETag": '"noaa-%d"' % version}),
+        "/metno": (2 * 3600, 60 * 1024, lambda version, nextRefresh: {"Last-Modified": formatdate(version * 2 * 3600, usegmt=True),
+                                                                       "Expires": formatdate(nextRefresh, usegmt=True)}),
+        "/mosmix": (6 * 3600, 40 * 1024, lambda version, nextRefresh: {"ETag": '"mosmix-%d"' % version,
+                                                                        "Cache-Control": "max-age=%d" % (nextRefresh - simulatedTime[0])}),
+    }
+    uncacheable = {
+        "/live": (1800, 200 * 1024, lambda version, nextRefresh: {}),
+        "/large": (6 * 3600, 2 * 1024 * 1024, lambda version, nextRefresh: {"ETag": '"large-%d"' % version}),
+        "/unsized": (6 * 3600, 2 * 1024 * 1024, lambda version, nextRefresh: {"ETag": '"unsized-%d"' % version, "Content-Length": None}),
+    }
+    serverStats = {"requests": 0, "bytes": 0}
+
+    def upstreamResponse(path):
+        interval, size, headers = upstreams.get(path) or uncacheable[path]
+        version = simulatedTime[0] // interval
+        body = ("%s version %d\n" % (path, version)) * (size // 20)
+        return version, body, headers(version, (version + 1) * interval)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            version, body, headers = upstreamResponse(self.path)
+            serverStats["requests"] += 1
+            time.sleep(0.03)
+            if (headers.get("ETag") and self.headers.getheader("If-None-Match") == headers["ETag"]) or \
+               (headers.get("Last-Modified") and self.headers.getheader("If-Modified-Since") == headers["Last-Modified"]):
+                self.send_response(304)
+                body = ""
+            else:
+                self.send_response(200)
+                time.sleep(len(body) / (4.0 * 1024 * 1024))
+            for name, value in headers.items():
+                if value is not None:
+                    self.send_header(name, value)
+            if not "Content-Length" in headers:
+                self.send_header("Content-Length", len(body))
+            self.end_headers()
+            self.wfile.write(body)
+            serverStats["bytes"] += len(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    serverThread = Thread(target=server.serve_forever)
+    serverThread.daemon = True
+    serverThread.start()
+    baseURL = "http://127.0.0.1:%d" % server.server_port
+
+    class RMTestParser(RMParser):
+        parserName = "HTTP Cache Test"
+
+    parser = RMTestParser()
+    cacheDir = tempfile.mkdtemp()
+    globalHTTPCache.clock = lambda: simulatedTime[0]
+
+    for label, useCache in (("without cache", False), ("with cache", True)):
+        globalHTTPCache.setCacheDir(cacheDir)
+        globalHTTPCache.clear()
+        globalHTTPCache.resetStats()
+        serverStats.update(requests = 0, bytes = 0)
+        simulatedTime[0] = 1500000000 - 1500000000 % 86400
+
+        errors = 0
+        unchanged = 0
+        startTime = time.time()
+        for run in range(48):
+            for path in sorted(upstreams):
+                response = parser.openURL(baseURL + path, useCache = useCache)
+                if response.read() != upstreamResponse(path)[1]:
+                    errors += 1
+                unchanged += getattr(response, "unchanged", False)
+            simulatedTime[0] += 1800
+        wallTime = time.time() - startTime
+
+        stats = globalHTTPCache.getStats()
+        print "%-14s %3d requests %8d KB transferred %6.2f s wall time, %d unchanged responses, %d wrong bodies" % \
+              (label, serverStats["requests"], serverStats["bytes"] / 1024, wallTime, unchanged, errors)
+        if useCache:
+            print "%14s %d fresh, %d not modified, %d downloaded" % ("", stats["fresh"], stats["notModified"], stats["downloaded"])
+
+    failed = False
+    storedEntries = len(os.listdir(cacheDir))
+    for path in sorted(uncacheable):
+        response = parser.openURL(baseURL + path)
+        if isinstance(response.fp, StringIO):
+            print "%s: response read in memory" % path
+            failed = True
+        if response.read() != upstreamResponse(path)[1] or response.unchanged:
+            print "%s: wrong response" % path
+            failed = True
+    if len(os.listdir(cacheDir)) != storedEntries:
+        print "Uncacheable responses stored"
+        failed = True
+
+    def writeEntry(index):
+        for i in range(50):
+            globalHTTPCache._RMHTTPCache__write(os.path.join(cacheDir, "concurrent.body"), "%d" % index * 1000)
+    writers = [Thread(target=writeEntry, args=(index, )) for index in range(4)]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    if [fileName for fileName in os.listdir(cacheDir) if fileName.endswith(".tmp")] or \
+       not open(os.path.join(cacheDir, "concurrent.body")).read() in ["%d" % index * 1000 for index in range(4)]:
+        print "Concurrent writes of an entry failed"
+        failed = True
+
+    server.shutdown()
+    shutil.rmtree(cacheDir)
+    print "FAILED" if failed else "OK"
@@ -0,0 +1,229 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import time, math
+
+from RMDataFramework.rmMixerData import RMMixerData
+from RMDataFramework.rmUserSettings import globalSettings
+from RMDatabaseFramework.rmDatabase import rmExecuteCommand
+from RMDatabaseFramework.rmDatabaseManager import globalDbManager
+from RMFormulaFramework.formula import asceDailyBatch
+from RMUtilsFramework.rmCommandThread import RMCommand
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmTimeUtils import rmGetStartOfDay, rmCurrentDayTimestamp, rmTimestampToDayOfYear
+
+#-----------------------------------------------------------------------------------------------
+#
+# Merges the parserData of all enabled parsers into one mixerData record per day:
+#  - each parser's values for a day come from its newest forecast for each timestamp and are
+#    reduced to daily values (mean, sum, min/max, most frequent condition, see below)
+#  - for each field of a day only some parsers are used: for past days the observation parsers
+#    (parserHistorical without parserForecast) when at least one has the field, the forecast
+#    parsers otherwise, and the other way around for today and the next days. Of those, the
+#    parsers with the highest parserPriority are used and their daily values are averaged.
+#  - et0calc is computed with the ASCE daily formula from the mixed values, et0final is the
+#    ET0 reported by the parsers or et0calc when none does
+# Parsers are always taken in parser ID order so the same data gives the same mixerData.
+#
+class RMMixerSource:
+    def __init__(self, parserID, priority = 0, observed = False):
+        self.parserID = parserID
+        self.priority = priority
+        self.observed = observed
+
+    def __repr__(self):
+        return "(" + `self.parserID` + ", priority=" + `self.priority` + ", observed=" + `self.observed` + ")"
+
+class RMMixer:
+
+    MeanFields = ("temperature", "rh", "wind", "skyCover", "pressure", "dewPoint")
+    SumFields = ("solarRad", "rain", "et0", "qpf")
+    MaxFields = ("pop", )
+    MixedFields = MeanFields + SumFields + MaxFields + ("minTemp", "maxTemp", "minRH", "maxRH", "condition")
+
+    def __init__(self, parserDataTable, mixerDataTable):
+        self.parserDataTable = parserDataTable
+        self.mixerDataTable = mixerDataTable
+
+        self.lastRunStats = None
+        self.__lastMixDayTimestamp = None # Days that became past days since then are mixed again with the observations
+
+    def run(self, forecast, sources, dayTimestamps):
+        ### Mixes the given days again and saves them with forecast. Returns the new mixerData values.
+        startTime = time.time()
+        todayTimestamp = rmCurrentDayTimestamp()
+
+        dayTimestamps = set(dayTimestamps)
+        if self.__lastMixDayTimestamp is not None and dayTimestamps:
+            dayTimestamp = self.__lastMixDayTimestamp
+            while dayTimestamp < todayTimestamp:
+                dayTimestamps.add(dayTimestamp)
+                dayTimestamp = rmGetStartOfDay(dayTimestamp + 129600)
+
+        values = self.mix(sources, sorted(dayTimestamps), todayTimestamp)
+        if not values:
+            return None
+
+        command = RMCommand("storeMixerValues", True, self.__writeMixerValues, (forecast, values, todayTimestamp))
+        if not rmExecuteCommand(command):
+            return None
+
+        self.__lastMixDayTimestamp = todayTimestamp
+        self.lastRunStats = {
+            "days": len(values),
+            "parsers": len(sources),
+            "time": time.time() - startTime
+        }
+        log.info("*** Mixed %d days from %d parsers in %.2f seconds" % (len(values), len(sources), self.lastRunStats["time"]))
+
+        return values
+
+    def mix(self, sources, dayTimestamps, todayTimestamp):
+        ### Mixed values for each day with parser values, in day order
+        if not dayTimestamps:
+            return []
+
+        wantedDays = set(dayTimestamps)
+        minTimestamp = min(dayTimestamps)
+        maxTimestamp = rmGetStartOfDay(max(dayTimestamps) + 129600)
+
+        sources = sorted(sources, key=lambda source: source.parserID)
+        dailyValues = {} # day -> [(source, daily values)]
+        for source in sources:
+            dayValues = None
+            dayTimestamp = None
+            for value in self.parserDataTable.getLatestRecordsByParserID(source.parserID, minTimestamp, maxTimestamp):
+                valueDayTimestamp = rmGetStartOfDay(value.timestamp)
+                if valueDayTimestamp != dayTimestamp:
+                    if dayValues:
+                        dailyValues.setdefault(dayTimestamp, []).append((source, self.aggregateDay(dayTimestamp, dayValues)))
+                    dayTimestamp = valueDayTimestamp
+                    dayValues = []
+                if valueDayTimestamp in wantedDays:
+                    dayValues.append(value)
+            if dayValues:
+                dailyValues.setdefault(dayTimestamp, []).append((source, self.aggregateDay(dayTimestamp, dayValues)))
+
+        values = [self.mixDay(dayTimestamp, dailyValues[dayTimestamp], dayTimestamp < todayTimestamp) for dayTimestamp in sorted(dailyValues)]
+        self.computeET0(values)
+        return values
+
+    def aggregateDay(self, dayTimestamp, values):
+        ### Daily values of one parser from its values of that day
+        daily = RMMixerData(dayTimestamp)
+
+        for field in RMMixer.MeanFields:
+            fieldValues = [getattr(value, field) for value in values if getattr(value, field) is not None]
+            if fieldValues:
+                setattr(daily, field, math.fsum(fieldValues) / len(fieldValues))
+
+        for field in RMMixer.SumFields:
+            fieldValues = [getattr(value, field) for value in values if getattr(value, field) is not None]
+            if fieldValues:
+                setattr(daily, field, math.fsum(fieldValues))
+
+        for field in RMMixer.MaxFields:
+            fieldValues = [getattr(value, field) for value in values if getattr(value, field) is not None]
+            if fieldValues:
+                setattr(daily, field, max(fieldValues))
+
+        daily.minTemp = self.__extreme(min, values, "minTemperature", "temperature")
+        daily.maxTemp = self.__extreme(max, values, "maxTemperature", "temperature")
+        daily.minRH = self.__extreme(min, values, "minRh", "rh")
+        daily.maxRH = self.__extreme(max, values, "maxRh", "rh")
+
+        # Most frequent condition, the earliest one on ties
+        counts = {}
+        for value in values:
+            if value.condition is not None:
+                counts[value.condition] = counts.get(value.condition, 0) + 1
+        for value in values:
+            if value.condition is not None and (daily.condition is None or counts[value.condition] > counts[daily.condition]):
+                daily.condition = value.condition
+
+        return daily
+
+    def mixDay(self, dayTimestamp, dailyValues, isPastDay):
+        ### dailyValues: [(RMMixerSource, daily values)] in parser ID order
+        mixed = RMMixerData(dayTimestamp)
+
+        for field in RMMixer.MixedFields:
+            candidates = [(source, getattr(daily, field)) for source, daily in dailyValues if getattr(daily, field) is not None]
+            if not candidates:
+                continue
+
+            preferred = [candidate for candidate in candidates if candidate[0].observed == isPastDay]
+            if preferred:
+                candidates = preferred
+
+            priority = max(source.priority for source, value in candidates)
+            fieldValues = [value for source, value in candidates if source.priority == priority]
+
+            if field == "condition":
+                setattr(mixed, field, fieldValues[0])
+            else:
+                setattr(mixed, field, math.fsum(fieldValues) / len(fieldValues))
+
+        return mixed
+
+    def computeET0(self, values):
+        location = globalSettings.location
+        rows = [value for value in values if value.minTemp is not None and value.maxTemp is not None and value.minTemp <= value.maxTemp]
+
+        if rows and location.latitude is not None:
+            et0 = asceDailyBatch([rmTimestampToDayOfYear(value.timestamp) for value in rows],
+                                 [value.minTemp for value in rows],
+                                 [value.maxTemp for value in rows],
+                                 [value.wind for value in rows],
+                                 None, # wind measured at 10m
+                                 location.latitude,
+                                 location.elevation,
+                                 [value.solarRad for value in rows],
+                                 None,
+                                 [value.minRH for value in rows],
+                                 [value.maxRH for value in rows],
+                                 [value.pressure for value in rows],
+                                 location.krs,
+                                 [value.dewPoint for value in rows])
+            for value, valueET0 in zip(rows, et0):
+                if not math.isnan(valueET0):
+                    value.et0calc = float(valueET0)
+
+        for value in values:
+            if value.et0 is not None:
+                value.et0final = value.et0
+            else:
+                value.et0final = value.et0calc
+
+    def resetToDefault(self):
+        self.mixerDataTable.clear(True)
+        self.__lastMixDayTimestamp = None
+
+    def __writeMixerValues(self, forecast, values, todayTimestamp):
+        try:
+            with globalDbManager.mixerDatabase.transaction():
+                self.mixerDataTable.addRecords(forecast.id, forecast.timestamp, values)
+                # Past days keep only the values of their last forecast
+                self.mixerDataTable.deleteRecordsHistoryByDayThreshold(todayTimestamp, False)
+                if globalSettings.mixerHistorySize > 0:
+                    self.mixerDataTable.deleteRecordsByDayThreshold(todayTimestamp - globalSettings.mixerHistorySize * 86400, False)
+        except Exception, e:
+            log.error("  * Cannot save mixer values for forecast %s: %s" % (forecast.id, e))
+            return False
+
+        return True
+
+    def __extreme(self, function, values, field, fallbackField):
+        fieldValues = []
+        for value in values:
+            fieldValue = getattr(value, field)
+            if fieldValue is None:
+                fieldValue = getattr(value, fallbackField)
+            if fieldValue is not None:
+                fieldValues.append(fieldValue)
+        if fieldValues:
+            return function(fieldValues)
+        return None
@@ -8,11 +8,15 @@ from functools import wraps
 import errno
 import os
 import signal
+import threading
 import urllib, urllib2, ssl
 import sys
 import datetime
 
 from RMDataFramework.rmWeatherData import *
+from RMDataFramework.rmWeatherDataFrame import RMWeatherDataFrame
+from RMParserFramework.rmHTTPCache import globalHTTPCache
+from RMParserFramework.rmConnectionPool import globalConnectionPool
 from RMUtilsFramework.rmLogging import log
 from RMUtilsFramework.rmTimeUtils import rmCurrentDayTimestamp, rmGetStartOfDayUtc
 from RMFormulaFramework.formula import asceDaily
@@ -22,6 +26,12 @@ ALLOW_HISTORIC_PARSERS = True
 class RMTimeoutError(Exception):
     pass
 
+def _canUseAlarm():
+    # SIGALRM handlers can only be installed from the main thread. Parsers running on
+    # worker threads rely on the deadline enforced by RMParserManager instead.
+    global USE_THREADING__
+    return not USE_THREADING__ and isinstance(threading.current_thread(), threading._MainThread)
+
 def _handle_timeout(signum, frame):
     error_message = os.strerror(errno.ETIME)
     log.error("*** Timeout occurred while running a parser: %s" % error_message)
@@ -38,8 +48,8 @@ class RMParserType(type):
             # Add timeout to perform function
             if hasattr(cls, "perform"):
                 def timedPerform(self):
-                    global USE_THREADING__
-                    if not USE_THREADING__:
+                    useAlarm = _canUseAlarm()
+                    if useAlarm:
                         seconds = 10 * 60
                         _old_handler = signal.signal(signal.SIGALRM, _handle_timeout)
                         signal.alarm(seconds)
@@ -50,7 +60,7 @@ class RMParserType(type):
                         log.exception(e)
                         return None
                     finally:
-                        if not USE_THREADING__:
+                        if useAlarm:
                             signal.alarm(0)
                             signal.signal(signal.SIGALRM, _old_handler)
 
@@ -82,6 +92,7 @@ class RMParser(object):
     parserForecast = False
     parserHistorical = False
     parserInterval = 60 * 60 * 3
+    parserPriority = 0 # the mixer uses the parsers with the highest priority that have a value for a day
     parserEnabled = False
     parserDebug = False
     params = {}
@@ -93,7 +104,7 @@ class RMParser(object):
     isRunning = False
 
     def __init__(self):
-        self.result = {}
+        self.result = RMWeatherDataFrame() # {timestamp: RMWeatherData} like
         self.settings = {} #set from parserManager
         self.runtime = {RMParser.RuntimeDayTimestamp: 0}
 
@@ -103,7 +114,9 @@ class RMParser(object):
     def perform(self):
         log.warning("*** Perform method not implemented by parser '%s'" % self.parserName)
 
-    def openURL(self, url, params = None, encodeParameters = True, headers = {}):
+    def openURL(self, url, params = None, encodeParameters = True, headers = {}, useCache = True):
+        ### Responses go through globalHTTPCache unless useCache is False. The returned response has an 'unchanged'
+        ### attribute set to True when the body is the same as the one received by the previous call for this url.
         if params:
             if encodeParameters:
                 query_string = urllib.urlencode(params)
@@ -114,15 +127,19 @@ class RMParser(object):
 
         log.debug("Parser '%s': downloading from %s" % (self.parserName, url))
 
+        urlOpen = globalConnectionPool.open
+        if useCache:
+            urlOpen = lambda request, **kwargs: globalHTTPCache.open(request, lambda request: globalConnectionPool.open(request, **kwargs))
+
         try:
             req = urllib2.Request(url=url, headers=headers)
-            res = urllib2.urlopen(url=req, timeout=60)
+            res = urlOpen(req, timeout=60)
             return res
         except Exception, e:
             if hasattr(ssl, '_create_unverified_context'): #for mac os only in order to ignore invalid certificates
                 try:
-                    context = ssl._create_unverified_context()
-                    res = urllib2.urlopen(url=req, timeout=60, context=context)
+                    req = urllib2.Request(url=url, headers=headers)
+                    res = urlOpen(req, timeout=60, verify=False)
                     return res
                 except Exception, e:
                     log.error("*** Error in parser '%s' while downloading data from %s, error: %s" % (self.parserName, url, e))
@@ -141,12 +158,11 @@ class RMParser(object):
 
         timestamp = timestamp - (timestamp % 3600)
         if ALLOW_HISTORIC_PARSERS or self.runtime[RMParser.RuntimeDayTimestamp] < timestamp:
-            if timestamp not in self.result:
-                self.result[timestamp] = RMWeatherData(timestamp)
-            self.result[timestamp].setValue(key, value)
+            self.result.setValue(timestamp, key, value)
             #log.debug("%d added value %s" % (timestamp, value))
 
     def addValues(self, key, timestampsWithValues, roundToHour = True):
+        result = self.result
         for entry in timestampsWithValues:
             if len(entry)  == 2:
                 timestamp = entry[0]
@@ -159,9 +175,7 @@ class RMParser(object):
                 timestamp = timestamp - (timestamp % 3600)
 
                 if ALLOW_HISTORIC_PARSERS or self.runtime[RMParser.RuntimeDayTimestamp] < timestamp:
-                    if timestamp not in self.result:
-                        self.result[timestamp] = RMWeatherData(timestamp)
-                    self.result[timestamp].setValue(key, value)
+                    result.setValue(timestamp, key, value)
 
     def addUserValue(self, key,timestamp, value, roundToHour = True):
         if timestamp == None:
@@ -170,15 +184,13 @@ class RMParser(object):
 
         timestamp = timestamp - (timestamp % 3600)
         if self.runtime[RMParser.RuntimeDayTimestamp] < timestamp:
-            if timestamp not in self.result:
-                self.result[timestamp] = RMWeatherData(timestamp)
-            self.result[timestamp].setUserValue(key, value)
+            self.result.setUserValue(timestamp, key, value)
 
     def clearValues(self):
         self.result.clear()
 
     def hasValues(self):
-        return (self.result and True) or False
+        return len(self.result) > 0
 
     def getValues(self):
         return self.result.values()
@@ -5,16 +5,24 @@ import time, copy
 from pprint import pprint
 
 from RMParserFramework.rmParser import RMParser
+from RMParserFramework.rmHTTPCache import globalHTTPCache
+from RMParserFramework.rmMixer import RMMixer, RMMixerSource
 
 from RMDataFramework.rmForecastInfo import RMForecastInfo
+from RMDataFramework.rmWeatherData import rmWeatherDataDigest
 from RMDataFramework.rmParserConfig import RMParserConfig
 
+from RMDatabaseFramework.rmDatabase import rmExecuteCommand, rmSubmitCommand, rmExecuteBatch
 from RMDatabaseFramework.rmDatabaseManager import globalDbManager
 from RMDatabaseFramework.rmParserDataTable import *
 from RMDatabaseFramework.rmForecastInfoTable import RMForecastTable
+from RMDatabaseFramework.rmMixerDataTable import RMMixerDataTable
 from RMDatabaseFramework.rmUserDataTypeTable import RMUserDataTypeTable
 from RMUtilsFramework.rmLogging import log
 from RMUtilsFramework.rmTimeUtils import *
+from RMUtilsFramework.rmCommandThread import RMCommand
+from RMUtilsFramework.rmWorkerPool import RMWorkerPool
+from RMUtilsFramework.rmScheduler import RMScheduler
 
 from RMDataFramework.rmMainDataRecords import RMNotification
 
@@ -24,6 +32,12 @@ class RMParserManager:
 
     IGNORE_PYC_MODULES = True
 
+    FORCE_RUN_PARSERS = True        # SDK: run all enabled parsers every minute, False runs them by their parserInterval like on device
+
+    CONCURRENT_RUN = False          # Run the eligible parsers on a worker pool instead of one after another
+    MAX_CONCURRENT_PARSERS = 4
+    PARSER_TIMEOUT = 10 * 60        # Deadline for a single parser when running concurrently
+
     instance = None
 
     def __init__(self):
@@ -51,9 +65,20 @@ class RMParserManager:
 
         self.userDataTypeTable.buildCache()
 
-        self.mixer = None
+        if globalSettings.databasePath:
+            globalHTTPCache.setCacheDir(os.path.join(globalSettings.databasePath, "cache", "http"))
+
+        self.mixer = RMMixer(self.parserDataTable, RMMixerDataTable(globalDbManager.mixerDatabase))
+
+        self.lastRunStats = None
+        self.__unchangedResults = 0
+        self.__workerPool = None
+
+        self.__scheduler = RMScheduler() # Next timestamp at which each parser is eligible to run
+        self.scheduleListener = None     # Called when a parser becomes due earlier than the previous next run timestamp
 
         self.__load(os.path.dirname(__file__) + '/parsers')
+        self.__reschedule()
 
 
     def preRun(self):
@@ -67,24 +92,33 @@ class RMParserManager:
                 parserConfig.runtimeLastForecastInfo = latestForecastByParser[parserID]
                 if not parserConfig.runtimeLastForecastInfo.processed:
                     unmixedForecastAvailable = True
-                if lastForecast == None:
+                if lastForecast == None or lastForecast.id < parserConfig.runtimeLastForecastInfo.id:
                     lastForecast = parserConfig.runtimeLastForecastInfo
 
-        log.debug("*** All values are already mixed! No need to run the Mixer!")
+        mixerDataValues = None
+        if unmixedForecastAvailable:
+            mixerDataValues = self.__mixUnprocessedForecasts(lastForecast)
+        else:
+            log.debug("*** All values are already mixed! No need to run the Mixer!")
 
-        for parserConfig in self.parsers:
-            self.parserDataTable.clearHistory(parserConfig.dbID, False)
-        globalDbManager.parserDatabase.commit()
-        globalDbManager.parserDatabase.vacuum()
+        commands = [RMCommand("clearHistory", False, self.parserDataTable.clearHistory, (parserConfig.dbID, False)) for parserConfig in self.parsers]
+        commands.append(RMCommand("commit", False, globalDbManager.parserDatabase.commit))
+        commands.append(RMCommand("reclaimSpace", False, globalDbManager.parserDatabase.reclaimSpace))
+        rmExecuteBatch(commands)
+
+        self.__reschedule()
 
-        return None, None
+        if mixerDataValues is None:
+            return None, None
+        return lastForecast, mixerDataValues
 
     def run(self, parserId = None, forceRunParser = False, forceRunMixer = False):
         currentTimestamp = rmCurrentTimestamp()
-        forceRunParser = True
+        forceRunParser = forceRunParser or RMParserManager.FORCE_RUN_PARSERS
 
-        if not forceRunParser and self.__lastRunningTimestamp is not None and (currentTimestamp - self.__lastRunningTimestamp) < self.__runningInterval:
-            # We want to run the parser only each N minutes. This condition is not met, try later.
+        if not forceRunParser and self.__lastRunningTimestamp is not None and (currentTimestamp - self.__lastRunningTimestamp) < self.__runningInterval \
+                and not self.isRunDue(currentTimestamp):
+            # We want to run the parser only each N minutes unless one is due. This condition is not met, try later.
             log.debug("Parser %r not run lastRunning timestamp %s current %s" % (parserId, self.__lastRunningTimestamp, currentTimestamp))
             return None, None
 
@@ -94,7 +128,137 @@ class RMParserManager:
         newForecast = RMForecastInfo(None, currentTimestamp)
 
         log.debug("*** BEGIN Running parsers: %d (%s)" % (newForecast.timestamp, rmTimestampToDateAsString(newForecast.timestamp)))
-        for parserConfig in self.parsers:
+
+        parsersToRun = self.__getParsersToRun(parserId, forceRunParser, newForecast, currentTimestamp)
+
+        runStartTime = time.time()
+        parsersTime = 0
+        self.__unchangedResults = 0
+        mixDayTimestamps = set() # Days with new parser values
+
+        if RMParserManager.CONCURRENT_RUN and len(parsersToRun) > 1:
+            parsersTime, timedOut = self.__performParsersConcurrently(parsersToRun)
+            for parserConfig, parser in parsersToRun:
+                if self.__storeParserValues(parserConfig, parser, newForecast, mixDayTimestamps, parserConfig.dbID in timedOut):
+                    newValuesAvailable = True
+        else:
+            for parserConfig, parser in parsersToRun:
+                self.__prepareParser(parser)
+                parsersTime += self.__performParser(parser)
+                if self.__storeParserValues(parserConfig, parser, newForecast, mixDayTimestamps):
+                    newValuesAvailable = True
+
+        self.lastRunStats = {
+            "parsers": len(parsersToRun),
+            "wallTime": time.time() - runStartTime,
+            "parsersTime": parsersTime,
+            "unchanged": self.__unchangedResults # parsers that returned the values already saved
+        }
+        if parsersToRun:
+            log.info("*** Ran %d parsers in %.2f seconds (sum of parser times %.2f seconds)" %
+                     (len(parsersToRun), self.lastRunStats["wallTime"], parsersTime))
+
+        mixerDataValues = None
+        if newValuesAvailable or forceRunMixer:
+            if newValuesAvailable:
+                rmSubmitCommand(RMCommand("reclaimSpace", False, globalDbManager.parserDatabase.reclaimSpace))
+
+            if forceRunMixer:
+                self.forecastTable.markAllRecordsAsNotProcessed()
+                mixerForecast = newForecast
+                if mixerForecast.id is None:
+                    mixerForecast = self.forecastTable.getLastForecast()
+                mixerDataValues = self.__mixUnprocessedForecasts(mixerForecast)
+            else:
+                # Only the days with new values change
+                mixerDataValues = self.mixer.run(newForecast, self.__getMixerSources(), mixDayTimestamps)
+                if not mixerDataValues is None:
+                    self.forecastTable.markRecordsAsProcessed([newForecast.id])
+
+            if not mixerDataValues is None:
+                for parserConfig in self.parsers:
+                    if parserConfig.runtimeLastForecastInfo:
+                        parserConfig.runtimeLastForecastInfo.processed = True
+        else:
+            log.debug("  * No new value available from parsers")
+
+        self.__reschedule(currentTimestamp)
+
+        log.debug("*** END Running parsers: %s, %d (%s)" % (`newForecast.id`, newForecast.timestamp, rmTimestampToDateAsString(newForecast.timestamp)))
+        return newForecast, mixerDataValues
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Run scheduling: the earliest timestamp at which run() has a parser to run, following the
+    # same rules as __getParsersToRun(), so callers can sleep until then instead of polling run().
+    #
+    def getNextRunTimestamp(self):
+        nextRunTimestamp = self.__scheduler.nextDeadline()
+        if nextRunTimestamp is not None and self.__lastRunningTimestamp is not None and nextRunTimestamp <= self.__lastRunningTimestamp:
+            # Deadlines are after the run that computed them. A run that failed before rescheduling must not become a busy loop.
+            nextRunTimestamp = self.__lastRunningTimestamp + self.__runningInterval
+        return nextRunTimestamp
+
+    def isRunDue(self, timestamp = None):
+        if timestamp is None:
+            timestamp = rmCurrentTimestamp()
+        nextRunTimestamp = self.getNextRunTimestamp()
+        return nextRunTimestamp is not None and nextRunTimestamp <= timestamp
+
+    def __reschedule(self, currentTimestamp = None):
+        if currentTimestamp is None:
+            currentTimestamp = rmCurrentTimestamp()
+
+        previousRunTimestamp = self.__scheduler.nextDeadline()
+
+        for parserConfig, parser in self.parsers.items():
+            deadline = self.__getParserDeadline(parserConfig, parser, currentTimestamp)
+            if deadline is None:
+                self.__scheduler.cancel(parserConfig.dbID)
+            else:
+                self.__scheduler.schedule(parserConfig.dbID, deadline)
+
+        nextRunTimestamp = self.__scheduler.nextDeadline()
+        if self.scheduleListener and nextRunTimestamp is not None and \
+                (previousRunTimestamp is None or nextRunTimestamp < previousRunTimestamp):
+            self.scheduleListener()
+
+    def __getParserDeadline(self, parserConfig, parser, currentTimestamp):
+        if not parserConfig.enabled:
+            return None
+
+        forceRunParser = RMParserManager.FORCE_RUN_PARSERS
+
+        deadline = currentTimestamp
+        if forceRunParser and self.__lastRunningTimestamp is not None:
+            deadline = self.__lastRunningTimestamp + self.__runningInterval # all parsers each minute
+
+        if parserConfig.failCounter >= self.__maxFails:
+            if not forceRunParser and parserConfig.lastFailTimestamp is not None:
+                deadline = max(deadline, parserConfig.lastFailTimestamp + self.__delayAfterMaxFails)
+        elif parserConfig.failCounter > 0:
+            retryDelay = min(self.__minDelayBetweenFails + (parserConfig.failCounter - 1) * self.__stepDelayBetweenFails, self.__maxDelayBetweenFails)
+            deadline = max(deadline, parserConfig.lastFailTimestamp + retryDelay)
+
+        if parser.isRunning:
+            return max(deadline, currentTimestamp + self.__runningInterval) # checked again until it finishes
+
+        if not forceRunParser and not self.forceParsersRun and parserConfig.runtimeLastForecastInfo:
+            lastUpdate = parserConfig.runtimeLastForecastInfo.timestamp
+            if lastUpdate <= currentTimestamp:
+                deadline = max(deadline, lastUpdate + parser.parserInterval)
+
+        return deadline
+
+    def __getParsersToRun(self, parserId, forceRunParser, newForecast, currentTimestamp):
+        parsersToRun = []
+
+        parserConfigs = self.parsers.keys()
+        if RMParserManager.CONCURRENT_RUN:
+            # Results are merged after all parsers finish, keep a deterministic order.
+            parserConfigs.sort(key=lambda parserConfig: parserConfig.dbID)
+
+        for parserConfig in parserConfigs:
             if parserId is not None and parserId != parserConfig.dbID:
                 continue
 
@@ -120,6 +284,11 @@ class RMParserManager:
 
                 parser = self.parsers[parserConfig]
 
+                if parser.isRunning:
+                    # A previous run missed its deadline and is still executing on a worker thread.
+                    log.warning("     * Parser: %s - ignored because it's still running" % parserConfig)
+                    continue
+
                 lastUpdate = None
                 if parserConfig.runtimeLastForecastInfo:
                     # Check if parser hasn't run with an invalid future date
@@ -134,62 +303,187 @@ class RMParserManager:
                     log.debug("     * Ignored because interval %d not expired for timestamp %d lastUpdate: %d" % (parser.parserInterval, newForecast.timestamp, lastUpdate))
                     continue
 
-                log.debug("  * Running parser %s with interval %d" % (parser.parserName, parser.parserInterval))
-                parser.settings = globalSettings.getSettings()
-                parser.runtime[RMParser.RuntimeDayTimestamp] = rmCurrentDayTimestamp()
-
-                try:
-                    parser.lastKnownError = ''
-                    parser.isRunning = True
-                    parser.perform()
-                    parser.isRunning = False
-                except Exception, e:
-                    log.error("  * Cannot execute parser %s" % parser.parserName)
-                    log.exception(e)
-                    parser.isRunning = False
-                    if len(parser.lastKnownError) == 0:
-                        parser.lastKnownError = 'Error: Failed to run'
-
-                if not parser.hasValues():
-                    parserConfig.failCounter += 1
-                    parserConfig.lastFailTimestamp = newForecast.timestamp
-                    if len(parser.lastKnownError) == 0:
-                        parser.lastKnownError = 'Error: parser returned no values'
-                    parser.isRunning = False
-                    if parserConfig.failCounter == 1:
-                        log.warn ("  * Parser %s returned no values" % parser.parserName)
-                    continue
+                parsersToRun.append((parserConfig, parser))
 
+        return parsersToRun
 
-                parserConfig.failCounter = 0
-                parserConfig.lastFailTimestamp = None
+    def __prepareParser(self, parser):
+        log.debug("  * Running parser %s with interval %d" % (parser.parserName, parser.parserInterval))
+        parser.settings = globalSettings.getSettings()
+        parser.runtime[RMParser.RuntimeDayTimestamp] = rmCurrentDayTimestamp()
+        parser.clearValues()
+
+    def __performParser(self, parser):
+        startTime = time.time()
+        try:
+            parser.lastKnownError = ''
+            parser.isRunning = True
+            parser.perform()
+            parser.isRunning = False
+        except Exception, e:
+            log.error("  * Cannot execute parser %s" % parser.parserName)
+            log.exception(e)
+            parser.isRunning = False
+            if len(parser.lastKnownError) == 0:
+                parser.lastKnownError = 'Error: Failed to run'
+
+        return time.time() - startTime
+
+    def __performParsersConcurrently(self, parsersToRun):
+        if self.__workerPool is None:
+            self.__workerPool = RMWorkerPool("parsers", RMParserManager.MAX_CONCURRENT_PARSERS)
+
+        commands = []
+        for parserConfig, parser in parsersToRun:
+            self.__prepareParser(parser)
+            # Set here so that a parser waiting in the queue is not picked up again by the next run.
+            parser.isRunning = True
+            command = RMCommand("parser-%s" % parserConfig.dbID, True)
+            command.command = self.__performParser
+            command.args = (parser, )
+            commands.append(self.__workerPool.submit(command))
+
+        parsersTime = 0
+        timedOut = set() # dbIDs of the parsers that missed their deadline
+        for (parserConfig, parser), command in zip(parsersToRun, commands):
+            if self.__workerPool.waitForCommand(command, RMParserManager.PARSER_TIMEOUT):
+                parsersTime += command.result
+            else:
+                log.error("*** Timeout occurred while running parser %s" % parser.parserName)
+                parsersTime += RMParserManager.PARSER_TIMEOUT
+                # The abandoned run may still finish: its late values are never stored, the next run clears them.
+                parser.lastKnownError = 'Error: Timeout'
+                timedOut.add(parserConfig.dbID)
+
+        return parsersTime, timedOut
+
+    def __storeParserValues(self, parserConfig, parser, newForecast, mixDayTimestamps, timedOut = False):
+        if timedOut or parser.isRunning or not parser.hasValues():
+            parserConfig.failCounter += 1
+            parserConfig.lastFailTimestamp = newForecast.timestamp
+            if len(parser.lastKnownError) == 0:
+                parser.lastKnownError = 'Error: parser returned no values'
+            if parserConfig.failCounter == 1:
+                log.warn ("  * Parser %s returned no values" % parser.parserName)
+            return False
+
+        values = parser.getValues()
+        digest = rmWeatherDataDigest(values)
+
+        # Same result as the last one saved, the upstream data was not updated: only the last run changes
+        cmd = RMCommand("storeParserLastRun", True, self.__writeParserLastRun, (parserConfig.dbID, digest, newForecast.timestamp))
+        unchangedForecastID = rmExecuteCommand(cmd)
+        if unchangedForecastID is not None:
+            parser.clearValues()
+            parserConfig.failCounter = 0
+            parserConfig.lastFailTimestamp = None
+
+            lastForecast = parserConfig.runtimeLastForecastInfo
+            processed = lastForecast is None or lastForecast.id != unchangedForecastID or lastForecast.processed
+            parserConfig.runtimeLastForecastInfo = RMForecastInfo(unchangedForecastID, newForecast.timestamp, processed)
+
+            self.__unchangedResults += 1
+            log.debug("  * Parser %s returned the same values as its last run" % parser.parserName)
+            return False
+
+        # The values are views on the parser frame, clearing the parser values invalidates them
+        dayTimestamps = set(rmGetStartOfDay(value.timestamp) for value in values)
+
+        # The forecast and parser values are written with a single round trip to the command thread
+        cmd = RMCommand("storeParserValues", True, self.__writeParserValues, (parserConfig.dbID, values, newForecast, digest))
+        stored = rmExecuteCommand(cmd)
+        parser.clearValues()
+
+        if not stored:
+            parserConfig.failCounter += 1
+            parserConfig.lastFailTimestamp = newForecast.timestamp
+            parser.lastKnownError = 'Error: cannot save parser values'
+            return False
+
+        parserConfig.failCounter = 0
+        parserConfig.lastFailTimestamp = None
+
+        parserConfig.runtimeLastForecastInfo = newForecast
+        mixDayTimestamps.update(dayTimestamps)
+
+        return True
+
+    def __writeParserLastRun(self, parserID, digest, timestamp):
+        ### The forecast of the saved result with this digest, its last run is saved so it's still known after a restart
+        try:
+            with globalDbManager.parserDatabase.transaction():
+                forecastID = self.parserDataTable.getUnchangedResultForecastID(parserID, digest)
+                if forecastID is not None:
+                    self.parserDataTable.setResultLastRun(parserID, forecastID, timestamp)
+        except Exception, e:
+            log.error("  * Cannot save the last run of parser %s: %s" % (parserID, e))
+            return None
+
+        return forecastID
 
-                if newForecast.id == None:
+    def __writeParserValues(self, parserID, values, newForecast, digest):
+        ### All the values of a parser are written in one transaction: either all of them or none are saved.
+        isNewForecast = newForecast.id is None
+        try:
+            with globalDbManager.parserDatabase.transaction():
+                if isNewForecast:
                     self.forecastTable.addRecordEx(newForecast)
-                parserConfig.runtimeLastForecastInfo = newForecast
 
                 if not globalSettings.vibration:
-                    self.parserDataTable.removeEntriesWithParserIdAndTimestamp(parserConfig.dbID, parser.getValues())
+                    self.parserDataTable.removeEntriesWithParserIdAndTimestamp(parserID, values)
 
-                self.parserDataTable.addRecords(newForecast.id, parserConfig.dbID, parser.getValues())
-                parser.clearValues()
+                self.parserDataTable.addRecords(newForecast.id, parserID, values)
+                self.parserDataTable.setResultDigest(parserID, newForecast.id, digest)
+        except Exception, e:
+            log.error("  * Cannot save values for parser %s: %s" % (parserID, e))
+            if isNewForecast:
+                newForecast.id = None # rolled back
+            return False
 
-                newValuesAvailable = True
+        return True
 
-        mixerDataValues = None
-        if newValuesAvailable:
-            globalDbManager.parserDatabase.vacuum()
 
-            if not mixerDataValues is None:
-                for parserConfig in self.parsers:
-                    if parserConfig.runtimeLastForecastInfo:
-                        parserConfig.runtimeLastForecastInfo.processed = True
-        else:
-            log.debug("  * No new value available from parsers")
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Mixer
+    #
+    def resetMixerToDefault(self):
+        self.mixer.resetToDefault()
+        self.forecastTable.markAllRecordsAsNotProcessed()
 
-        log.debug("*** END Running parsers: %s, %d (%s)" % (`newForecast.id`, newForecast.timestamp, rmTimestampToDateAsString(newForecast.timestamp)))
-        return newForecast, mixerDataValues
+        forecast = self.forecastTable.getLastForecast()
+        if forecast is None:
+            return None, None
+        return forecast, self.__mixUnprocessedForecasts(forecast)
+
+    def __mixUnprocessedForecasts(self, forecast):
+        ### Mixes again all the days with values from forecasts that were not mixed yet, saved with forecast
+        forecasts = self.forecastTable.getUnprocessedRecords()
+        if not forecasts or forecast is None:
+            return None
+
+        forecastIDs = [unprocessedForecast.id for unprocessedForecast in forecasts]
+        minTimestamp, maxTimestamp = self.parserDataTable.getTimestampRangeByForecast(forecastIDs)
+        if minTimestamp is None:
+            return None
+
+        dayTimestamps = []
+        dayTimestamp = rmGetStartOfDay(minTimestamp)
+        while dayTimestamp <= maxTimestamp:
+            dayTimestamps.append(dayTimestamp)
+            dayTimestamp = rmGetStartOfDay(dayTimestamp + 129600)
+
+        mixerDataValues = self.mixer.run(forecast, self.__getMixerSources(), dayTimestamps)
+        if not mixerDataValues is None:
+            self.forecastTable.markRecordsAsProcessed(forecastIDs)
+            for parserConfig in self.parsers:
+                if parserConfig.runtimeLastForecastInfo:
+                    parserConfig.runtimeLastForecastInfo.processed = True
+        return mixerDataValues
 
+    def __getMixerSources(self):
+        return [RMMixerSource(parserConfig.dbID, parser.parserPriority, parser.parserHistorical and not parser.parserForecast)
+                for parserConfig, parser in self.parsers.items() if parserConfig.enabled]
 
     def __load(self, parserDir):
         log.info("*** BEGIN Loading parsers from '%s'" % parserDir)
@@ -335,6 +629,7 @@ class RMParserManager:
 
         parserConfig.enabled = (activate == True)
         self.parserTable.enableParser(parserConfig.dbID, parserConfig.enabled)
+        self.__reschedule()
 
         return True
 
@@ -371,6 +666,7 @@ class RMParserManager:
 
             log.debug(parserConfig)
 
+            self.__reschedule()
             return True
 
         except Exception as e:
@@ -413,6 +709,7 @@ class RMParserManager:
         except Exception, e:
             log.exception(e)
 
+        self.__reschedule()
         log.info("**** END Reset parsers and mixer to default")
 
         return result
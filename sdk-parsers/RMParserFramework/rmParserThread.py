@@ -116,6 +116,18 @@ class RMParserThread(Thread):
     def simulateProgram(self, programId):
         self.__simulator.simulateProgram(programId)
 
+    def getNextRunTimestamp(self):
+        if self.__parserManager is None:
+            return None
+        return self.__parserManager.getNextRunTimestamp()
+
+    def isRunDue(self):
+        return self.__parserManager is not None and self.__parserManager.isRunDue()
+
+    def setScheduleListener(self, listener):
+        if self.__parserManager is not None:
+            self.__parserManager.scheduleListener = listener
+
     #----------------------------------------------------------------------------------------
     #
     #
@@ -0,0 +1,194 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import heapq
+from math import radians, sin, cos, asin, sqrt
+
+#-----------------------------------------------------------------------------------------------
+#
+# Nearest station lookups: k-d tree over the (lat, lon) points mapped on the unit sphere. The chord
+# between two points on the sphere grows with the great circle distance so nearest points by chord
+# are nearest points by haversine distance, without any trigonometry while searching.
+# Distances are returned in km on a sphere of the mean earth radius.
+#
+class RMSpatialIndex:
+
+    EarthRadius = 6371 # km, mean earth radius, also used by the australia-bom parser distances
+
+    def __init__(self, points):
+        ### points: list of (lat, lon, item)
+        nodes = [(self.__toUnitVector(lat, lon), item, index) for index, (lat, lon, item) in enumerate(points)]
+        self.size = len(nodes)
+        self.__root = self.__build(nodes, 0)
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Returns up to k [(distanceKm, item)] sorted by distance.
+    #
+    def nearest(self, lat, lon, k = 1):
+        if k <= 0 or self.__root is None:
+            return []
+
+        target = self.__toUnitVector(lat, lon)
+        best = [] # max heap of (-squaredChord, index, item)
+        self.__searchNearest(self.__root, target, k, best)
+
+        best.sort(key = lambda entry: (-entry[0], entry[1]))
+        return [(self.__chordToKm(sqrt(-negative)), item) for negative, index, item in best]
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    # Returns [(distanceKm, item)] of the points at most radiusKm away sorted by distance.
+    #
+    def withinRadius(self, lat, lon, radiusKm):
+        if self.__root is None or radiusKm < 0:
+            return []
+
+        target = self.__toUnitVector(lat, lon)
+        chord = self.__kmToChord(radiusKm)
+        found = []
+        self.__searchRadius(self.__root, target, chord * chord, found)
+
+        found.sort()
+        return [(self.__chordToKm(sqrt(squaredChord)), item) for squaredChord, index, item in found]
+
+    #-----------------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def __toUnitVector(self, lat, lon):
+        lat = radians(lat)
+        lon = radians(lon)
+        return (cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat))
+
+    def __chordToKm(self, chord):
+        return 2 * RMSpatialIndex.EarthRadius * asin(min(1.0, chord / 2))
+
+    def __kmToChord(self, km):
+        angle = min(km / float(RMSpatialIndex.EarthRadius), 3.141592653589793)
+        return 2 * sin(angle / 2)
+
+    def __build(self, nodes, depth):
+        # node: (vector, item, axis, left, right, index), the point index orders equal distances
+        if not nodes:
+            return None
+
+        axis = depth % 3
+        nodes.sort(key = lambda node: node[0][axis])
+        median = len(nodes) // 2
+        vector, item, index = nodes[median]
+        return (vector, item, axis,
+                self.__build(nodes[:median], depth + 1),
+                self.__build(nodes[median + 1:], depth + 1),
+                index)
+
+    def __searchNearest(self, node, target, k, best):
+        vector, item, axis, left, right, index = node
+
+        dx = vector[0] - target[0]
+        dy = vector[1] - target[1]
+        dz = vector[2] - target[2]
+        squaredChord = dx * dx + dy * dy + dz * dz
+
+        if len(best) < k:
+            heapq.heappush(best, (-squaredChord, index, item))
+        elif squaredChord < -best[0][0]:
+            heapq.heapreplace(best, (-squaredChord, index, item))
+
+        delta = target[axis] - vector[axis]
+        if delta < 0:
+            near, far = left, right
+        else:
+            near, far = right, left
+
+        if near is not None:
+            self.__searchNearest(near, target, k, best)
+        if far is not None and (len(best) < k or delta * delta < -best[0][0]):
+            self.__searchNearest(far, target, k, best)
+
+    def __searchRadius(self, node, target, maxSquaredChord, found):
+        vector, item, axis, left, right, index = node
+
+        dx = vector[0] - target[0]
+        dy = vector[1] - target[1]
+        dz = vector[2] - target[2]
+        squaredChord = dx * dx + dy * dy + dz * dz
+        if squaredChord <= maxSquaredChord:
+            found.append((squaredChord, index, item))
+
+        delta = target[axis] - vector[axis]
+        if left is not None and (delta < 0 or delta * delta <= maxSquaredChord):
+            self.__searchRadius(left, target, maxSquaredChord, found)
+        if right is not None and (delta >= 0 or delta * delta <= maxSquaredChord):
+            self.__searchRadius(right, target, maxSquaredChord, found)
+
+
+#-----------------------------------------------------------------------------------------------
+# Main Test Unit: nearest station and within radius results against a linear haversine scan of the
+# australia-bom WMO station list for 10k random locations, then lookup throughput.
+#
+if __name__ == "__main__":
+    import os, sys, imp, time, random, logging
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    from RMUtilsFramework.rmLogging import log
+    log.setLevel(logging.ERROR)
+
+    bomModule = imp.load_source("australiabom", os.path.join(os.path.dirname(os.path.abspath(__file__)), "parsers", "australia-bom.py"))
+    bom = bomModule.AustraliaBOM()
+    bom.parserDebug = False
+    stations = sorted(bom._AustraliaBOM__getWMOLocations())
+    haversine = bom._AustraliaBOM__distanceBetween
+
+    def linearNearest(lat, lon):
+        # The scan __getNearestWMO did before the index
+        closest = None
+        closestDistance = 9999999
+        for station in stations:
+            distance = haversine((lat, lon), (station[1], station[2]))
+            if distance < closestDistance:
+                closestDistance = distance
+                closest = station
+        return closest
+
+    random.seed(1)
+    locations = [(random.uniform(-44, -10), random.uniform(112, 154)) for i in range(9000)] + \
+                [(random.uniform(-90, 90), random.uniform(-180, 180)) for i in range(1000)]
+
+    startTime = time.time()
+    index = RMSpatialIndex([(station[1], station[2], station) for station in stations])
+    buildTime = time.time() - startTime
+
+    mismatches = 0
+    distanceMismatches = 0
+    for lat, lon in locations:
+        expected = linearNearest(lat, lon)
+        distance, found = index.nearest(lat, lon)[0]
+        if found != expected and abs(haversine((lat, lon), found[1:3]) - haversine((lat, lon), expected[1:3])) > 1e-9:
+            mismatches += 1
+        if abs(distance - haversine((lat, lon), found[1:3])) > 1e-6:
+            distanceMismatches += 1
+    print "Nearest station: %d of %d random locations differ from the linear scan, %d distances differ" % (mismatches, len(locations), distanceMismatches)
+
+    mismatches = 0
+    for lat, lon in locations[:1000]:
+        radius = random.uniform(10, 500)
+        expected = sorted(station for station in stations if haversine((lat, lon), station[1:3]) <= radius)
+        found = sorted(station for distance, station in index.withinRadius(lat, lon, radius))
+        if found != expected:
+            mismatches += 1
+    print "Within radius: %d of 1000 random queries differ from the linear scan" % mismatches
+
+    nearest5 = [station for distance, station in index.nearest(-33.87, 151.21, 5)]
+    expected5 = sorted(stations, key = lambda station: haversine((-33.87, 151.21), station[1:3]))[:5]
+    print "5 nearest to Sydney: %s" % ("same as the linear scan" if nearest5 == expected5 else "DIFFERENT")
+
+    for label, function in (("linear scan", linearNearest), ("k-d tree", lambda lat, lon: index.nearest(lat, lon))):
+        startTime = time.time()
+        for lat, lon in locations[:2000]:
+            function(lat, lon)
+        elapsed = time.time() - startTime
+        print "%-12s %8.0f lookups/s %8.3f ms per lookup" % (label, 2000 / elapsed, elapsed * 1000 / 2000)
+    print "Index of %d stations built in %.2f ms" % (index.size, buildTime * 1000)
@@ -0,0 +1,110 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# RMCommandThread batches, futures and statistics, and the database commands with and without
+# USE_COMMAND_THREAD__:
+#  - executeBatch() runs its commands in order on the command thread, a command that raises is logged,
+#    its result is None and the next commands still run
+#  - submitCommand() and executeBatch(synch = False) return futures
+#  - getCommandStats() counts every command executed, batched or not
+#  - rmExecuteCommand(), rmSubmitCommand() and rmExecuteBatch() run the commands on the caller thread
+#    without USE_COMMAND_THREAD__, so they can use a database opened on that thread
+#
+
+import sys, thread, logging
+sys.path.append('../')
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmCommandThread import RMCommand, RMCommandThread
+from RMDatabaseFramework import rmDatabase
+from RMDatabaseFramework.rmDatabase import RMParsersDatabase, rmExecuteCommand, rmSubmitCommand, rmExecuteBatch
+
+log.setLevel(logging.CRITICAL)
+
+failed = False
+
+def check(name, value, expected):
+    global failed
+    if value != expected:
+        print "  %s: %s, expected %s" % (name, value, expected)
+        failed = True
+
+executed = []
+def record(name):
+    executed.append((name, thread.get_ident()))
+    return name
+
+def fail():
+    raise ValueError("failed command")
+
+RMCommandThread.createInstance()
+commandThread = RMCommandThread.instance.ident
+
+#-----------------------------------------------------------------------------------------------------------
+# Batches
+#
+commands = [RMCommand("record", False, record, ("first", )),
+            RMCommand("fail", False, fail),
+            RMCommand("record", False, record, ("second", )),
+            RMCommand("record", False, record, ), # missing argument, raises
+            RMCommand("record", False, record, None, {"name": "third"})]
+results = RMCommandThread.instance.executeBatch(commands)
+print "batch: results %s" % results
+check("batch results", results, ["first", None, "second", None, "third"])
+check("batch order and thread", executed, [("first", commandThread), ("second", commandThread), ("third", commandThread)])
+check("batch commands finished", [command.isFinished() for command in commands], [True] * 5)
+
+del executed[:]
+future = RMCommandThread.instance.executeBatch([RMCommand("record", False, record, (str(index), )) for index in range(100)], False)
+check("asynchronous batch", future.getResult(5), [str(index) for index in range(100)])
+
+# A synchronous command issued from the command thread runs directly
+nested = RMCommand("nested", True, lambda: RMCommandThread.instance.executeCommand(RMCommand("record", True, record, ("nested", ))))
+check("nested command", RMCommandThread.instance.executeCommand(nested), "nested")
+
+#-----------------------------------------------------------------------------------------------------------
+# Futures
+#
+futures = [RMCommandThread.instance.submitCommand(RMCommand("record", False, record, ("future %d" % index, ))) for index in range(10)]
+check("futures", [future.getResult(5) for future in futures], ["future %d" % index for index in range(10)])
+check("futures finished", all(future.isFinished() for future in futures), True)
+
+#-----------------------------------------------------------------------------------------------------------
+# Statistics
+#
+RMCommandThread.instance.executeCommand(RMCommand("sync", True, lambda: None)) # everything before it has finished
+stats = RMCommandThread.instance.getCommandStats()
+print "stats: %s" % ", ".join("%s %d" % (name, stats[name][0]) for name in sorted(stats))
+check("record count", stats["record"][0], 4 + 100 + 1 + 10)
+check("fail count", stats["fail"][0], 1)
+check("batch count", stats["batch"][0], 2)
+check("times", all(waitTime >= 0 and executionTime >= 0 for count, waitTime, executionTime in stats.values()), True)
+
+#-----------------------------------------------------------------------------------------------------------
+# Database commands without USE_COMMAND_THREAD__: the database is opened on this thread
+#
+rmDatabase.USE_COMMAND_THREAD__ = False
+database = RMParsersDatabase(":memory:")
+database.open()
+database.execute("CREATE TABLE value (value INTEGER)")
+
+def insert(value):
+    database.execute("INSERT INTO value VALUES(?)", (value, ))
+    return value
+
+del executed[:]
+results = rmExecuteBatch([RMCommand("insert", False, insert, (1, )), RMCommand("fail", False, fail), RMCommand("insert", False, insert, (2, )),
+                          RMCommand("commit", False, database.commit), RMCommand("reclaimSpace", False, database.reclaimSpace)])
+check("caller thread batch", results, [1, None, 2, None, 0])
+check("caller thread command", rmExecuteCommand(RMCommand("record", True, record, ("command", ))), "command")
+future = rmSubmitCommand(RMCommand("insert", False, insert, (3, )))
+check("caller thread future", (future.isFinished(), future.getResult(0)), (True, 3))
+check("caller thread", executed, [("command", thread.get_ident())])
+check("values", [row[0] for row in database.execute("SELECT value FROM value ORDER BY value")], [1, 2, 3])
+database.close()
+
+RMCommandThread.instance.stop()
+print "FAILED" if failed else "OK"
@@ -0,0 +1,214 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Logging benchmark, each case in its own process with a file log rotated every 500KB:
+#  - records written by the calling thread with the rotated file compressed inside doRollover() against
+#    the writer thread and background gzip:
+#      - throughput of one thread logging as fast as it can, until everything is written
+#      - caller latency of 4 threads logging bursts of 10 messages every 2ms (about 15000 messages/s),
+#        the worst case being the caller that rotates the file
+#  - filtered debug messages (module level above DEBUG): eager % formatting, lazy arguments, isEnabledForModule()
+#  - overflow: a burst into a small queue, the dropped records are counted and reported in the log
+#  - failures: a handler raising in the writer thread and a failed gzip are reported on stderr, the writer
+#    keeps going and the rotated log is kept without a partial archive
+#
+
+import sys, os, gzip, json, shutil, tempfile, logging, StringIO
+sys.path.append('../')
+
+import time
+from threading import Thread
+
+from RMUtilsFramework import rmLogging
+from RMUtilsFramework.rmLogging import RMLogger
+
+threads = 4
+messages = 20000
+burst = 10
+
+def synchronousCompression(self):
+    # CompressingRotatingFileHandler.doRollover before the background compression
+    logging.handlers.RotatingFileHandler.doRollover(self)
+    oldLog = self.baseFilename + ".1"
+    with open(oldLog) as log:
+        with gzip.open(oldLog + '.gz', 'wb') as compressedLog:
+            compressedLog.writelines(log)
+    os.remove(oldLog)
+
+def createLogger(logPath, asynchronous):
+    logger = RMLogger("Benchmark", asynchronous)
+    logger.stdoutHandler.setLevel(logging.CRITICAL + 1)
+    logger.enableFileLogging(os.path.join(logPath, "rainmachine.log"))
+    return logger
+
+def createBenchmarkLogger(logPath, asynchronous):
+    rollovers = []
+    doRollover = synchronousCompression if not asynchronous else RMLogger.CompressingRotatingFileHandler.doRollover
+    def timedRollover(self):
+        startTime = time.time()
+        doRollover(self)
+        rollovers.append(time.time() - startTime)
+    RMLogger.CompressingRotatingFileHandler.doRollover = timedRollover
+    return createLogger(logPath, asynchronous), rollovers
+
+def logMessage(log, index, message):
+    log.info("Worker %d message %d: zone %d watered %.2f seconds, forecast %s" % (index, message, message % 16, message * 1.5, "sunny"))
+
+def throughput(logPath, asynchronous):
+    logger, rollovers = createBenchmarkLogger(logPath, asynchronous)
+    log = logger.logger
+
+    startTime = time.time()
+    for message in xrange(messages):
+        logMessage(log, 0, message)
+    callerTime = time.time() - startTime
+    logger.flush()
+    elapsed = time.time() - startTime
+
+    return {"callerRate": messages / callerTime, "rate": messages / elapsed, "rollovers": len(rollovers), "stats": logger.getStats()}
+
+def latency(logPath, asynchronous):
+    logger, rollovers = createBenchmarkLogger(logPath, asynchronous)
+    log = logger.logger
+
+    latencies = []
+    def worker(index):
+        workerLatencies = []
+        for message in xrange(messages):
+            startTime = time.time()
+            logMessage(log, index, message)
+            workerLatencies.append(time.time() - startTime)
+            if message % burst == burst - 1:
+                time.sleep(0.002)
+        latencies.extend(workerLatencies)
+
+    workers = [Thread(target = worker, args = (index, )) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    logger.flush()
+
+    latencies.sort()
+    return {"p99": latencies[int(len(latencies) * 0.99)] * 1000, "p999": latencies[int(len(latencies) * 0.999)] * 1000,
+            "max": latencies[-1] * 1000, "rollovers": len(rollovers), "rolloverTime": max(rollovers or [0]) * 1000,
+            "stats": logger.getStats()}
+
+def filteredDebug(logPath):
+    logger = createLogger(logPath, True)
+    logger.setModuleDebugLevel("__rm-logging-test", logging.WARNING)
+    log = logger.logger
+    values = range(20)
+    result = {}
+
+    startTime = time.time()
+    for i in xrange(messages):
+        log.debug("Values %s" % `values`)
+    result["eager"] = (time.time() - startTime) * 1e6 / messages
+
+    startTime = time.time()
+    for i in xrange(messages):
+        log.debug("Values %r", values)
+    result["lazy"] = (time.time() - startTime) * 1e6 / messages
+
+    startTime = time.time()
+    for i in xrange(messages):
+        if log.isEnabledForModule("__rm-logging-test", logging.DEBUG):
+            log.debug("Values %r", values)
+    result["guarded"] = (time.time() - startTime) * 1e6 / messages
+    return result
+
+def overflow(logPath):
+    RMLogger.QUEUE_SIZE = 100
+    RMLogger.ROTATE_FILE_SIZE = 10000000 # all the drop reports in one file
+    logger = createLogger(logPath, True)
+    for i in xrange(messages):
+        logger.logger.info("Burst message %d" % i)
+    logger.flush()
+    with open(os.path.join(logPath, "rainmachine.log")) as f:
+        reported = [line for line in f if "log messages dropped" in line]
+    stats = logger.getStats()
+    return {"stats": stats, "reported": sum(int(line.split(" - ")[-1].split()[0]) for line in reported)}
+
+def failures(logPath):
+    logger = createLogger(logPath, True)
+    class FailingHandler(logging.Handler):
+        def emit(self, record):
+            if "fail" in record.getMessage():
+                raise IOError("No space left on device")
+    logger._addHandler(FailingHandler())
+
+    def failingGzip(fileName, mode):
+        open(fileName, mode).close()
+        raise IOError("No space left on device")
+    rmLogging.gzip.open = failingGzip
+
+    sys.stderr = StringIO.StringIO()
+    log = logger.logger
+    for message in ("before", "fail", "after"):
+        log.info(message)
+    logger.flush()
+    fileHandler = logger.queueHandler.targets[-2]
+    fileHandler.doRollover()
+    fileHandler.compressThread.join()
+    errors = sys.stderr.getvalue()
+    sys.stderr = sys.__stderr__
+
+    logFile = os.path.join(logPath, "rainmachine.log")
+    with open(logFile + ".1") as f:
+        lines = f.readlines()
+    return {"written": logger.getStats()["written"], "logged": len(lines), "handlerError": "No space left on device" in errors.split("Cannot compress")[0],
+            "compressError": "Cannot compress log %s.1" % logFile in errors, "partialArchive": os.path.exists(logFile + ".1.gz.tmp")}
+
+def inChild(function, *args):
+    logPath = tempfile.mkdtemp(dir = os.path.dirname(os.path.abspath(__file__))) # not on a tmpfs
+    resultFile = tempfile.mktemp()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            with open(resultFile, "w") as f:
+                json.dump(function(logPath, *args), f)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    shutil.rmtree(logPath)
+    with open(resultFile) as f:
+        result = json.load(f)
+    os.remove(resultFile)
+    return result
+
+failed = False
+for asynchronous in (False, True):
+    name = "writer thread, background gzip" if asynchronous else "synchronous write and gzip"
+    result = inChild(throughput, asynchronous)
+    print "%-32s 1 thread:  caller %6.0f messages/s, written %6.0f messages/s, %d rollovers" % \
+          (name, result["callerRate"], result["rate"], result["rollovers"])
+    if asynchronous:
+        failed = failed or result["stats"]["written"] + result["stats"]["dropped"] != messages
+
+    result = inChild(latency, asynchronous)
+    print "%-32s %d threads: caller latency p99 %.3f ms, p99.9 %.3f ms, max %.2f ms, %d rollovers (longest %.2f ms)" % \
+          ("", threads, result["p99"], result["p999"], result["max"], result["rollovers"], result["rolloverTime"])
+    if asynchronous:
+        stats = result["stats"]
+        print "%-32s %d written, %d dropped, at most %d queued" % ("", stats["written"], stats["dropped"], stats["maxQueued"])
+        failed = failed or stats["written"] + stats["dropped"] != threads * messages
+
+result = inChild(filteredDebug)
+print "filtered debug message: eager %% %.2f us, lazy arguments %.2f us, isEnabledForModule() %.2f us" % \
+      (result["eager"], result["lazy"], result["guarded"])
+
+result = inChild(overflow)
+print "burst of %d messages into a queue of 100: %d written, %d dropped, %d reported as dropped" % \
+      (messages, result["stats"]["written"], result["stats"]["dropped"], result["reported"])
+failed = failed or result["stats"]["written"] + result["stats"]["dropped"] != messages or result["reported"] != result["stats"]["dropped"]
+
+result = inChild(failures)
+print "failures: %d of 3 messages written, %d in the log, handler error reported %s, gzip error reported %s, partial archive left %s" % \
+      (result["written"], result["logged"], result["handlerError"], result["compressError"], result["partialArchive"])
+failed = failed or result["written"] != 2 or result["logged"] != 3 or not result["handlerError"] or not result["compressError"] or result["partialArchive"]
+
+print "FAILED" if failed else "OK"
@@ -6,6 +6,8 @@
 
 import os
 import thread
+import time
+import logging
 from threading import Thread, Event
 from Queue import Queue, Empty
 
@@ -19,15 +21,19 @@ from pprint import pprint
 #
 class RMCommand:
 
-    def __init__(self, name, synch):
+    def __init__(self, name, synch, command = None, args = None, kwargs = None):
         self.name = name
 
-        self.command = None
-        self.args = None
-        self.kwargs = None
+        self.command = command
+        self.args = args
+        self.kwargs = kwargs
 
         self.result = None
 
+        self.queuedTimestamp = None
+        self.startTimestamp = None
+        self.finishTimestamp = None
+
         self.event = None
         if synch:
             self.event = Event()
@@ -41,6 +47,23 @@ class RMCommand:
                 "result=" + `self.result` + \
                 ")"
 
+    def run(self):
+        ### Executes the command on the caller thread, an exception is logged and leaves result None.
+        self.startTimestamp = time.time()
+        try:
+            if self.args is None and self.kwargs is None:
+                self.result = self.command()
+            elif self.kwargs is None:
+                self.result = self.command(*self.args)
+            elif self.args is None:
+                self.result = self.command(**self.kwargs)
+            else:
+                self.result = self.command(*self.args, **self.kwargs)
+        except Exception, e:
+            log.error(self.name)
+            log.exception(e)
+        self.finishTimestamp = time.time()
+
     def wait(self, timeout = None):
         if self.event:
             self.event.wait(timeout)
@@ -49,6 +72,24 @@ class RMCommand:
         if self.event:
             self.event.set()
 
+    def isFinished(self):
+        return self.finishTimestamp is not None
+
+    def getResult(self, timeout = None):
+        ### Future like access for commands submitted with RMCommandThread.submitCommand().
+        self.wait(timeout)
+        return self.result
+
+    def getWaitTime(self):
+        if self.queuedTimestamp is None or self.startTimestamp is None:
+            return None
+        return self.startTimestamp - self.queuedTimestamp
+
+    def getExecutionTime(self):
+        if self.startTimestamp is None or self.finishTimestamp is None:
+            return None
+        return self.finishTimestamp - self.startTimestamp
+
 #----------------------------------------------------------------------------------------
 #
 #
@@ -76,9 +117,11 @@ class RMCommandThread(Thread):
 
         Thread.__init__(self)
 
-        self.waitTimeout = 3600
+        self.waitTimeout = None # A timed Queue.get() polls with sleeps in Python 2 which delays every command
         self.messageQueue = Queue()
 
+        self.commandStats = {} # command name -> [count, queue wait time, execution time]
+
     #----------------------------------------------------------------------------------------
     #
     #
@@ -91,15 +134,53 @@ class RMCommandThread(Thread):
     #
     #
     def executeCommand(self, command):
-        log.debug("Schedule execute command: %s" % `command.name`)
-        log.debug(command)
+        debug = log.isEnabledForModule("rmCommandThread", logging.DEBUG)
+        if debug:
+            log.debug("Schedule execute command: %r", command.name)
+
+        command.queuedTimestamp = time.time()
+        if command.event and self.runsOnThisThread():
+            self.doExecuteCommand(command) # Waiting on the queue would block forever
+            return command.result
+
         self.messageQueue.put(command)
         if command.event:
             command.wait()
-            log.debug(command)
-            log.debug("Command finished %s" % `command.name`)
+            if debug:
+                log.debug("Command finished %r in %.2f ms", command.name, (command.finishTimestamp - command.queuedTimestamp) * 1000)
             return command.result
 
+    def submitCommand(self, command):
+        ### Queues the command without waiting for it, the returned command is used as a future (getResult()).
+        if command.event is None:
+            command.event = Event()
+        command.queuedTimestamp = time.time()
+        self.messageQueue.put(command)
+        return command
+
+    def executeBatch(self, commands, synch = True):
+        ### Executes the commands in order with a single round trip to the command thread. Returns the list of results,
+        ### or if synch is False the batch command to be used as a future.
+        batch = RMCommand("batch", True)
+        batch.command = self.__executeBatch
+        batch.args = (commands, )
+
+        if synch:
+            return self.executeCommand(batch)
+        return self.submitCommand(batch)
+
+    def __executeBatch(self, commands):
+        queuedTimestamp = time.time()
+        for command in commands:
+            if command.queuedTimestamp is None:
+                command.queuedTimestamp = queuedTimestamp
+            self.doExecuteCommand(command)
+        return [command.result for command in commands]
+
+    def getCommandStats(self):
+        ### Returns {name: (count, total queue wait time, total execution time)}.
+        return dict((name, tuple(stats)) for name, stats in self.commandStats.items())
+
     #----------------------------------------------------------------------------------------
     #
     #
@@ -198,18 +279,14 @@ class RMCommandThread(Thread):
         return True
 
     def doExecuteCommand(self, command):
-        log.debug(command.name)
-        try:
-            if command.args is None and command.kwargs is None:
-                command.result = command.command()
-            elif command.kwargs is None:
-                command.result = command.command(*command.args)
-            elif command.args is None:
-                command.result = command.command(**command.kwargs)
-            else:
-                command.result = command.command(*command.args, **command.kwargs)
-        except Exception, e:
-            log.error(command.name)
-            log.error(e)
+        command.run()
+
+        stats = self.commandStats.get(command.name)
+        if stats is None:
+            stats = self.commandStats[command.name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        if command.queuedTimestamp is not None:
+            stats[1] += command.startTimestamp - command.queuedTimestamp
+        stats[2] += command.finishTimestamp - command.startTimestamp
 
         command.notifyFinished()
@@ -0,0 +1,228 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+#
+# Reduces a time series of (timestamp, value) points, ordered by timestamp, to at most threshold points.
+# The points are read once from any iterable (a database cursor) and only a couple of buckets are kept
+# in memory. count is the number of points the iterable will return, the buckets are made of consecutive
+# points, count / threshold of them. Modes:
+#   lttb:   largest triangle three buckets, the point of each bucket that keeps the shape of the line
+#   minmax: the lowest and highest points of each bucket, in timestamp order
+#   min, max: the lowest / highest point of each bucket
+#   mean:   the mean timestamp and value of each bucket
+# Ties are broken by the first point so the same series always gives the same result.
+#
+
+import math
+
+RMDownsampleModes = ("lttb", "minmax", "min", "max", "mean")
+
+def rmDownsample(points, count, threshold, mode = "lttb"):
+    if not mode in RMDownsampleModes:
+        raise ValueError("Unknown downsample mode %s" % `mode`)
+
+    if mode == "lttb":
+        return rmDownsampleLTTB(points, count, threshold)
+    return rmDownsampleBuckets(points, count, threshold, mode)
+
+def rmDownsampleLTTB(points, count, threshold):
+    if threshold >= count:
+        return list(points)
+    if threshold < 3:
+        points = list(points)
+        return [points[0], points[-1]][:max(threshold, 0)]
+
+    buckets = __lttbBuckets(points, count, threshold)
+    first = next(buckets)[0]
+    result = [first]
+
+    selected = first
+    bucket = next(buckets)
+    for nextBucket in buckets:
+        averageTimestamp = math.fsum(point[0] for point in nextBucket) / len(nextBucket)
+        averageValue = math.fsum(point[1] for point in nextBucket) / len(nextBucket)
+
+        maxArea = -1
+        for point in bucket:
+            # Twice the area of the triangle with the previous selected point and the next bucket average
+            area = abs((selected[0] - averageTimestamp) * (point[1] - selected[1]) - (selected[0] - point[0]) * (averageValue - selected[1]))
+            if area > maxArea:
+                maxArea = area
+                candidate = point
+        selected = candidate
+        result.append(selected)
+        bucket = nextBucket
+
+    result.append(bucket[0]) # the last point
+    return result
+
+def rmDownsampleBuckets(points, count, threshold, mode = "minmax"):
+    if mode == "minmax":
+        bucketCount = threshold // 2
+    else:
+        bucketCount = threshold
+
+    if count <= threshold or bucketCount < 1:
+        return list(points)
+
+    result = []
+    for bucket in __buckets(points, count, bucketCount):
+        if mode == "mean":
+            result.append((int(round(math.fsum(point[0] for point in bucket) / len(bucket))), math.fsum(point[1] for point in bucket) / len(bucket)))
+            continue
+
+        low = high = bucket[0]
+        for point in bucket:
+            if point[1] < low[1]:
+                low = point
+            if point[1] > high[1]:
+                high = point
+
+        if mode == "min":
+            result.append(low)
+        elif mode == "max":
+            result.append(high)
+        elif low is high:
+            result.append(low)
+        elif low[0] <= high[0]:
+            result.extend((low, high))
+        else:
+            result.extend((high, low))
+
+    return result
+
+def __buckets(points, count, bucketCount):
+    ### Lists of consecutive points, bucket i has the points with index in [i * count / bucketCount, (i + 1) * count / bucketCount)
+    bucket = []
+    index = 0
+    end = count // bucketCount
+    bucketIndex = 0
+    for point in points:
+        if index >= end and bucket:
+            yield bucket
+            bucket = []
+            bucketIndex += 1
+            end = (bucketIndex + 1) * count // bucketCount
+        bucket.append(point)
+        index += 1
+    if bucket:
+        yield bucket
+
+def __lttbBuckets(points, count, threshold):
+    ### The first point, the threshold - 2 buckets of the points in between and the last point, each as a list.
+    ### Bucket i has the points with index in [1 + i * (count - 2) / (threshold - 2), 1 + (i + 1) * (count - 2) / (threshold - 2))
+    points = iter(points)
+    yield [next(points)]
+
+    bucket = []
+    index = 1
+    bucketIndex = 0
+    end = 1 + (count - 2) // (threshold - 2)
+    for point in points:
+        if index == count - 1:
+            break
+        while index >= end:
+            yield bucket
+            bucket = []
+            bucketIndex += 1
+            end = 1 + (bucketIndex + 1) * (count - 2) // (threshold - 2)
+        bucket.append(point)
+        index += 1
+    else:
+        # Fewer points than count (rows deleted between the count and the query): the last one is in the bucket
+        if not bucket:
+            return
+        point = bucket.pop()
+    yield bucket
+    yield [point]
+
+#-----------------------------------------------------------------------------------------------
+#
+# Main Test Unit
+#
+if __name__ == "__main__":
+    import random, time
+
+    random.seed(1)
+    failed = False
+
+    def lttbReference(data, threshold):
+        # The LTTB reference algorithm on a list, with integer bucket bounds
+        bound = lambda i: 1 + i * (len(data) - 2) // (threshold - 2)
+        result = [data[0]]
+        a = 0
+        for i in range(threshold - 2):
+            start = bound(i + 1)
+            end = min(bound(i + 2), len(data))
+            averageTimestamp = math.fsum(point[0] for point in data[start:end]) / (end - start)
+            averageValue = math.fsum(point[1] for point in data[start:end]) / (end - start)
+
+            maxArea = -1
+            for j in range(bound(i), bound(i + 1)):
+                area = abs((data[a][0] - averageTimestamp) * (data[j][1] - data[a][1]) - (data[a][0] - data[j][0]) * (averageValue - data[a][1]))
+                if area > maxArea:
+                    maxArea = area
+                    nextA = j
+            result.append(data[nextA])
+            a = nextA
+        result.append(data[-1])
+        return result
+
+    def randomSeries():
+        count = random.randint(1, 3000)
+        timestamp = 1420070400
+        value = 20.0
+        data = []
+        for i in range(count):
+            timestamp += random.choice([3600, 3600, 7200])
+            value = round(value + random.gauss(0, 2), random.choice([0, 2])) # rounding makes ties
+            data.append((timestamp, value))
+        return data
+
+    for trial in range(300):
+        data = randomSeries()
+        threshold = random.randint(2, 600)
+
+        for mode in RMDownsampleModes:
+            result = rmDownsample(iter(data), len(data), threshold, mode)
+            if len(result) > max(threshold, 2) and len(data) > threshold:
+                print "%s: %d points for a threshold of %d" % (mode, len(result), threshold)
+                failed = True
+            if result != rmDownsample(list(data), len(data), threshold, mode):
+                print "%s: not deterministic" % mode
+                failed = True
+            if mode != "mean" and not set(result) <= set(data):
+                print "%s: points not in the series" % mode
+                failed = True
+            if result != sorted(result):
+                print "%s: points not in timestamp order" % mode
+                failed = True
+
+        if len(data) > threshold >= 3 and rmDownsampleLTTB(data, len(data), threshold) != lttbReference(data, threshold):
+            print "lttb: different from the reference"
+            failed = True
+
+        # minmax keeps the extrema of the series and of each bucket
+        result = set(rmDownsampleBuckets(data, len(data), threshold, "minmax"))
+        if not min(data, key = lambda point: point[1])[1] in [point[1] for point in result] or \
+           not max(data, key = lambda point: point[1])[1] in [point[1] for point in result]:
+            print "minmax: series extrema lost"
+            failed = True
+        bucketCount = threshold // 2
+        if len(data) > threshold and bucketCount >= 1:
+            for i in range(bucketCount):
+                bucket = data[i * len(data) // bucketCount:(i + 1) * len(data) // bucketCount]
+                if not min(bucket, key = lambda point: point[1]) in result or not max(bucket, key = lambda point: point[1]) in result:
+                    print "minmax: bucket extrema lost"
+                    failed = True
+                    break
+
+    data = [(1420070400 + i * 3600, math.sin(i / 100.0) * 10) for i in range(8760)]
+    for mode in RMDownsampleModes:
+        startTime = time.time()
+        result = rmDownsample(iter(data), len(data), 500, mode)
+        print "%-6s 8760 -> %3d points in %.1f ms" % (mode, len(result), (time.time() - startTime) * 1000)
+
+    print "FAILED" if failed else "OK"
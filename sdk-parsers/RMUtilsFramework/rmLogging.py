@@ -6,29 +6,45 @@
 import logging
 import logging.handlers
 import os
+import sys
 import gzip
 import time
 import shutil
+import atexit
+import Queue
+from threading import Thread, Lock
 
 class RMLogger:
 
     ENABLE_COMPRESSION = True
     ROTATE_FILE_SIZE = 500000
 
-    def __init__(self, name="RainMachine"):
+    # Records are formatted and written by a writer thread. When QUEUE_SIZE records are waiting, new
+    # DEBUG/INFO records are dropped and WARNING and above wait up to OVERFLOW_WAIT seconds for room.
+    ENABLE_ASYNC = True
+    QUEUE_SIZE = 10000
+    OVERFLOW_WAIT = 0.5
+
+    def __init__(self, name="RainMachine", asynchronous=None):
         self._logFileName = None
 
         self.stdoutHandler = logging.StreamHandler()
         self.format = logging.Formatter(fmt='%(asctime)s - %(levelname)-5s - %(module)s:%(lineno)s - %(message)s')
         self.stdoutHandler.setFormatter(self.format)
 
+        self.queueHandler = None
+        if asynchronous or (asynchronous is None and RMLogger.ENABLE_ASYNC):
+            self.queueHandler = RMLogger.RMQueueHandler(RMLogger.QUEUE_SIZE)
+
         self.filter = RMLogger.RMLoggerFilter()
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.DEBUG)
         self.logger.addFilter(self.filter)
-        self.logger.addHandler(self.stdoutHandler)
+        self._addHandler(self.stdoutHandler)
         self.logger.enableFileLogging = self.enableFileLogging
         self.logger.setConsoleLogLevel = self.setConsoleLogLevel
+        self.logger.isEnabledForModule = self.isEnabledForModule
+        self.logger.flush = self.flush
 
     def setGlobalDebugLevel(self, level = logging.DEBUG):
         self.logger.setLevel(level)
@@ -36,6 +52,21 @@ class RMLogger:
     def setModuleDebugLevel(self, name, level = logging.DEBUG):
         self.filter.modulesLevel[name] = level
 
+    def isEnabledForModule(self, name, level):
+        ### Like isEnabledFor() with the module level too, to skip building a record the filter would discard
+        moduleLevel = self.filter.modulesLevel.get(name)
+        return self.logger.isEnabledFor(level) and (moduleLevel is None or level >= moduleLevel)
+
+    def flush(self):
+        ### Waits until the queued records are written
+        if self.queueHandler:
+            self.queueHandler.flush()
+
+    def getStats(self):
+        if self.queueHandler:
+            return dict(self.queueHandler.stats)
+        return None
+
     def enableFileLogging(self, fileName = "log/rainmachine.log"):
         self._logFileName = fileName
         self.__checkAndCreateLogDir()
@@ -47,11 +78,19 @@ class RMLogger:
                 fileHandler = logging.handlers.RotatingFileHandler(fileName, maxBytes=RMLogger.ROTATE_FILE_SIZE, backupCount=1)
 
             fileHandler.setFormatter(self.format)
-            self.logger.addHandler(fileHandler)
+            self._addHandler(fileHandler)
 
         except Exception, e:
             self.logger.error("Cannot enable file logging to %s: %s" % (fileName, e))
 
+    def _addHandler(self, handler):
+        if self.queueHandler:
+            if not self.queueHandler in self.logger.handlers:
+                self.logger.addHandler(self.queueHandler)
+            self.queueHandler.targets.append(handler)
+        else:
+            self.logger.addHandler(handler)
+
     def setConsoleLogLevel(self, level = logging.ERROR):
         self.stdoutHandler.setLevel(logging.ERROR)   # Send only errors to console
 
@@ -79,22 +118,116 @@ class RMLogger:
 
     #----------------------------------------------------------------------------------------
     #
+    # Bounded queue between the logging threads and a writer thread that formats the records
+    # (the message arguments too, so they must not change after the log call) and passes them
+    # to the target handlers.
     #
+    class RMQueueHandler(logging.Handler):
+
+        def __init__(self, size):
+            logging.Handler.__init__(self)
+            self.targets = []
+            self.queue = Queue.Queue(size)
+            self.stats = {"written": 0, "dropped": 0, "maxQueued": 0}
+            self.__reportedDropped = 0
+            self.__pid = None
+            self.__startWriter()
+            atexit.register(self.flush)
+
+        def emit(self, record):
+            if self.__pid != os.getpid(): # the writer thread doesn't survive a fork
+                self.__startWriter()
+
+            if record.exc_info:
+                # The traceback is formatted now, the frames can change before the writer gets the record
+                record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+                record.exc_info = None
+
+            # Handler.handle() holds the handler lock here, the counters don't need another one
+            try:
+                self.queue.put_nowait(record)
+            except Queue.Full:
+                try:
+                    if record.levelno < logging.WARNING:
+                        raise Queue.Full
+                    self.queue.put(record, True, RMLogger.OVERFLOW_WAIT)
+                except Queue.Full:
+                    self.stats["dropped"] += 1
+                    return
+
+            queued = self.queue.qsize()
+            if queued > self.stats["maxQueued"]:
+                self.stats["maxQueued"] = queued
+
+        def flush(self):
+            if self.__pid == os.getpid() and self.writer.isAlive():
+                self.queue.join()
+
+        def __startWriter(self):
+            if self.__pid is not None:
+                # Forked: the records queued by the parent are its own to write
+                self.queue = Queue.Queue(self.queue.maxsize)
+            self.__pid = os.getpid()
+            self.writer = Thread(target = self.__write, name = "RMLogWriter")
+            self.writer.daemon = True
+            self.writer.start()
+
+        def __write(self):
+            while True:
+                record = self.queue.get()
+                try:
+                    self.__handle(record)
+                    self.stats["written"] += 1
+
+                    dropped = self.stats["dropped"]
+                    if dropped != self.__reportedDropped and self.queue.empty():
+                        self.__handle(logging.LogRecord(record.name, logging.WARNING, __file__, 0,
+                                                        "%d log messages dropped, the log queue was full" % (dropped - self.__reportedDropped), None, None))
+                        self.__reportedDropped = dropped
+                except Exception:
+                    self.handleError(record)
+                finally:
+                    self.queue.task_done()
+
+        def __handle(self, record):
+            for handler in self.targets:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    #----------------------------------------------------------------------------------------
+    #
+    # The rotated file is compressed by a background thread, the next rollover waits for it.
     #
     class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
 
         def __init__(self, *args, **kws):
             logging.handlers.RotatingFileHandler.__init__(self, *args, **kws)
+            self.compressThread = None
 
         def doRollover(self):
+            if self.compressThread:
+                self.compressThread.join()
+
             logging.handlers.RotatingFileHandler.doRollover(self)
 
-            oldLog = self.baseFilename + ".1"
-            with open(oldLog) as log:
-                with gzip.open(oldLog + '.gz', 'wb') as compressedLog:
-                    compressedLog.writelines(log)
+            self.compressThread = Thread(target = self.__compress, args = (self.baseFilename + ".1", ), name = "RMLogCompress")
+            self.compressThread.daemon = True
+            self.compressThread.start()
 
-            os.remove(oldLog)
+        def __compress(self, oldLog):
+            try:
+                with open(oldLog) as log:
+                    with gzip.open(oldLog + '.gz.tmp', 'wb') as compressedLog:
+                        compressedLog.writelines(log)
+                os.rename(oldLog + '.gz.tmp', oldLog + '.gz')
+                os.remove(oldLog)
+            except Exception, e:
+                # The uncompressed log is kept for the next rollover, only the partial archive is removed
+                sys.stderr.write("Cannot compress log %s: %s\n" % (oldLog, e))
+                try:
+                    os.remove(oldLog + '.gz.tmp')
+                except OSError:
+                    pass
 
 
 
@@ -104,7 +237,7 @@ class RMLogger:
 class RMLoggerVolatile(RMLogger):
     def __init__(self):
         self._persistentFileName = None
-        RMLogger.__init__(self, name="RainMachineVolatile")
+        RMLogger.__init__(self, name="RainMachineVolatile", asynchronous=False) # truncate() uses its file handler directly
         self.logger.enableFileLogging = self.enableFileLogging
         self.logger.truncate = self.truncate
 
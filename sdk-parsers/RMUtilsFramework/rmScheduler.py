@@ -0,0 +1,151 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import os, time, fcntl, errno, heapq, select
+from collections import deque
+from threading import Lock
+from Queue import Empty
+
+#-----------------------------------------------------------------------------------------------
+#
+# Deadline queue holding one deadline per key (a parser, a retry delay...). Replaced deadlines
+# stay in the heap until they reach the top, the earliest deadline is found in O(log n).
+#
+class RMScheduler:
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__heap = []        # (deadline, sequence, key)
+        self.__deadlines = {}   # key -> (deadline, sequence) of the valid heap entry
+        self.__sequence = 0
+
+    def __len__(self):
+        return len(self.__deadlines)
+
+    def schedule(self, key, deadline):
+        with self.__lock:
+            current = self.__deadlines.get(key)
+            if current is not None and current[0] == deadline:
+                return
+
+            self.__sequence += 1
+            self.__deadlines[key] = (deadline, self.__sequence)
+            heapq.heappush(self.__heap, (deadline, self.__sequence, key))
+
+            if len(self.__heap) > 2 * len(self.__deadlines) + 16:
+                self.__heap = [(deadline, sequence, key) for key, (deadline, sequence) in self.__deadlines.iteritems()]
+                heapq.heapify(self.__heap)
+
+    def cancel(self, key):
+        with self.__lock:
+            self.__deadlines.pop(key, None)
+
+    def getDeadline(self, key):
+        with self.__lock:
+            current = self.__deadlines.get(key)
+            if current is None:
+                return None
+            return current[0]
+
+    def nextDeadline(self):
+        ### Earliest deadline or None when nothing is scheduled
+        with self.__lock:
+            self.__dropReplaced()
+            if self.__heap:
+                return self.__heap[0][0]
+            return None
+
+    def popDue(self, timestamp):
+        ### Removes and returns the keys with deadline <= timestamp, earliest first
+        keys = []
+        with self.__lock:
+            while True:
+                self.__dropReplaced()
+                if not self.__heap or self.__heap[0][0] > timestamp:
+                    break
+                deadline, sequence, key = heapq.heappop(self.__heap)
+                del self.__deadlines[key]
+                keys.append(key)
+        return keys
+
+    def __dropReplaced(self):
+        heap = self.__heap
+        while heap and self.__deadlines.get(heap[0][2]) != heap[0][:2]:
+            heapq.heappop(heap)
+
+#-----------------------------------------------------------------------------------------------
+#
+# Queue.Queue replacement for a single consumer thread that sleeps until a deadline. In Python 2 a
+# get() with timeout polls the queue every 50 ms, here the consumer sleeps in select() on a pipe
+# that put() writes to, so it wakes up only for an item or when the timeout expires.
+#
+class RMWakeupQueue:
+
+    def __init__(self):
+        self.__items = deque()
+        self.__lock = Lock()
+        self.__readFd, self.__writeFd = os.pipe()
+        for fd in (self.__readFd, self.__writeFd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def qsize(self):
+        with self.__lock:
+            return len(self.__items)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def put(self, item, block = True, timeout = None):
+        with self.__lock:
+            self.__items.append(item)
+        try:
+            os.write(self.__writeFd, "x")
+        except OSError, e:
+            if e.errno != errno.EAGAIN: # pipe full, the consumer has a wake up pending anyway
+                raise
+
+    def put_nowait(self, item):
+        self.put(item, False)
+
+    def get(self, block = True, timeout = None):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            with self.__lock:
+                if self.__items:
+                    return self.__items.popleft()
+
+            if not block:
+                raise Empty
+
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Empty
+
+            try:
+                readable = select.select([self.__readFd], [], [], remaining)[0]
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+
+            if readable:
+                try:
+                    os.read(self.__readFd, 4096)
+                except OSError, e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def close(self):
+        os.close(self.__readFd)
+        os.close(self.__writeFd)
@@ -141,6 +141,16 @@ def rmGetStartOfDay(timestamp):
     tuple = datetime.fromtimestamp(timestamp).timetuple()
     return int(datetime(tuple.tm_year, tuple.tm_mon, tuple.tm_mday).strftime("%s"))
 
+def rmGetStartOfWeek(timestamp):
+    ### Start of the ISO week (Monday)
+    d = datetime.fromtimestamp(timestamp).date()
+    d = d - timedelta(days=d.weekday())
+    return rmYMDToTimestamp(d.year, d.month, d.day)
+
+def rmGetStartOfMonth(timestamp):
+    d = datetime.fromtimestamp(timestamp)
+    return rmYMDToTimestamp(d.year, d.month, 1)
+
 def rmGetStartOfDayUtc(timestamp):
     tuple = datetime.utcfromtimestamp(timestamp).timetuple()
     dt = datetime(tuple.tm_year, tuple.tm_mon, tuple.tm_mday, tzinfo=utc)
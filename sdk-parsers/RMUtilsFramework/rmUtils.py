@@ -177,6 +177,22 @@ def convertInchesToMM(value):
 
     return value
 
+def convertToFloat(value):
+    if isinstance(value, list):
+        value = [(v[0], __toFloat(v[1])) for v in value]
+    else:
+        value = __toFloat(value)
+
+    return value
+
+def convertToInt(value):
+    if isinstance(value, list):
+        value = [(v[0], __toInt(v[1])) for v in value]
+    else:
+        value = __toInt(value)
+
+    return value
+
 #Calculate wind to 10 meters from 2 meters (default in RainMachine). This is a precalculated version.
 def convertWindFrom2mTo10m(wind2):
     try:
@@ -219,6 +235,18 @@ def __inchesToMM(inches):
         log.debug("Can't convert inches to mm !")
         return None
 
+def __toFloat(value):
+    try:
+        return float(value)
+    except:
+        return None
+
+def __toInt(value):
+    try:
+        return int(value)
+    except:
+        return None
+
 
 #Calculate wind from N meters to 2 meters (same as inside formula.py)
 def __windFromNmTo2m(windN, height):
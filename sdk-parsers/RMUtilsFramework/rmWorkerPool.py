@@ -0,0 +1,102 @@
+# Copyright (c) 2014 RainMachine, Green Electronics LLC
+# All rights reserved.
+# Authors: Nicu Pavel <npavel@mini-box.com>
+#          Codrin Juravle <codrin.juravle@mini-box.com>
+
+
+import time
+from threading import Thread, Lock, current_thread
+from Queue import Queue
+
+from RMUtilsFramework.rmLogging import log
+from RMUtilsFramework.rmCommandThread import RMCommand
+
+#----------------------------------------------------------------------------------------
+#
+# Bounded pool of worker threads executing RMCommands. Commands that exceed their
+# deadline are abandoned: the caller stops waiting for them and the worker that runs
+# them is replaced so the pool capacity is preserved.
+#
+class RMWorkerPool:
+
+    def __init__(self, name, maxWorkers):
+        self.name = name
+        self.maxWorkers = max(1, maxWorkers)
+
+        self.__queue = Queue()
+        self.__lock = Lock()
+        self.__workers = []
+        self.__workerIndex = 0
+
+    #----------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def submit(self, command):
+        command.startTimestamp = None
+        command.finishTimestamp = None
+        command.worker = None
+        command.abandoned = False
+
+        self.__startWorkers()
+        self.__queue.put(command)
+        return command
+
+    def waitForCommand(self, command, timeout):
+        ### Returns True if the command finished in less than timeout seconds since it started running.
+        while not command.event.isSet():
+            startTimestamp = command.startTimestamp
+            if startTimestamp is None:
+                command.wait(timeout) # Still queued, wait for a free worker.
+                continue
+
+            remaining = startTimestamp + timeout - time.time()
+            if remaining <= 0:
+                self.__abandon(command)
+                return False
+            command.wait(remaining)
+        return True
+
+    def stop(self):
+        with self.__lock:
+            workers = self.__workers
+            self.__workers = []
+
+        for worker in workers:
+            self.__queue.put(RMCommand("shutdown", False))
+
+    #----------------------------------------------------------------------------------------
+    #
+    #
+    #
+    def __startWorkers(self):
+        with self.__lock:
+            while len(self.__workers) < self.maxWorkers:
+                self.__workerIndex += 1
+                worker = Thread(target=self.__workerLoop, name="%s-%d" % (self.name, self.__workerIndex))
+                worker.daemon = True
+                self.__workers.append(worker)
+                worker.start()
+
+    def __abandon(self, command):
+        log.warning("Worker pool '%s': abandoning command %s after deadline" % (self.name, `command.name`))
+        with self.__lock:
+            command.abandoned = True
+            if command.worker in self.__workers:
+                self.__workers.remove(command.worker)
+        self.__startWorkers()
+
+    def __workerLoop(self):
+        while True:
+            command = self.__queue.get()
+            if command.name == "shutdown":
+                break
+
+            with self.__lock:
+                command.worker = current_thread()
+
+            command.run()
+            command.notifyFinished()
+
+            if command.abandoned:
+                break # A replacement worker has already been started.
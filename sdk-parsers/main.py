@@ -59,7 +59,7 @@ globalSettings.firstRun = not os.path.isfile(os.path.join(globalSettings.databas
 ##------------------------------------------------------------------------
 ## Global Database Descriptors
 ##
-globalDbManager.initialize(globalSettings.databasePath)
+globalDbManager.initialize(globalSettings.databasePath, globalSettings.databaseWALMode)
 
 ##------------------------------------------------------------------------
 